@@ -1,23 +1,58 @@
+import asyncio
+import hmac
+import importlib.util
 import math
 import os
-import pickle
+import queue
+import sys
+import threading
 import time
-import tracemalloc
 from collections import deque
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Optional
 
 import numpy as np
 import structlog
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+# Shared ml/ package: next to this file in the Space image (the Dockerfile
+# copies or fetches it), two levels up in a repo checkout.
+_HERE = Path(__file__).resolve().parent
+for _root in (_HERE, _HERE.parent.parent):
+    if (_root / "ml" / "__init__.py").exists():
+        sys.path.insert(0, str(_root))
+        break
+else:
+    if importlib.util.find_spec("ml") is None:
+        raise ImportError(
+            "apps/api-hf needs the repo's ml/ package: build the image from apps/api-hf/Dockerfile "
+            "(it fetches ml/) or run `make hf-vendor` before starting the app outside the repo"
+        )
+
+from ml.data.parser import parse_patch
+from ml.heuristics import file_features
+from ml.memory import MemoryProfiler, memory_stats
+from ml.streaming import StreamEncoder, negotiate_stream_format
+from ml.telemetry import BATCH_SIZE_BUCKETS, get_telemetry
+
 logger = structlog.get_logger()
+_telemetry = get_telemetry()
+# tracemalloc runs only inside windows opened via POST /admin/memory/trace
+_memory = MemoryProfiler()
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    _start_model_loading()
+    yield
 
-tracemalloc.start()
 
-app = FastAPI(title="CodeLens API", version="2.0.0")
+app = FastAPI(title="CodeLens API", version="2.0.0", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,62 +62,176 @@ app.add_middleware(
 )
 
 # ── Latency tracking ──────────────────────────────────────────────────────────
+# Every request lands in a per-route histogram; the global p50/p95/p99 on
+# /metrics only sample model endpoints so probes don't drag them down.
+_PROBE_PATHS = {"/health", "/ready", "/metrics", "/metrics/prometheus"}
 _latency_ms: deque = deque(maxlen=1000)
 _request_count: int = 0
+_stats_lock = threading.Lock()
+
+
+def _record_request(endpoint: str, status: int, start: float) -> None:
+    global _request_count
+    elapsed = (time.perf_counter() - start) * 1000
+    _telemetry.observe("request_latency_ms", elapsed, help="End-to-end request latency in milliseconds.",
+                       endpoint=endpoint)
+    _telemetry.inc("requests_total", help="Requests served, by route and status code.",
+                   endpoint=endpoint, status=status)
+    with _stats_lock:
+        _request_count += 1
+        if endpoint not in _PROBE_PATHS:
+            _latency_ms.append(elapsed)
+
+
+@app.middleware("http")
+async def _track_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    before = _memory.begin_request(request.url.path)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        _record_request(endpoint, status, start)
+        _memory.end_request(before, endpoint)
 
 
-# ── CodeBERT embedder ─────────────────────────────────────────────────────────
+# ── Model loading (background, concurrent) ────────────────────────────────────
+# CodeBERT, the reranker and the FAISS index load on their own threads once the
+# app starts, so the port opens immediately and Spaces health checks pass.
+# Until a component is ready, endpoints serve the heuristic path for it;
+# GET /ready reports per-component state and load time.
 _embedder = None
-try:
+_reranker_model = None
+_faiss_index = None
+_faiss_metadata = None
+
+_components: dict[str, dict] = {
+    name: {"state": "pending", "load_s": None} for name in ("codebert", "reranker", "faiss")
+}
+_components_lock = threading.Lock()
+
+# Both models are RoBERTa BPE; once both tokenizers are loaded and pass the
+# vocabulary check, the reranker reuses CodeBERT's SharedTokenizer, so each
+# file text is tokenized once (ids cached by content hash) for both models.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "50000"))
+_tokenizers: dict = {}
+_tokenizer_status: dict = {"shared": False, "reason": "waiting for both tokenizers"}
+_tokenizers_lock = threading.Lock()
+
+
+def _register_tokenizer(name: str, tokenizer):
+    """Wrap ``tokenizer`` for ``name``; returns the SharedTokenizer that model should use."""
+    from ml.models.tokenization import SharedTokenizer, VocabularyMismatchError, check_vocab_compatible
+
+    with _tokenizers_lock:
+        _tokenizers[name] = SharedTokenizer(tokenizer, cache_size=TOKEN_CACHE_SIZE)
+        if "codebert" in _tokenizers and "reranker" in _tokenizers:
+            try:
+                check_vocab_compatible(_tokenizers["codebert"].tokenizer, _tokenizers["reranker"].tokenizer)
+            except VocabularyMismatchError as e:
+                _tokenizer_status.update(shared=False, reason=str(e))
+                logger.warning("Reranker vocabulary differs from CodeBERT; tokenizing separately", error=str(e))
+            else:
+                _tokenizers["reranker"] = _tokenizers["codebert"]
+                _tokenizer_status.update(shared=True, reason=None)
+                logger.info("CodeBERT and reranker share one tokenizer")
+        return _tokenizers[name]
+
+
+def _tokenizer_for(name: str):
+    # Re-read per batch: the reranker switches to the shared instance once CodeBERT loads
+    return _tokenizers[name]
+
+
+def _load_codebert() -> None:
+    global _embedder
     from transformers import AutoModel, AutoTokenizer
-    import torch
 
-    _tokenizer = AutoTokenizer.from_pretrained(
+    _register_tokenizer("codebert", AutoTokenizer.from_pretrained(
         "microsoft/codebert-base", cache_dir="/tmp/hf-cache"
-    )
-    _model = AutoModel.from_pretrained(
+    ))
+    model = AutoModel.from_pretrained(
         "microsoft/codebert-base", cache_dir="/tmp/hf-cache"
     )
-    _model.eval()
-    _embedder = (_tokenizer, _model)
+    model.eval()
+    _embedder = model
     logger.info("CodeBERT loaded successfully")
-except Exception as e:
-    logger.warning("CodeBERT not loaded (using heuristics)", error=str(e))
 
 
-# ── Fine-tuned reranker ───────────────────────────────────────────────────────
-_reranker_tokenizer = None
-_reranker_model = None
+# RERANKER_BACKEND: auto (INT8 ONNX if RERANKER_ONNX_PATH exists, else torch),
+# onnxruntime or torch. ORT_* env vars tune the onnxruntime session.
+def _load_reranker() -> None:
+    global _reranker_model
+    from transformers import AutoTokenizer
+    from ml.models.backends import OrtSessionConfig, load_backend
 
-try:
-    from transformers import AutoModelForSequenceClassification, AutoTokenizer
-    import torch
-
-    _reranker_tokenizer = AutoTokenizer.from_pretrained(
+    _register_tokenizer("reranker", AutoTokenizer.from_pretrained(
         "ritunjaym/prism-reranker", cache_dir="/tmp/hf-cache"
+    ))
+    # Published last: endpoints treat a non-None model as "reranker ready"
+    _reranker_model = load_backend(
+        os.environ.get("RERANKER_BACKEND", "auto"),
+        model_name_or_path="ritunjaym/prism-reranker",
+        onnx_path=os.environ.get("RERANKER_ONNX_PATH", str(_HERE / "reranker_onnx" / "model_int8.onnx")),
+        session_config=OrtSessionConfig.from_env(),
+        cache_dir="/tmp/hf-cache",
     )
-    _reranker_model = AutoModelForSequenceClassification.from_pretrained(
-        "ritunjaym/prism-reranker", cache_dir="/tmp/hf-cache"
-    )
-    _reranker_model.eval()
-    logger.info("Reranker model loaded successfully")
-except Exception as e:
-    logger.warning("Reranker not loaded (using heuristics)", error=str(e))
+    logger.info("Reranker model loaded successfully", backend=_reranker_model.name)
 
 
-# ── FAISS index ───────────────────────────────────────────────────────────────
-_faiss_index = None
-_faiss_metadata = None
-
-try:
+def _load_faiss() -> None:
+    global _faiss_index, _faiss_metadata
     import faiss
 
-    _faiss_index = faiss.read_index("hunk_index.faiss")
-    with open("hunk_index.faiss.meta", "rb") as _f:
-        _faiss_metadata = pickle.load(_f)
+    from ml.models.index import load_metadata
+
+    index = faiss.read_index(str(_HERE / "hunk_index.faiss"))
+    # Columnar + mmap'd (hunk_index.faiss.cols/); rows are decoded per hit
+    _faiss_metadata = load_metadata(_HERE / "hunk_index.faiss")
+    _faiss_index = index
     logger.info("FAISS index loaded", vectors=_faiss_index.ntotal, metadata_entries=len(_faiss_metadata))
-except Exception as e:
-    logger.warning("FAISS index not loaded", error=str(e))
+
+
+_LOADERS: dict[str, Callable[[], None]] = {
+    "codebert": _load_codebert,
+    "reranker": _load_reranker,
+    "faiss": _load_faiss,
+}
+
+
+def _load_component(name: str) -> None:
+    with _components_lock:
+        _components[name]["state"] = "loading"
+    t0 = time.time()
+    try:
+        _LOADERS[name]()
+        state, error = "ready", None
+    except Exception as e:
+        state, error = "failed", str(e)
+        logger.warning("Component not loaded (using heuristics)", component=name, error=error)
+    load_s = round(time.time() - t0, 3)
+    _telemetry.set_gauge("model_load_seconds", load_s, help="Wall time spent loading each model component.",
+                         component=name, state=state)
+    with _components_lock:
+        _components[name].update(state=state, load_s=load_s)
+        if error:
+            _components[name]["error"] = error
+
+
+def _start_model_loading() -> None:
+    for name in _LOADERS:
+        threading.Thread(target=_load_component, args=(name,), name=f"load-{name}", daemon=True).start()
+
+
+def _loading_status() -> dict:
+    with _components_lock:
+        components = {name: dict(c) for name, c in _components.items()}
+    settled = all(c["state"] in ("ready", "failed") for c in components.values())
+    return {"ready": settled, "components": components}
 
 
 # ── Cluster auto-labeling helpers ─────────────────────────────────────────────
@@ -145,120 +294,396 @@ class RetrieveRequest(BaseModel):
     k: int = 10
 
 
+class AnalyzeRequest(BaseModel):
+    pr_id: str
+    repo: str
+    files: list[FileInput]
+    k: int = 5
+
+
 class HunkRankRequest(BaseModel):
     filename: str
     patch: str
 
 
+class HunkBatchRequest(BaseModel):
+    pr_id: str
+    files: list[FileInput]
+
+
 # ── Heuristic importance scoring ──────────────────────────────────────────────
-def _path_score(filename: str) -> float:
-    high = ["src/", "lib/", "core/", "app/", "api/", "auth", "crypto",
-            "secret", "token", "password", "security"]
-    low = ["docs/", ".md", ".txt", ".github/", "LICENSE", "CHANGELOG"]
-    f = filename.lower()
-    if any(p in f for p in high):
-        return 0.9
-    if any(f.endswith(p.replace("*", "")) or p in f for p in low):
-        return 0.2
-    return 0.5
+def _embed_scores(files: list[FileInput], embeddings: Optional[np.ndarray] = None) -> np.ndarray:
+    """sigmoid(mean(embedding)) per file from one batched CodeBERT pass; -1 where unavailable."""
+    emb = embeddings
+    if emb is None:
+        if _embedder is None or not files:
+            return np.full(len(files), -1.0)
+        try:
+            emb = _codebert_embed([_file_text(f.filename, f.patch or "") for f in files])
+        except Exception:
+            return np.full(len(files), -1.0)
+    # Row-wise float32 means, exactly as the per-file scorer computed them
+    means = np.array([float(row.mean()) for row in emb])
+    return 1.0 / (1.0 + np.exp(-means))
+
+
+def score_files(
+    files: list[FileInput],
+    total_changes: int,
+    embeddings: Optional[np.ndarray] = None,
+    embed: bool = True,
+) -> list[dict]:
+    """Heuristic (+ CodeBERT) scores for all files at once: features as arrays, one forward pass.
+
+    Pass ``embeddings`` (rows aligned with ``files``) to reuse an existing encoding,
+    or ``embed=False`` for the path/size/keyword features alone (no model call).
+    """
+    if not files:
+        return []
+    features = file_features(
+        [f.filename for f in files], [f.additions for f in files], [f.deletions for f in files], total_changes
+    )
+    path, size, sec, raw = features["path"], features["size"], features["security"], features["score"]
 
+    emb = _embed_scores(files, embeddings) if embed else np.full(len(files), -1.0)
+    has_emb = emb >= 0
+    raw = np.where(has_emb, 0.6 * raw + 0.4 * emb, raw)
+    scores = np.clip(raw, 0.0, 1.0)
 
-def _size_score(additions: int, deletions: int, total: int) -> float:
-    if total == 0:
-        return 0.5
-    ratio = (additions + deletions) / max(total, 1)
-    return 1 / (1 + math.exp(-5 * (ratio - 0.3)))
+    results = []
+    for i, f in enumerate(files):
+        score = float(scores[i])
+        reasons = []
+        if sec[i] > 0:
+            reasons.append("security-sensitive path")
+        if size[i] > 0.7:
+            reasons.append("large change")
+        if path[i] > 0.7:
+            reasons.append("core source file")
+        if has_emb[i]:
+            reasons.append("CodeBERT scored")
+        if not reasons:
+            reasons.append("standard change")
 
+        results.append({
+            "filename": f.filename,
+            "reranker_score": round(score, 4),
+            "retrieval_score": round(score * 0.9, 4),
+            "final_score": round(score, 4),
+            "label": _score_label(score),
+            "explanation": ", ".join(reasons).capitalize(),
+        })
+    return results
 
-def _security_score(filename: str) -> float:
-    keywords = ["auth", "crypto", "secret", "token", "password",
-                "security", "permission", "oauth", "jwt", "key"]
-    return 1.0 if any(k in filename.lower() for k in keywords) else 0.0
 
+def score_file(f: FileInput, total_changes: int) -> dict:
+    return score_files([f], total_changes)[0]
+
+
+# ── Cross-request micro-batching ───────────────────────────────────────────────
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "64"))
+
+
+class _MicroBatcher:
+    """Coalesce reranker inputs from concurrent requests into one forward pass.
+
+    ``submit`` returns a Future at once; a single daemon thread drains the
+    queue: it waits up to ``max_wait_ms`` after the oldest pending request (or
+    until ``max_batch_size`` texts are collected), runs ``forward`` once on the
+    concatenated texts and resolves each caller's Future with only its own
+    slice. Async handlers await the Future without holding an inference
+    worker, so a batch can collect from every admitted request. A request
+    larger than ``max_batch_size`` runs as a batch of its own.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[[list[str]], list[float]],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+    ):
+        self._forward = forward
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self.batch_size_hist = _telemetry.histogram(
+            "batch_size", BATCH_SIZE_BUCKETS, help="Texts per model forward pass.", model="reranker"
+        )
+        self.requests_per_batch_hist = _telemetry.histogram(
+            "reranker_requests_per_batch", [1, 2, 4, 8, 16, 32], help="Requests coalesced into one reranker batch."
+        )
+        self.wait_ms_hist = _telemetry.histogram(
+            "reranker_batch_wait_ms", [0.5, 1, 2, 5, 10, 20, 50, 100, 250],
+            help="Time a reranker request waited for its batch to dispatch.",
+        )
+
+    def submit(self, texts: list[str]) -> Future:
+        """Queue ``texts`` for the next batch; the Future resolves to one logit per text."""
+        fut: Future = Future()
+        if not texts:
+            fut.set_result([])
+            return fut
+        self._ensure_started()
+        self._queue.put((texts, fut, time.perf_counter()))
+        return fut
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="reranker-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            pending = [first]
+            size = len(first[0])
+            deadline = first[2] + self.max_wait_s
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._dispatch(pending)
+
+    def _dispatch(self, pending: list) -> None:
+        started = time.perf_counter()
+        for _, _, enqueued in pending:
+            self.wait_ms_hist.observe((started - enqueued) * 1000)
+        self.batch_size_hist.observe(sum(len(texts) for texts, _, _ in pending))
+        self.requests_per_batch_hist.observe(len(pending))
+
+        texts = [t for item_texts, _, _ in pending for t in item_texts]
+        try:
+            logits = self._forward(texts)
+        except Exception as e:
+            for _, fut, _ in pending:
+                fut.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, fut, _ in pending:
+            fut.set_result(logits[offset : offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "queue_depth": self._queue.qsize(),
+            "batch_size": self.batch_size_hist.snapshot(),
+            "requests_per_batch": self.requests_per_batch_hist.snapshot(),
+            "wait_ms": self.wait_ms_hist.snapshot(),
+        }
 
-def _test_penalty(filename: str) -> float:
-    keywords = ["test", "spec", "__tests__", ".test.", ".spec."]
-    return 0.7 if any(k in filename.lower() for k in keywords) else 1.0
 
+def _reranker_logits(texts: list[str]) -> list[float]:
+    """One padded reranker forward pass over ``texts`` → raw logits."""
+    with _telemetry.timer("tokenize", model="reranker"):
+        enc = _tokenizer_for("reranker")(texts, max_length=128, return_tensors="np")
+    with _telemetry.timer("forward", model="reranker"):
+        return _reranker_model(dict(enc)).tolist()
 
-def _config_penalty(filename: str, additions: int, deletions: int) -> float:
-    exts = [".json", ".yaml", ".yml", ".toml", ".lock", ".env"]
-    if any(filename.endswith(e) for e in exts) and (additions + deletions) < 50:
-        return 0.5
-    return 1.0
 
+_reranker_batcher = _MicroBatcher(_reranker_logits)
 
-def _embed_score(filename: str, patch: str) -> float:
-    if _embedder is None:
-        return -1.0
+
+def _minmax_normalize(logits: list[float]) -> list[float]:
+    lo, hi = min(logits), max(logits)
+    if hi - lo < 1e-6:
+        return [0.5] * len(logits)
+    return [(l - lo) / (hi - lo) for l in logits]
+
+
+# ── Bounded inference executor ────────────────────────────────────────────────
+# Model work runs on INFERENCE_WORKERS threads behind an admission queue of
+# INFERENCE_QUEUE_SIZE; beyond that requests get 429 + Retry-After instead of
+# piling onto the CPU. Requests that wait longer than INFERENCE_QUEUE_TIMEOUT_S
+# are shed with 503 when a worker finally picks them up.
+INFERENCE_WORKERS = max(1, int(os.environ.get("INFERENCE_WORKERS", "4")))
+INFERENCE_QUEUE_SIZE = max(0, int(os.environ.get("INFERENCE_QUEUE_SIZE", "32")))
+INFERENCE_QUEUE_TIMEOUT_S = float(os.environ.get("INFERENCE_QUEUE_TIMEOUT_S", "10"))
+INFERENCE_RETRY_AFTER_S = int(os.environ.get("INFERENCE_RETRY_AFTER_S", "1"))
+
+# torch's intra-op pool is process-wide, and every reranker pass runs one at a
+# time on the micro-batcher's thread, so it keeps all cores by default.
+# TORCH_NUM_THREADS caps it (e.g. when CodeBERT passes on several workers contend).
+if os.environ.get("TORCH_NUM_THREADS"):
     try:
-        tokenizer, model = _embedder
         import torch
 
-        text = f"<file>{filename}</file><diff>{(patch or '')[:512]}</diff>"
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=128)
-        with torch.no_grad():
-            out = model(**inputs)
-        emb = out.last_hidden_state.mean(dim=1).squeeze()
-        norm = emb / (emb.norm() + 1e-8)
-        return float(torch.sigmoid(norm.mean()).item())
-    except Exception:
-        return -1.0
+        torch.set_num_threads(max(1, int(os.environ["TORCH_NUM_THREADS"])))
+    except ImportError:
+        pass
+
+
+class _Overloaded(Exception):
+    def __init__(self, status_code: int, code: str, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.code = code
+        self.reason = reason
+
+
+class _InferenceExecutor:
+    """Fixed worker threads + bounded admission; rejects instead of queueing unboundedly."""
+
+    def __init__(self, workers: int, max_queue: int, queue_timeout_s: float):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._batched = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_ms_hist = _telemetry.histogram(
+            "inference_queue_wait_ms", [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+            help="Time a request waited for an inference worker.",
+        )
+
+    def submit(self, fn: Callable, *args) -> Future:
+        self._acquire_slot()
+        with self._lock:
+            self._queued += 1
+        try:
+            fut = self._pool.submit(self._run, fn, args, time.perf_counter())
+        except RuntimeError:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            raise _Overloaded(503, "UNAVAILABLE", "inference executor stopped")
+        fut.add_done_callback(self._release)
+        return fut
+
+    def admit(self, submit: Callable[..., Future], *args) -> Future:
+        """Hold an admission slot for work queued elsewhere (the micro-batcher) without a worker."""
+        self._acquire_slot()
+        with self._lock:
+            self._batched += 1
+        try:
+            fut = submit(*args)
+        except BaseException:
+            self._release_batched(None)
+            raise
+        fut.add_done_callback(self._release_batched)
+        return fut
+
+    def _acquire_slot(self) -> None:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise _Overloaded(429, "OVERLOADED", "inference queue full")
+
+    def _run(self, fn: Callable, args: tuple, enqueued: float):
+        waited = time.perf_counter() - enqueued
+        self.wait_ms_hist.observe(waited * 1000)
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        if self.queue_timeout_s > 0 and waited > self.queue_timeout_s:
+            with self._lock:
+                self._running -= 1
+                self.timed_out += 1
+            raise _Overloaded(503, "QUEUE_TIMEOUT", "request waited too long for an inference worker")
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+
+    def _release_batched(self, fut: Optional[Future]) -> None:
+        with self._lock:
+            self._batched -= 1
+        self._slots.release()
+
+    def _release(self, fut: Future) -> None:
+        # Also runs for futures cancelled while still queued (client went away)
+        if fut.cancelled():
+            with self._lock:
+                self._queued -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "batching": self._batched,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_ms": self.wait_ms_hist.snapshot(),
+            }
 
 
-def score_file(f: FileInput, total_changes: int) -> dict:
-    path = _path_score(f.filename)
-    size = _size_score(f.additions, f.deletions, total_changes)
-    sec = _security_score(f.filename)
-    raw = 0.3 * path + 0.3 * size + 0.4 * sec
-    raw *= _test_penalty(f.filename)
-    raw *= _config_penalty(f.filename, f.additions, f.deletions)
-
-    emb = _embed_score(f.filename, f.patch or "")
-    if emb >= 0:
-        raw = 0.6 * raw + 0.4 * emb
-
-    score = min(max(raw, 0.0), 1.0)
-
-    reasons = []
-    if sec > 0:
-        reasons.append("security-sensitive path")
-    if size > 0.7:
-        reasons.append("large change")
-    if path > 0.7:
-        reasons.append("core source file")
-    if emb >= 0:
-        reasons.append("CodeBERT scored")
-    if not reasons:
-        reasons.append("standard change")
+_inference = _InferenceExecutor(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_QUEUE_TIMEOUT_S)
+
+
+def _overloaded_response(endpoint: str, e: _Overloaded) -> JSONResponse:
+    logger.warning("inference request shed", endpoint=endpoint, status=e.status_code, reason=e.reason)
+    return JSONResponse(
+        status_code=e.status_code,
+        headers={"Retry-After": str(INFERENCE_RETRY_AFTER_S)},
+        content={"error": e.reason, "code": e.code},
+    )
+
+
+def _json_response(endpoint: str, result) -> Response:
+    if isinstance(result, Response):
+        return result
+    with _telemetry.timer("serialize", endpoint=endpoint):
+        return JSONResponse(content=jsonable_encoder(result))
 
-    return {
-        "filename": f.filename,
-        "reranker_score": round(score, 4),
-        "retrieval_score": round(score * 0.9, 4),
-        "final_score": round(score, 4),
-        "label": _score_label(score),
-        "explanation": ", ".join(reasons).capitalize(),
-    }
+
+async def _run_inference(endpoint: str, fn: Callable, *args):
+    """Run a model-bound handler on the inference executor; 429/503 when saturated."""
+    try:
+        result = await asyncio.wrap_future(_inference.submit(fn, *args))
+    except _Overloaded as e:
+        return _overloaded_response(endpoint, e)
+    return _json_response(endpoint, result)
 
 
 # ── Reranker scoring ──────────────────────────────────────────────────────────
+def _reranker_texts(files: list[FileInput]) -> list[str]:
+    return [_file_text(f.filename, f.patch) for f in files]
+
+
+def _reranker_file_logits(files: list[FileInput]) -> list[float]:
+    # Blocking form for handlers already on an inference worker (/analyze);
+    # batched with concurrent requests, normalization stays per request.
+    return _reranker_batcher.submit(_reranker_texts(files)).result()
+
+
 def _reranker_rank_files(files: list[FileInput]) -> list[dict]:
-    import torch
+    return _reranker_results(files, _reranker_file_logits(files))
 
-    texts = [f"<file>{f.filename}\n{(f.patch or '')[:512]}" for f in files]
-    enc = _reranker_tokenizer(
-        texts, padding=True, truncation=True, max_length=128, return_tensors="pt"
-    )
-    with torch.no_grad():
-        out = _reranker_model(**enc)
-        logits = out.logits.squeeze(-1)
 
-    lo, hi = logits.min().item(), logits.max().item()
-    if hi - lo < 1e-6:
-        scores = [0.5] * len(files)
-    else:
-        scores = [(l - lo) / (hi - lo) for l in logits.tolist()]
+def _reranker_results(files: list[FileInput], logits: list[float]) -> list[dict]:
+    scores = _minmax_normalize(logits)
 
     results = []
     for f, score in zip(files, scores):
@@ -289,230 +714,443 @@ def _score_label(score: float) -> str:
     return "Low"
 
 
-# ── FAISS query embedding ─────────────────────────────────────────────────────
-def _embed_query(text: str) -> np.ndarray:
-    """Embed a query string with CodeBERT → (1, 768) float32, L2-normalized."""
-    if _embedder is None:
-        raise RuntimeError("CodeBERT embedder not available")
+# ── CodeBERT embeddings (content-addressed cache) ────────────────────────────
+# EMBEDDING_CACHE_SIZE / EMBEDDING_CACHE_PATH size the LRU and optional SQLite tier.
+_EMBED_MODEL_ID = "microsoft/codebert-base"
+_EMBED_TRUNCATION = "chars=512,max_length=128"
+
+try:
+    from ml.models.embedding_cache import EmbeddingCache, get_embedding_cache
+
+    _embedding_cache = get_embedding_cache()
+except Exception as e:
+    _embedding_cache = None
+    logger.warning("Embedding cache disabled", error=str(e))
+
+
+def _file_text(filename: str, patch: Optional[str]) -> str:
+    """Per-file model input shared by CodeBERT and the reranker (the reranker's training format)."""
+    return f"<file>{filename}\n{(patch or '')[:512]}"
+
+
+def _codebert_forward(texts: list[str]) -> np.ndarray:
+    """One padded CodeBERT pass → masked-mean-pooled, L2-normalized (N, 768)."""
     import torch
 
-    tokenizer, model = _embedder
-    inputs = tokenizer(
-        text[:512], return_tensors="pt", truncation=True, max_length=128
-    )
-    with torch.no_grad():
-        out = model(**inputs)
-    emb = out.last_hidden_state.mean(dim=1)  # (1, 768)
+    _telemetry.observe("batch_size", len(texts), BATCH_SIZE_BUCKETS, model="codebert")
+    with _telemetry.timer("tokenize", model="codebert"):
+        inputs = _tokenizer_for("codebert")(texts, max_length=128, return_tensors="pt")
+    with _telemetry.timer("forward", model="codebert"), torch.no_grad():
+        out = _embedder(**inputs)
+    mask = inputs["attention_mask"].unsqueeze(-1).float()
+    emb = (out.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
     emb = emb / (emb.norm(dim=1, keepdim=True) + 1e-8)
     return emb.numpy().astype(np.float32)
 
 
+def _codebert_embed(texts: list[str]) -> np.ndarray:
+    """Embed ``texts`` with CodeBERT, running the model only on cache misses."""
+    if _embedder is None:
+        raise RuntimeError("CodeBERT embedder not available")
+    if _embedding_cache is None:
+        return _codebert_forward(texts)
+
+    keys = [EmbeddingCache.make_key(_EMBED_MODEL_ID, _EMBED_TRUNCATION, t) for t in texts]
+    cached = _embedding_cache.get_many(keys)
+    missing = [i for i, vec in enumerate(cached) if vec is None]
+    if missing:
+        fresh = _codebert_forward([texts[i] for i in missing])
+        _embedding_cache.put_many([keys[i] for i in missing], fresh)
+        for i, vec in zip(missing, fresh):
+            cached[i] = vec
+    return np.vstack(cached).astype(np.float32)
+
+
+def _embed_query(text: str) -> np.ndarray:
+    """Embed a query string with CodeBERT → (1, 768) float32, L2-normalized."""
+    return _codebert_embed([text[:512]])
+
+
 # ── Endpoints ─────────────────────────────────────────────────────────────────
 @app.get("/health")
 def health():
-    global _request_count
-    start = time.time()
-    try:
-        result = {
-            "status": "ok",
-            "version": "2.0.0",
-            "codebert": _embedder is not None,
-            "reranker": _reranker_model is not None,
-            "faiss_loaded": _faiss_index is not None,
-        }
-        return result
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
+    return {
+        "status": "ok",
+        "version": "2.0.0",
+        "codebert": _embedder is not None,
+        "reranker": _reranker_model is not None,
+        "reranker_backend": _reranker_model.name if _reranker_model is not None else None,
+        "faiss_loaded": _faiss_index is not None,
+        "models_loading": not _loading_status()["ready"],
+    }
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 503 until every model component has finished loading (or failed)."""
+    status = _loading_status()
+    status["mode"] = "model" if _embedder is not None or _reranker_model is not None else "heuristic"
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
 
 
 @app.get("/metrics")
 def metrics():
-    global _request_count
-    start = time.time()
     try:
-        lats = list(_latency_ms)
+        with _stats_lock:
+            lats = list(_latency_ms)
+            request_count = _request_count
         if lats:
             p50, p95, p99 = np.percentile(lats, [50, 95, 99])
         else:
             p50 = p95 = p99 = 0.0
 
-        current_mem, peak_mem = tracemalloc.get_traced_memory()
+        memory = memory_stats()
         return {
-            "request_count": _request_count,
+            "request_count": request_count,
             "latency_p50_ms": round(float(p50), 2),
             "latency_p95_ms": round(float(p95), 2),
             "latency_p99_ms": round(float(p99), 2),
-            "memory_current_mb": round(current_mem / 1e6, 1),
-            "memory_peak_mb": round(peak_mem / 1e6, 1),
+            "memory_current_mb": memory["rss_mb"],
+            "memory_peak_mb": memory["peak_rss_mb"],
+            "torch_memory": memory["torch"],
+            "memory_tracing": _memory.active,
             "faiss_loaded": _faiss_index is not None,
             "faiss_size": _faiss_index.ntotal if _faiss_index is not None else 0,
             "reranker_loaded": _reranker_model is not None,
+            "reranker_backend": _reranker_model.name if _reranker_model is not None else None,
             "codebert_loaded": _embedder is not None,
+            "batching": _reranker_batcher.stats(),
+            "inference": _inference.stats(),
+            "embedding_cache": _embedding_cache.stats() if _embedding_cache is not None else None,
+            "tokenizer": {
+                **_tokenizer_status,
+                "caches": {name: tok.stats() for name, tok in _tokenizers.items()},
+            },
+            "latency_by_endpoint_ms": _telemetry.summary("request_latency_ms"),
+            "latency_by_stage_ms": _telemetry.summary("stage_latency_ms"),
         }
     except Exception as e:
         logger.error("metrics endpoint failed", error=str(e))
         return JSONResponse(status_code=500, content={"error": str(e), "code": "METRICS_ERROR"})
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
+
+
+@app.get("/metrics/prometheus")
+def metrics_prometheus():
+    """Every histogram, counter and gauge in Prometheus text format."""
+    memory = memory_stats()
+    _telemetry.set_gauge("memory_rss_bytes", memory["rss_mb"] * 1e6, help="Resident set size.")
+    _telemetry.set_gauge("memory_peak_rss_bytes", memory["peak_rss_mb"] * 1e6, help="Peak resident set size.")
+    return PlainTextResponse(_telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# ── Admin: on-demand memory tracing ───────────────────────────────────────────
+# Disabled unless ADMIN_TOKEN is set; callers send it as X-Admin-Token.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+
+class MemoryTraceRequest(BaseModel):
+    duration_s: float = 30.0
+    max_requests: Optional[int] = None
+    endpoints: Optional[list[str]] = None
+
+
+def _admin_denied(request: Request) -> Optional[JSONResponse]:
+    if not ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "admin endpoints disabled", "code": "ADMIN_DISABLED"})
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return JSONResponse(status_code=403, content={"error": "invalid admin token", "code": "FORBIDDEN"})
+    return None
+
+
+@app.get("/admin/memory")
+def admin_memory(request: Request):
+    """RSS/torch stats plus the open (or last) tracemalloc window's per-endpoint top sites."""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return {**memory_stats(), "tracing": _memory.report()}
+
+
+@app.post("/admin/memory/trace")
+def admin_memory_trace(req: MemoryTraceRequest, request: Request):
+    """Open a bounded tracemalloc window (``duration_s``, optional request budget and endpoint filter)."""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    try:
+        return _memory.start(req.duration_s, req.max_requests, req.endpoints)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e), "code": "INVALID_TRACE_WINDOW"})
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"error": str(e), "code": "TRACE_ACTIVE"})
+
+
+@app.delete("/admin/memory/trace")
+def admin_memory_trace_stop(request: Request):
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    return _memory.stop()
 
 
 @app.post("/rank")
-def rank(req: RankRequest):
-    global _request_count
+async def rank(req: RankRequest):
+    # The reranker path waits on the micro-batcher without tying up an inference
+    # worker, so concurrent requests share one forward pass; heuristics need a worker.
     start = time.time()
-    try:
-        if _reranker_model is not None and len(req.files) > 0:
-            try:
-                scored = _reranker_rank_files(req.files)
-            except Exception as e:
-                logger.warning("Reranker failed, using heuristics", error=str(e))
-                total = sum(f.additions + f.deletions for f in req.files)
-                scored = [score_file(f, total) for f in req.files]
+    if _reranker_model is not None and req.files:
+        try:
+            logits = await asyncio.wrap_future(_inference.admit(_reranker_batcher.submit, _reranker_texts(req.files)))
+        except _Overloaded as e:
+            return _overloaded_response("rank", e)
+        except Exception as e:
+            logger.warning("Reranker failed, using heuristics", error=str(e))
         else:
-            total = sum(f.additions + f.deletions for f in req.files)
-            scored = [score_file(f, total) for f in req.files]
+            return _json_response("rank", _rank_result(req, _reranker_results(req.files, logits), start))
+    return await _run_inference("rank", _rank, req, start)
+
+
+def _ranked_files(files: list[FileInput], embeddings: Optional[np.ndarray] = None) -> list[dict]:
+    """Reranker scores if loaded, else heuristics (reusing ``embeddings``); sorted with ranks."""
+    if _reranker_model is not None and len(files) > 0:
+        try:
+            scored = _reranker_rank_files(files)
+        except Exception as e:
+            logger.warning("Reranker failed, using heuristics", error=str(e))
+            total = sum(f.additions + f.deletions for f in files)
+            scored = score_files(files, total, embeddings)
+    else:
+        total = sum(f.additions + f.deletions for f in files)
+        scored = score_files(files, total, embeddings)
 
-        scored.sort(key=lambda x: x["final_score"], reverse=True)
-        ranked = [{"rank": i + 1, **s} for i, s in enumerate(scored)]
-        return {
-            "pr_id": req.pr_id,
-            "ranked_files": ranked,
-            "processing_ms": int((time.time() - start) * 1000),
-        }
+    scored.sort(key=lambda x: x["final_score"], reverse=True)
+    return [{"rank": i + 1, **s} for i, s in enumerate(scored)]
+
+
+def _rank_result(req: RankRequest, scored: list[dict], start: float) -> dict:
+    scored.sort(key=lambda x: x["final_score"], reverse=True)
+    return {
+        "pr_id": req.pr_id,
+        "ranked_files": [{"rank": i + 1, **s} for i, s in enumerate(scored)],
+        "processing_ms": int((time.time() - start) * 1000),
+    }
+
+
+def _rank(req: RankRequest, start: float):
+    """Heuristic (+ CodeBERT) ranking; the reranker path is served by ``rank`` itself."""
+    try:
+        total = sum(f.additions + f.deletions for f in req.files)
+        return _rank_result(req, score_files(req.files, total), start)
     except Exception as e:
         logger.error("rank endpoint failed", error=str(e))
         return JSONResponse(status_code=500, content={"error": str(e), "code": "RANK_ERROR"})
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
 
 
-@app.post("/cluster")
-def cluster(req: ClusterRequest):
-    global _request_count
+# ── Streaming ranking ─────────────────────────────────────────────────────────
+# NDJSON by default, SSE with ?format=sse or Accept: text/event-stream.
+# Events: "heuristic" (model-free scores, sent immediately), one "refined" per
+# reranker batch (sigmoid scores, comparable across batches), then "final" —
+# the same ranking the non-streaming endpoint returns — or "error".
+RANK_STREAM_BATCH = max(1, int(os.environ.get("RANK_STREAM_BATCH", "32")))
+
+
+def _sigmoid(logits: list[float]) -> list[float]:
+    return [round(1.0 / (1.0 + math.exp(-l)), 4) for l in logits]
+
+
+def _stream_error(e: Exception) -> dict:
+    if isinstance(e, _Overloaded):
+        logger.warning("stream batch shed", status=e.status_code, reason=e.reason)
+        return {"event": "error", "error": e.reason, "code": e.code}
+    logger.error("stream failed", error=str(e))
+    return {"event": "error", "error": str(e), "code": "STREAM_ERROR"}
+
+
+def _streaming_response(request: Request, requested_format: Optional[str], endpoint: str, events):
+    try:
+        fmt = negotiate_stream_format(request.headers.get("accept"), requested_format)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e), "code": "INVALID_STREAM_FORMAT"})
+    encoder = StreamEncoder(fmt, endpoint, _telemetry)
+    return StreamingResponse(
+        encoder.wrap_async(events), media_type=encoder.media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/rank/stream")
+async def rank_stream(req: RankRequest, request: Request, format: Optional[str] = None):
+    """Streamed ``/rank``: heuristic scores first, then reranker batches, then the final ranking."""
+    return _streaming_response(request, format, "rank_stream", _rank_events(req))
+
+
+async def _rank_events(req: RankRequest):
     start = time.time()
+    files = req.files
+    total = sum(f.additions + f.deletions for f in files)
+    yield {
+        "event": "heuristic",
+        "pr_id": req.pr_id,
+        "ranked_files": [{"rank": i + 1, **s} for i, s in enumerate(
+            sorted(score_files(files, total, embed=False), key=lambda x: x["final_score"], reverse=True)
+        )],
+    }
+
+    ranked = None
+    if _reranker_model is not None and files:
+        logits: list[float] = []
+        try:
+            for batch_index, i in enumerate(range(0, len(files), RANK_STREAM_BATCH)):
+                batch = files[i : i + RANK_STREAM_BATCH]
+                batch_logits = await asyncio.wrap_future(
+                    _inference.admit(_reranker_batcher.submit, _reranker_texts(batch))
+                )
+                logits.extend(batch_logits)
+                yield {
+                    "event": "refined",
+                    "batch": batch_index,
+                    "files": [{"filename": f.filename, "reranker_score": s}
+                              for f, s in zip(batch, _sigmoid(batch_logits))],
+                }
+        except _Overloaded as e:
+            yield _stream_error(e)
+            return
+        except Exception as e:
+            logger.warning("Reranker failed, using heuristics", error=str(e))
+        else:
+            scored = sorted(_reranker_results(files, logits), key=lambda x: x["final_score"], reverse=True)
+            ranked = [{"rank": i + 1, **s} for i, s in enumerate(scored)]
+
+    if ranked is None:
+        # No reranker (or it failed mid-stream): the CodeBERT-backed heuristic ranking
+        try:
+            scored = await asyncio.wrap_future(_inference.submit(score_files, files, total))
+        except Exception as e:
+            yield _stream_error(e)
+            return
+        scored.sort(key=lambda x: x["final_score"], reverse=True)
+        ranked = [{"rank": i + 1, **s} for i, s in enumerate(scored)]
+    yield {
+        "event": "final",
+        "pr_id": req.pr_id,
+        "ranked_files": ranked,
+        "processing_ms": int((time.time() - start) * 1000),
+    }
+
+
+@app.post("/cluster")
+async def cluster(req: ClusterRequest):
+    return await _run_inference("cluster", _cluster, req)
+
+
+def _cluster(req: ClusterRequest):
     try:
-        files = req.files
-        filenames = [f.filename for f in files]
-        patches = [f.patch or "" for f in files]
-
-        if len(files) < 2:
-            groups = [
-                {"cluster_id": i, "label": f.filename.split("/")[-1],
-                 "files": [f.filename], "coherence": 1.0}
-                for i, f in enumerate(files)
-            ]
-            return {"pr_id": req.pr_id, "groups": groups}
-
-        # ── Embedding-based HDBSCAN clustering ────────────────────────────────
         embeddings = None
-        labels = None
-
-        if _embedder is not None:
+        if _embedder is not None and len(req.files) >= 2:
             try:
-                import torch
-
-                tokenizer, model = _embedder
-                texts = [
-                    f"<file>{f.filename}</file><diff>{(f.patch or '')[:512]}</diff>"
-                    for f in files
-                ]
-                inputs = tokenizer(
-                    texts, padding=True, truncation=True,
-                    max_length=128, return_tensors="pt"
-                )
-                with torch.no_grad():
-                    out = model(**inputs)
-                emb = out.last_hidden_state.mean(dim=1)
-                norms = emb.norm(dim=1, keepdim=True) + 1e-8
-                embeddings = (emb / norms).numpy().astype(np.float32)
-
-                import hdbscan as _hdbscan
-                clusterer = _hdbscan.HDBSCAN(
-                    min_cluster_size=2, metric="euclidean",
-                    cluster_selection_method="eom",
-                )
-                labels = clusterer.fit_predict(embeddings).tolist()
+                embeddings = _codebert_embed([_file_text(f.filename, f.patch) for f in req.files])
             except Exception as e:
                 logger.warning("Embedding clustering failed, using directory fallback", error=str(e))
-                embeddings = None
-                labels = None
-
-        # ── Directory-based fallback ───────────────────────────────────────────
-        if labels is None:
-            from collections import defaultdict as _dd
-            dir_map: dict[str, list[int]] = _dd(list)
-            for i, f in enumerate(files):
-                parts = f.filename.split("/")
-                key = parts[0] if len(parts) > 1 else "root"
-                dir_map[key].append(i)
-            labels = [0] * len(files)
-            for cluster_id, idxs in enumerate(dir_map.values()):
-                for idx in idxs:
-                    labels[idx] = cluster_id
-
-        # ── Assemble groups ────────────────────────────────────────────────────
-        from collections import defaultdict as _dd2
-        cluster_to_idxs: dict[int, list[int]] = _dd2(list)
-        for i, lbl in enumerate(labels):
-            cluster_to_idxs[lbl].append(i)
-
-        groups = []
-        output_id = 0
-
-        for lbl in sorted(k for k in cluster_to_idxs if k >= 0):
-            idxs = cluster_to_idxs[lbl]
-            c_filenames = [filenames[i] for i in idxs]
-            c_patches = [patches[i] for i in idxs]
-            label = _label_cluster(c_filenames, c_patches)
-
-            if embeddings is not None and len(idxs) > 1:
-                e = embeddings[idxs]
-                sim = e @ e.T
-                mask = np.ones(sim.shape, dtype=bool)
-                np.fill_diagonal(mask, False)
-                coherence = float(np.clip(np.mean(sim[mask]), 0.0, 1.0))
-            else:
-                coherence = 1.0 if len(idxs) == 1 else round(0.7 + 0.3 * min(len(idxs) / 5, 1.0), 2)
+        return {"pr_id": req.pr_id, "groups": _cluster_groups(req.files, embeddings)}
+    except Exception as e:
+        logger.error("cluster endpoint failed", error=str(e))
+        return JSONResponse(status_code=500, content={"error": str(e), "code": "CLUSTER_ERROR"})
+
+
+def _cluster_groups(files: list[FileInput], embeddings: Optional[np.ndarray]) -> list[dict]:
+    """HDBSCAN over ``embeddings`` (rows aligned with ``files``), else directory grouping."""
+    filenames = [f.filename for f in files]
+    patches = [f.patch or "" for f in files]
+
+    if len(files) < 2:
+        return [
+            {"cluster_id": i, "label": f.filename.split("/")[-1],
+             "files": [f.filename], "coherence": 1.0}
+            for i, f in enumerate(files)
+        ]
+
+    # ── Embedding-based HDBSCAN clustering ────────────────────────────────────
+    labels = None
+
+    if embeddings is not None:
+        try:
+            import hdbscan as _hdbscan
+            clusterer = _hdbscan.HDBSCAN(
+                min_cluster_size=2, metric="euclidean",
+                cluster_selection_method="eom",
+            )
+            with _telemetry.timer("hdbscan"):
+                labels = clusterer.fit_predict(embeddings).tolist()
+        except Exception as e:
+            logger.warning("Embedding clustering failed, using directory fallback", error=str(e))
+            embeddings = None
+            labels = None
+
+    # ── Directory-based fallback ───────────────────────────────────────────────
+    if labels is None:
+        from collections import defaultdict as _dd
+        dir_map: dict[str, list[int]] = _dd(list)
+        for i, f in enumerate(files):
+            parts = f.filename.split("/")
+            key = parts[0] if len(parts) > 1 else "root"
+            dir_map[key].append(i)
+        labels = [0] * len(files)
+        for cluster_id, idxs in enumerate(dir_map.values()):
+            for idx in idxs:
+                labels[idx] = cluster_id
+
+    # ── Assemble groups ────────────────────────────────────────────────────────
+    from collections import defaultdict as _dd2
+    cluster_to_idxs: dict[int, list[int]] = _dd2(list)
+    for i, lbl in enumerate(labels):
+        cluster_to_idxs[lbl].append(i)
+
+    groups = []
+    output_id = 0
+
+    for lbl in sorted(k for k in cluster_to_idxs if k >= 0):
+        idxs = cluster_to_idxs[lbl]
+        c_filenames = [filenames[i] for i in idxs]
+        c_patches = [patches[i] for i in idxs]
+        label = _label_cluster(c_filenames, c_patches)
+
+        if embeddings is not None and len(idxs) > 1:
+            e = embeddings[idxs]
+            sim = e @ e.T
+            mask = np.ones(sim.shape, dtype=bool)
+            np.fill_diagonal(mask, False)
+            coherence = float(np.clip(np.mean(sim[mask]), 0.0, 1.0))
+        else:
+            coherence = 1.0 if len(idxs) == 1 else round(0.7 + 0.3 * min(len(idxs) / 5, 1.0), 2)
+
+        groups.append({
+            "cluster_id": output_id,
+            "label": label,
+            "files": c_filenames,
+            "coherence": round(coherence, 2),
+        })
+        output_id += 1
 
+    # Noise points (-1) as singletons
+    if -1 in cluster_to_idxs:
+        for idx in cluster_to_idxs[-1]:
             groups.append({
                 "cluster_id": output_id,
-                "label": label,
-                "files": c_filenames,
-                "coherence": round(coherence, 2),
+                "label": filenames[idx].split("/")[-1],
+                "files": [filenames[idx]],
+                "coherence": 1.0,
             })
             output_id += 1
 
-        # Noise points (-1) as singletons
-        if -1 in cluster_to_idxs:
-            for idx in cluster_to_idxs[-1]:
-                groups.append({
-                    "cluster_id": output_id,
-                    "label": filenames[idx].split("/")[-1],
-                    "files": [filenames[idx]],
-                    "coherence": 1.0,
-                })
-                output_id += 1
-
-        return {"pr_id": req.pr_id, "groups": groups}
-    except Exception as e:
-        logger.error("cluster endpoint failed", error=str(e))
-        return JSONResponse(status_code=500, content={"error": str(e), "code": "CLUSTER_ERROR"})
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
+    return groups
 
 
 @app.post("/retrieve")
-def retrieve(req: RetrieveRequest):
-    global _request_count
-    start = time.time()
+async def retrieve(req: RetrieveRequest):
+    return await _run_inference("retrieve", _retrieve, req)
+
+
+def _retrieve(req: RetrieveRequest):
     try:
         if _faiss_index is None or _faiss_metadata is None:
             return {
@@ -526,102 +1164,252 @@ def retrieve(req: RetrieveRequest):
             }
 
         emb = _embed_query(req.query_diff[:512])  # (1, 768) float32
-        k = min(req.k, _faiss_index.ntotal)
-        scores, indices = _faiss_index.search(emb, k)
+        return {"results": _faiss_neighbors(emb, req.k)[0]}
+    except Exception as e:
+        logger.error("retrieve endpoint failed", error=str(e))
+        return JSONResponse(status_code=500, content={"error": str(e), "code": "RETRIEVE_ERROR"})
+
+
+def _faiss_neighbors(queries: np.ndarray, k: int) -> list[list[dict]]:
+    """Top-``k`` indexed hunks for each query row, from one batched FAISS search."""
+    k = min(k, _faiss_index.ntotal)
+    if k <= 0 or len(queries) == 0:
+        return [[] for _ in range(len(queries))]
+    _telemetry.observe("batch_size", len(queries), BATCH_SIZE_BUCKETS, model="faiss")
+    with _telemetry.timer("faiss_search"):
+        scores, indices = _faiss_index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
 
+    neighbors = []
+    for row_scores, row_indices in zip(scores, indices):
         results = []
-        for score, idx in zip(scores[0], indices[0]):
+        for score, idx in zip(row_scores, row_indices):
             if idx < 0 or idx >= len(_faiss_metadata):
                 continue
             hunk = _faiss_metadata[idx]
             results.append({**hunk, "similarity": float(score)})
+        neighbors.append(results)
+    return neighbors
 
-        return {"results": results}
-    except Exception as e:
-        logger.error("retrieve endpoint failed", error=str(e))
-        return JSONResponse(status_code=500, content={"error": str(e), "code": "RETRIEVE_ERROR"})
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
 
+@app.post("/analyze")
+async def analyze(req: AnalyzeRequest):
+    return await _run_inference("analyze", _analyze, req)
 
-@app.post("/rank_hunks")
-def rank_hunks(req: HunkRankRequest):
-    """Split patch into individual hunks and score each independently."""
-    global _request_count
+
+def _analyze(req: AnalyzeRequest):
+    """Rank, cluster and retrieve for one PR from a single CodeBERT pass over its files."""
     start = time.time()
-    try:
-        # Split on @@ hunk headers; drop the first empty segment before first @@
-        raw_hunks = req.patch.split("@@")
-        # Reassemble: each hunk = "@@ <header> @@" + body
-        hunks = []
-        i = 1  # index 0 is empty string before first @@
-        while i + 1 < len(raw_hunks):
-            header = raw_hunks[i].strip()
-            body = raw_hunks[i + 1] if i + 1 < len(raw_hunks) else ""
-            hunks.append(f"@@ {header} @@{body}")
-            i += 2
+    timings: dict[str, float] = {}
 
-        if not hunks:
-            return {"filename": req.filename, "hunks": []}
+    def lap(stage: str, t0: float) -> float:
+        now = time.time()
+        timings[stage] = round((now - t0) * 1000, 2)
+        return now
 
-        # Score each hunk
-        scored_hunks = []
-        if _reranker_model is not None:
-            texts = [f"<file>{req.filename}\n{h[:512]}" for h in hunks]
+    try:
+        files = req.files
+        t = time.time()
+        embeddings = None
+        if _embedder is not None and files:
             try:
-                import torch
-                enc = _reranker_tokenizer(
-                    texts, padding=True, truncation=True,
-                    max_length=128, return_tensors="pt"
-                )
-                with torch.no_grad():
-                    out = _reranker_model(**enc)
-                    logits = out.logits.squeeze(-1)
-                lo, hi = logits.min().item(), logits.max().item()
-                if hi - lo < 1e-6:
-                    scores = [0.5] * len(hunks)
-                else:
-                    scores = [(l - lo) / (hi - lo) for l in logits.tolist()]
+                embeddings = _codebert_embed([_file_text(f.filename, f.patch or "") for f in files])
             except Exception as e:
-                logger.warning("Reranker hunk scoring failed", error=str(e))
-                scores = [0.5] * len(hunks)
-        else:
-            # Heuristic: score based on hunk size and security keywords
-            scores = []
-            for h in hunks:
-                added = h.count("\n+")
-                removed = h.count("\n-")
-                size_factor = min((added + removed) / 20.0, 1.0)
-                sec_factor = 0.3 if any(
-                    kw in h.lower() for kw in
-                    ["auth", "crypto", "secret", "token", "password", "security"]
-                ) else 0.0
-                scores.append(min(0.3 + 0.5 * size_factor + sec_factor, 1.0))
-
-        for i, (hunk_text, score) in enumerate(zip(hunks, scores)):
-            # Extract hunk header line count info
-            lines_added = hunk_text.count("\n+")
-            lines_removed = hunk_text.count("\n-")
-            scored_hunks.append({
-                "hunk_index": i,
-                "score": round(score, 4),
-                "label": _score_label(score),
-                "lines_added": lines_added,
-                "lines_removed": lines_removed,
-                "preview": hunk_text[:200],
-            })
+                logger.warning("analyze embedding failed, using heuristics", error=str(e))
+        t = lap("embed", t)
 
-        scored_hunks.sort(key=lambda x: x["score"], reverse=True)
+        ranked = _ranked_files(files, embeddings)
+        t = lap("rank", t)
+
+        groups = _cluster_groups(files, embeddings)
+        t = lap("cluster", t)
+
+        similar = []
+        if embeddings is not None and _faiss_index is not None and _faiss_metadata is not None:
+            for f, results in zip(files, _faiss_neighbors(embeddings, req.k)):
+                similar.append({"filename": f.filename, "results": results})
+        lap("retrieve", t)
+
+        timings["total"] = round((time.time() - start) * 1000, 2)
         return {
-            "filename": req.filename,
-            "hunks": scored_hunks,
+            "pr_id": req.pr_id,
+            "ranked_files": ranked,
+            "groups": groups,
+            "similar": similar,
+            "timings_ms": timings,
         }
+    except Exception as e:
+        logger.error("analyze endpoint failed", error=str(e))
+        return JSONResponse(status_code=500, content={"error": str(e), "code": "ANALYZE_ERROR"})
+
+
+# ── Hunk ranking ──────────────────────────────────────────────────────────────
+# Hunks come from ml.data.parser.parse_patch (anchored "@@ -a,b +c,d @@" header
+# lines), so "@@" inside code no longer splits a hunk. Scores are min-max
+# normalized per file, matching /rank_hunks for the same patch.
+HUNK_BATCH_MAX_TOKENS = int(os.environ.get("HUNK_BATCH_MAX_TOKENS", str(32 * 128)))
+_HUNK_SECURITY_KEYWORDS = ["auth", "crypto", "secret", "token", "password", "security"]
+
+
+def _heuristic_hunk_score(hunk) -> float:
+    size_factor = min((len(hunk.added_lines) + len(hunk.removed_lines)) / 20.0, 1.0)
+    sec_factor = 0.3 if any(kw in hunk.raw.lower() for kw in _HUNK_SECURITY_KEYWORDS) else 0.0
+    return min(0.3 + 0.5 * size_factor + sec_factor, 1.0)
+
+
+def _reranker_logits_bucketed(texts: list[str]) -> list[float]:
+    """Reranker logits for ``texts``, tokenized once and run in length-bucketed batches.
+
+    Only for ``/rank_hunks_batch``, whose whole-PR requests are large enough to
+    bucket on their own; single-file requests go through ``_reranker_batcher``.
+    """
+    from ml.models.batching import length_bucketed_batches
+
+    tokenizer = _tokenizer_for("reranker")
+    with _telemetry.timer("tokenize", model="reranker"):
+        ids = tokenizer.encode(texts)
+    logits = np.zeros(len(texts), dtype=np.float64)
+    lengths = [min(len(row), 128) for row in ids]
+    for idx in length_bucketed_batches(lengths, HUNK_BATCH_MAX_TOKENS):
+        _telemetry.observe("batch_size", len(idx), BATCH_SIZE_BUCKETS, model="reranker")
+        enc = tokenizer.pad([ids[i] for i in idx], max_length=128, return_tensors="np")
+        with _telemetry.timer("forward", model="reranker"):
+            logits[idx] = _reranker_model(enc)
+    return logits.tolist()
+
+
+def _score_hunk_groups(groups: list[tuple[str, list]]) -> list[list[float]]:
+    """Scores per hunk for each ``(filename, hunks)``: one reranker call across all files."""
+    if _reranker_model is not None:
+        texts = [_file_text(filename, h.raw) for filename, hunks in groups for h in hunks]
+        try:
+            logits = _reranker_logits_bucketed(texts) if texts else []
+            scores, offset = [], 0
+            for _, hunks in groups:
+                scores.append(_minmax_normalize(logits[offset : offset + len(hunks)]) if hunks else [])
+                offset += len(hunks)
+            return scores
+        except Exception as e:
+            logger.warning("Reranker hunk scoring failed", error=str(e))
+            return [[0.5] * len(hunks) for _, hunks in groups]
+    return [[_heuristic_hunk_score(h) for h in hunks] for _, hunks in groups]
+
+
+def _ranked_hunks(hunks: list, scores: list[float]) -> list[dict]:
+    scored_hunks = [
+        {
+            "hunk_index": i,
+            "header": hunk.raw.split("\n", 1)[0],
+            "score": round(score, 4),
+            "label": _score_label(score),
+            "lines_added": len(hunk.added_lines),
+            "lines_removed": len(hunk.removed_lines),
+            "preview": hunk.raw[:200],
+        }
+        for i, (hunk, score) in enumerate(zip(hunks, scores))
+    ]
+    scored_hunks.sort(key=lambda x: x["score"], reverse=True)
+    return scored_hunks
+
+
+@app.post("/rank_hunks")
+async def rank_hunks(req: HunkRankRequest):
+    """Split patch into individual hunks and score each independently."""
+    # Like /rank: reranker work goes through the micro-batcher, so concurrent
+    # /rank and /rank_hunks requests share one forward pass.
+    if _reranker_model is not None:
+        try:
+            hunks = parse_patch(req.patch)
+        except Exception as e:
+            logger.error("rank_hunks endpoint failed", error=str(e))
+            return JSONResponse(status_code=500, content={"error": str(e), "code": "RANK_HUNKS_ERROR"})
+        if not hunks:
+            return {"filename": req.filename, "hunks": []}
+        try:
+            logits = await asyncio.wrap_future(
+                _inference.admit(_reranker_batcher.submit, [_file_text(req.filename, h.raw) for h in hunks])
+            )
+        except _Overloaded as e:
+            return _overloaded_response("rank_hunks", e)
+        except Exception as e:
+            logger.warning("Reranker hunk scoring failed", error=str(e))
+            scores = [0.5] * len(hunks)
+        else:
+            scores = _minmax_normalize(logits)
+        return _json_response("rank_hunks", {"filename": req.filename, "hunks": _ranked_hunks(hunks, scores)})
+    return await _run_inference("rank_hunks", _rank_hunks, req)
+
+
+def _rank_hunks(req: HunkRankRequest):
+    """Heuristic hunk scores; the reranker path is served by ``rank_hunks`` itself."""
+    try:
+        hunks = parse_patch(req.patch)
+        if not hunks:
+            return {"filename": req.filename, "hunks": []}
+        scores = _score_hunk_groups([(req.filename, hunks)])[0]
+        return {"filename": req.filename, "hunks": _ranked_hunks(hunks, scores)}
     except Exception as e:
         logger.error("rank_hunks endpoint failed", error=str(e))
         return JSONResponse(status_code=500, content={"error": str(e), "code": "RANK_HUNKS_ERROR"})
-    finally:
-        elapsed = (time.time() - start) * 1000
-        _latency_ms.append(elapsed)
-        _request_count += 1
+
+
+@app.post("/rank_hunks_batch")
+async def rank_hunks_batch(req: HunkBatchRequest):
+    """Rank the hunks of every file in a PR with one bucketed reranker pass."""
+    return await _run_inference("rank_hunks_batch", _rank_hunks_batch, req)
+
+
+def _rank_hunks_batch(req: HunkBatchRequest):
+    start = time.time()
+    try:
+        groups = [(f.filename, parse_patch(f.patch or "")) for f in req.files]
+        scores = _score_hunk_groups(groups)
+        return {
+            "pr_id": req.pr_id,
+            "files": [
+                {"filename": filename, "hunks": _ranked_hunks(hunks, file_scores)}
+                for (filename, hunks), file_scores in zip(groups, scores)
+            ],
+            "total_hunks": sum(len(hunks) for _, hunks in groups),
+            "processing_ms": int((time.time() - start) * 1000),
+        }
+    except Exception as e:
+        logger.error("rank_hunks_batch endpoint failed", error=str(e))
+        return JSONResponse(status_code=500, content={"error": str(e), "code": "RANK_HUNKS_BATCH_ERROR"})
+
+
+@app.post("/rank_hunks/stream")
+async def rank_hunks_stream(req: HunkRankRequest, request: Request, format: Optional[str] = None):
+    """Streamed ``/rank_hunks``: heuristic hunk scores first, then reranker batches, then the final ranking."""
+    return _streaming_response(request, format, "rank_hunks_stream", _rank_hunks_events(req))
+
+
+async def _rank_hunks_events(req: HunkRankRequest):
+    hunks = parse_patch(req.patch)
+    heuristic = [_heuristic_hunk_score(h) for h in hunks]
+    yield {"event": "heuristic", "filename": req.filename, "hunks": _ranked_hunks(hunks, heuristic)}
+
+    scores = heuristic
+    if _reranker_model is not None and hunks:
+        texts = [_file_text(req.filename, h.raw) for h in hunks]
+        logits: list[float] = []
+        try:
+            for batch_index, i in enumerate(range(0, len(texts), RANK_STREAM_BATCH)):
+                batch_logits = await asyncio.wrap_future(
+                    _inference.admit(_reranker_batcher.submit, texts[i : i + RANK_STREAM_BATCH])
+                )
+                logits.extend(batch_logits)
+                yield {
+                    "event": "refined",
+                    "batch": batch_index,
+                    "hunks": [{"hunk_index": i + j, "reranker_score": s}
+                              for j, s in enumerate(_sigmoid(batch_logits))],
+                }
+        except _Overloaded as e:
+            yield _stream_error(e)
+            return
+        except Exception as e:
+            logger.warning("Reranker hunk scoring failed", error=str(e))
+            scores = [0.5] * len(hunks)
+        else:
+            scores = _minmax_normalize(logits)
+    yield {"event": "final", "filename": req.filename, "hunks": _ranked_hunks(hunks, scores)}
@@ -0,0 +1,18 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+MAIN = Path(__file__).resolve().parent.parent / "main.py"
+
+
+@pytest.fixture(scope="session")
+def hf():
+    """The Space app module, imported as ``hf_main`` so it can't shadow apps/api's ``main``."""
+    if "hf_main" not in sys.modules:
+        spec = importlib.util.spec_from_file_location("hf_main", MAIN)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["hf_main"] = module
+        spec.loader.exec_module(module)
+    return sys.modules["hf_main"]
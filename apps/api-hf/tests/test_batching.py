@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+class _FakeForward:
+    """Records each forward pass; logits are the text lengths. Blocks while ``gate`` is clear."""
+
+    def __init__(self, fail: bool = False):
+        self.calls: list[list[str]] = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = fail
+
+    def __call__(self, texts):
+        self.gate.wait(5)
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("forward failed")
+        return [float(len(t)) for t in texts]
+
+
+def _submit_all(batcher, requests):
+    return [batcher.submit(texts) for texts in requests]
+
+
+def test_each_request_gets_its_own_slice(hf):
+    forward = _FakeForward()
+    batcher = hf._MicroBatcher(forward, max_batch_size=64, max_wait_ms=50)
+    futures = _submit_all(batcher, [["a"], ["bb", "ccc"], ["dddd"]])
+
+    assert [f.result(5) for f in futures] == [[1.0], [2.0, 3.0], [4.0]]
+    assert forward.calls == [["a", "bb", "ccc", "dddd"]]
+
+
+def test_submit_does_not_block_the_caller(hf):
+    forward = _FakeForward()
+    forward.gate.clear()
+    batcher = hf._MicroBatcher(forward, max_batch_size=64, max_wait_ms=0)
+    # More concurrent requests than inference workers, all from one thread
+    futures = _submit_all(batcher, [["t"] for _ in range(hf.INFERENCE_WORKERS * 4)])
+    assert not any(f.done() for f in futures)
+    forward.gate.set()
+    assert [f.result(5) for f in futures] == [[1.0]] * len(futures)
+
+
+def test_forward_error_reaches_every_request_in_the_batch(hf):
+    batcher = hf._MicroBatcher(_FakeForward(fail=True), max_batch_size=64, max_wait_ms=50)
+    futures = _submit_all(batcher, [["a"], ["b", "c"]])
+    for fut in futures:
+        with pytest.raises(RuntimeError, match="forward failed"):
+            fut.result(5)
+
+
+def test_request_that_would_overflow_carries_to_next_batch(hf):
+    forward = _FakeForward()
+    batcher = hf._MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+    futures = _submit_all(batcher, [["a", "b", "c"], ["dd", "ee"], ["f"]])
+
+    assert [f.result(5) for f in futures] == [[1.0, 1.0, 1.0], [2.0, 2.0], [1.0]]
+    # The second request would make 5 texts, so it starts the next batch
+    assert forward.calls == [["a", "b", "c"], ["dd", "ee", "f"]]
+
+
+def test_oversized_request_runs_alone(hf):
+    forward = _FakeForward()
+    batcher = hf._MicroBatcher(forward, max_batch_size=2, max_wait_ms=50)
+    futures = _submit_all(batcher, [["a", "b", "c", "d", "e"], ["f"]])
+
+    assert futures[0].result(5) == [1.0] * 5
+    assert futures[1].result(5) == [1.0]
+    assert forward.calls == [["a", "b", "c", "d", "e"], ["f"]]
+
+
+def test_empty_request_resolves_without_a_forward_pass(hf):
+    forward = _FakeForward()
+    assert hf._MicroBatcher(forward).submit([]).result(0) == []
+    assert forward.calls == []
+
+
+def test_concurrent_rank_requests_share_one_forward_pass(hf, monkeypatch):
+    forward = _FakeForward()
+    batcher = hf._MicroBatcher(forward, max_batch_size=64, max_wait_ms=200)
+    monkeypatch.setattr(hf, "_reranker_batcher", batcher)
+    monkeypatch.setattr(hf, "_reranker_model", object())
+    monkeypatch.setattr(hf, "_start_model_loading", lambda: None)
+    n = hf.INFERENCE_WORKERS + 2  # more than could ever block a worker each
+
+    responses = []
+    with TestClient(hf.app) as client:
+        threads = [
+            threading.Thread(target=lambda i=i: responses.append(client.post("/rank", json={
+                "pr_id": str(i), "repo": "o/r",
+                "files": [{"filename": f"src/f{i}.py", "patch": "+x", "additions": 1}],
+            })))
+            for i in range(n)
+        ]
+        t0 = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+    assert time.monotonic() - t0 < 5
+    assert [r.status_code for r in responses] == [200] * n
+    assert len(forward.calls) == 1
+    assert len(forward.calls[0]) == n
+
+
+def test_concurrent_rank_and_rank_hunks_share_one_forward_pass(hf, monkeypatch):
+    forward = _FakeForward()
+    batcher = hf._MicroBatcher(forward, max_batch_size=64, max_wait_ms=200)
+    monkeypatch.setattr(hf, "_reranker_batcher", batcher)
+    monkeypatch.setattr(hf, "_reranker_model", object())
+    monkeypatch.setattr(hf, "_start_model_loading", lambda: None)
+    patch = "@@ -1,1 +1,1 @@\n-a = 1\n+a = 2\n@@ -9,1 +9,2 @@\n+b = 3\n"
+    requests = [
+        ("/rank", {"pr_id": "1", "repo": "o/r", "files": [{"filename": "src/a.py", "patch": "+x", "additions": 1}]}),
+        ("/rank_hunks", {"filename": "src/b.py", "patch": patch}),
+    ]
+
+    responses = {}
+    with TestClient(hf.app) as client:
+        threads = [
+            threading.Thread(target=lambda url=url, body=body: responses.update({url: client.post(url, json=body)}))
+            for url, body in requests
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+    assert {url: r.status_code for url, r in responses.items()} == {"/rank": 200, "/rank_hunks": 200}
+    assert len(responses["/rank_hunks"].json()["hunks"]) == 2
+    # One file text from /rank and two hunk texts from /rank_hunks in a single pass
+    assert [len(call) for call in forward.calls] == [3]
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+AUTH_PATCH = """\
+@@ -1,3 +1,4 @@
+ import os
+-SECRET = "x"
++SECRET = os.environ["SECRET"]
++TOKEN_TTL = 3600
+@@ -20,2 +21,8 @@ def login(user):
+     check(user)
++    log("@@ -1 +1 @@ is not a hunk header here")
++    a = 1
++    b = 2
++    c = 3
++    d = 4
++    return issue_token(user)
+"""
+
+UTIL_PATCH = """\
+@@ -5,1 +5,1 @@
+-x = 1
++x = 2
+"""
+
+FILES = [
+    {"filename": "src/auth.py", "patch": AUTH_PATCH},
+    {"filename": "src/util.py", "patch": UTIL_PATCH},
+    {"filename": "assets/logo.png", "patch": ""},
+]
+
+
+class _FakeTokenizer:
+    def encode(self, texts):
+        return [[ord(c) % 97 + 1 for c in text] for text in texts]
+
+    def pad(self, rows, max_length, return_tensors):
+        rows = [row[:max_length] for row in rows]
+        width = max(len(row) for row in rows)
+        ids = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            ids[i, : len(row)] = row
+        return {"input_ids": ids, "attention_mask": (ids > 0).astype(np.int64)}
+
+    def __call__(self, texts, max_length, return_tensors):
+        return self.pad(self.encode(texts), max_length, return_tensors)
+
+
+class _FakeReranker:
+    """Padding-invariant logits (masked mean of the ids); records batch shapes."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, enc):
+        ids, mask = enc["input_ids"], enc["attention_mask"]
+        self.batches.append(ids.shape)
+        return (ids * mask).sum(axis=1) / mask.sum(axis=1)
+
+
+@pytest.fixture
+def reranker(hf, monkeypatch):
+    model = _FakeReranker()
+    monkeypatch.setattr(hf, "_reranker_model", model)
+    monkeypatch.setitem(hf._tokenizers, "reranker", _FakeTokenizer())
+    monkeypatch.setattr(hf, "HUNK_BATCH_MAX_TOKENS", 256)  # force several buckets
+    return model
+
+
+@pytest.fixture
+def client(hf, monkeypatch):
+    monkeypatch.setattr(hf, "_start_model_loading", lambda: None)
+    with TestClient(hf.app) as c:
+        yield c
+
+
+def _per_file(client):
+    return [
+        client.post("/rank_hunks", json={"filename": f["filename"], "patch": f["patch"]}).json()
+        for f in FILES
+    ]
+
+
+def test_batch_rankings_match_rank_hunks_per_file(client, reranker):
+    batch = client.post("/rank_hunks_batch", json={"pr_id": "7", "files": FILES})
+    assert batch.status_code == 200
+    body = batch.json()
+
+    assert body["files"] == _per_file(client)
+    assert body["total_hunks"] == 3
+    assert len(reranker.batches) > 1  # bucketed, yet per-file scores are unchanged
+    assert all(0.0 <= h["score"] <= 1.0 for f in body["files"] for h in f["hunks"])
+
+
+def test_batch_heuristics_match_rank_hunks_without_reranker(client, hf, monkeypatch):
+    monkeypatch.setattr(hf, "_reranker_model", None)
+    body = client.post("/rank_hunks_batch", json={"pr_id": "7", "files": FILES}).json()
+    assert body["files"] == _per_file(client)
+
+
+def test_heuristic_scores_parsed_lines(client, hf, monkeypatch):
+    monkeypatch.setattr(hf, "_reranker_model", None)
+    hunks = client.post("/rank_hunks", json={"filename": "src/auth.py", "patch": AUTH_PATCH}).json()["hunks"]
+
+    # "@@" inside an added line does not start a new hunk
+    assert len(hunks) == 2
+    by_index = {h["hunk_index"]: h for h in hunks}
+    assert (by_index[0]["lines_added"], by_index[0]["lines_removed"]) == (2, 1)
+    assert (by_index[1]["lines_added"], by_index[1]["lines_removed"]) == (6, 0)
+    # 0.3 + 0.5 * changed/20, plus 0.3 for security keywords (SECRET, TOKEN, issue_token)
+    assert by_index[0]["score"] == round(0.3 + 0.5 * 3 / 20 + 0.3, 4)
+    assert by_index[1]["score"] == round(0.3 + 0.5 * 6 / 20 + 0.3, 4)
+    assert by_index[1]["header"] == "@@ -20,2 +21,8 @@ def login(user):"
+
+    util = client.post("/rank_hunks", json={"filename": "src/util.py", "patch": UTIL_PATCH}).json()["hunks"]
+    assert util[0]["score"] == round(0.3 + 0.5 * 2 / 20, 4)
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+
+class _Blocking:
+    """A handler that blocks its worker until ``release`` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, value):
+        self.started.set()
+        self.release.wait(5)
+        return {"value": value}
+
+
+@pytest.fixture
+def executor(hf):
+    ex = hf._InferenceExecutor(workers=1, max_queue=1, queue_timeout_s=0)
+    yield ex
+    ex._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def test_full_queue_is_rejected_with_429(hf, executor):
+    fn = _Blocking()
+    running = executor.submit(fn, 1)
+    fn.started.wait(5)
+    queued = executor.submit(fn, 2)
+
+    with pytest.raises(hf._Overloaded) as exc:
+        executor.submit(fn, 3)
+    assert (exc.value.status_code, exc.value.code) == (429, "OVERLOADED")
+
+    fn.release.set()
+    assert [running.result(5), queued.result(5)] == [{"value": 1}, {"value": 2}]
+    stats = executor.stats()
+    assert (stats["rejected"], stats["completed"], stats["timed_out"]) == (1, 2, 0)
+
+
+async def test_run_inference_answers_429_with_retry_after(hf, executor, monkeypatch):
+    monkeypatch.setattr(hf, "_inference", executor)
+    fn = _Blocking()
+    executor.submit(fn, 1)
+    executor.submit(fn, 2)
+    try:
+        response = await hf._run_inference("rank", fn, 3)
+    finally:
+        fn.release.set()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(hf.INFERENCE_RETRY_AFTER_S)
+    assert json.loads(response.body) == {"error": "inference queue full", "code": "OVERLOADED"}
+
+
+def test_request_queued_past_timeout_is_shed_not_run(hf):
+    executor = hf._InferenceExecutor(workers=1, max_queue=1, queue_timeout_s=0.05)
+    fn = _Blocking()
+    calls = []
+    executor.submit(fn, 1)
+    fn.started.wait(5)
+    late = executor.submit(calls.append, 2)
+    time.sleep(0.1)
+    fn.release.set()
+
+    with pytest.raises(hf._Overloaded) as exc:
+        late.result(5)
+    assert (exc.value.status_code, exc.value.code) == (503, "QUEUE_TIMEOUT")
+    assert calls == []
+    stats = executor.stats()
+    # A shed request is a timeout, not a completion
+    assert (stats["completed"], stats["timed_out"], stats["running"], stats["queue_depth"]) == (1, 1, 0, 0)
+    executor._pool.shutdown(wait=False)
+
+
+async def test_cancelled_queued_request_frees_its_slot(hf, executor, monkeypatch):
+    monkeypatch.setattr(hf, "_inference", executor)
+    fn = _Blocking()
+    executor.submit(fn, 1)
+    fn.started.wait(5)
+
+    # Client goes away while its request is still queued
+    task = asyncio.create_task(hf._run_inference("rank", fn, 2))
+    await asyncio.sleep(0.05)
+    assert executor.stats()["queue_depth"] == 1
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert executor.stats()["queue_depth"] == 0
+    replacement = executor.submit(fn, 3)  # would be 429 if the slot leaked
+    fn.release.set()
+    assert replacement.result(5) == {"value": 3}
+    assert executor.stats()["completed"] == 2
+
+
+def test_admitted_batcher_work_holds_a_slot_until_done(hf, executor):
+    from concurrent.futures import Future
+
+    pending = Future()
+    admitted = executor.admit(lambda: pending)
+    executor.admit(lambda: Future())
+    assert executor.stats()["batching"] == 2
+    with pytest.raises(hf._Overloaded):
+        executor.admit(lambda: Future())
+
+    pending.set_result([1.0])
+    assert admitted.result(0) == [1.0]
+    assert executor.stats()["batching"] == 1
+    executor.admit(lambda: Future())
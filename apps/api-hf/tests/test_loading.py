@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+FILES = [
+    {"filename": "src/auth/session.py", "patch": "+token = issue()", "additions": 40, "deletions": 2},
+    {"filename": "docs/usage.md", "patch": "+text", "additions": 3, "deletions": 0},
+]
+
+
+@pytest.fixture
+def loaders(hf, monkeypatch):
+    """CodeBERT loads until ``gate`` is set, the reranker fails, FAISS loads at once."""
+    gate = threading.Event()
+
+    def slow():
+        gate.wait(5)
+
+    def broken():
+        raise OSError("reranker weights not found")
+
+    monkeypatch.setattr(hf, "_components", {
+        name: {"state": "pending", "load_s": None} for name in ("codebert", "reranker", "faiss")
+    })
+    monkeypatch.setitem(hf._LOADERS, "codebert", slow)
+    monkeypatch.setitem(hf._LOADERS, "reranker", broken)
+    monkeypatch.setitem(hf._LOADERS, "faiss", lambda: None)
+    monkeypatch.setattr(hf, "_embedder", None)
+    monkeypatch.setattr(hf, "_reranker_model", None)
+    yield gate
+    gate.set()
+
+
+def _wait_for(client, predicate, timeout=5.0):
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout:
+        response = client.get("/ready")
+        if predicate(response):
+            return response
+        time.sleep(0.01)
+    raise AssertionError(f"/ready never settled: {response.json()}")
+
+
+def test_ready_is_503_until_every_component_settles(hf, loaders):
+    with TestClient(hf.app) as client:
+        loading = _wait_for(client, lambda r: r.json()["components"]["reranker"]["state"] == "failed")
+        assert loading.status_code == 503
+        body = loading.json()
+        assert body["ready"] is False
+        assert body["mode"] == "heuristic"
+        assert body["components"]["codebert"]["state"] == "loading"
+        assert body["components"]["reranker"]["error"] == "reranker weights not found"
+
+        loaders.set()
+        ready = _wait_for(client, lambda r: r.status_code == 200)
+        components = ready.json()["components"]
+        assert ready.json()["ready"] is True
+        assert components["codebert"]["state"] == "ready"
+        assert components["faiss"]["state"] == "ready"
+        assert components["reranker"]["state"] == "failed"
+        assert all(c["load_s"] is not None for c in components.values())
+
+
+def test_rank_serves_heuristics_while_models_load(hf, loaders):
+    with TestClient(hf.app) as client:
+        assert client.get("/ready").status_code == 503
+        assert client.get("/health").json()["models_loading"] is True
+
+        response = client.post("/rank", json={"pr_id": "1", "repo": "o/r", "files": FILES})
+        assert response.status_code == 200
+        ranked = response.json()["ranked_files"]
+        expected = sorted(
+            hf.score_files([hf.FileInput(**f) for f in FILES], 45, embed=False),
+            key=lambda x: x["final_score"], reverse=True,
+        )
+        assert [{k: v for k, v in r.items() if k != "rank"} for r in ranked] == expected
+        assert ranked[0]["filename"] == "src/auth/session.py"
+        assert all("CodeBERT" not in r["explanation"] for r in ranked)
@@ -0,0 +1,112 @@
+import hashlib
+import math
+import random
+
+import numpy as np
+import pytest
+
+from ml import heuristics
+
+
+def _fake_embed(texts):
+    """Deterministic stand-in for CodeBERT: a float32 vector seeded by each text."""
+    rows = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+        rows.append(np.random.default_rng(seed).normal(0.0, 0.2, 768).astype(np.float32))
+    return np.vstack(rows)
+
+
+def _legacy_score_file(hf, f, total_changes, embedder_ready):
+    """The per-file scorer the batched ``score_files`` replaced, kept as the reference."""
+    path = heuristics.path_score(f.filename)
+    if total_changes == 0:
+        size = 0.5
+    else:
+        size = 1 / (1 + math.exp(-5 * ((f.additions + f.deletions) / max(total_changes, 1) - 0.3)))
+    sec = heuristics.security_score(f.filename)
+    raw = 0.3 * path + 0.3 * size + 0.4 * sec
+    raw *= heuristics.penalty_for_test(f.filename)
+    raw *= heuristics.penalty_for_config(f.filename, f.additions, f.deletions)
+
+    emb = -1.0
+    if embedder_ready:
+        vec = _fake_embed([hf._file_text(f.filename, f.patch or "")])[0]
+        emb = float(1.0 / (1.0 + math.exp(-float(vec.mean()))))
+    if emb >= 0:
+        raw = 0.6 * raw + 0.4 * emb
+
+    score = min(max(raw, 0.0), 1.0)
+    reasons = []
+    if sec > 0:
+        reasons.append("security-sensitive path")
+    if size > 0.7:
+        reasons.append("large change")
+    if path > 0.7:
+        reasons.append("core source file")
+    if emb >= 0:
+        reasons.append("CodeBERT scored")
+    if not reasons:
+        reasons.append("standard change")
+    return {
+        "filename": f.filename,
+        "reranker_score": round(score, 4),
+        "retrieval_score": round(score * 0.9, 4),
+        "final_score": round(score, 4),
+        "label": hf._score_label(score),
+        "explanation": ", ".join(reasons).capitalize(),
+    }
+
+
+_DIRS = ["src/", "lib/auth/", "docs/", ".github/workflows/", "tests/", "config/", "app/api/", ""]
+_NAMES = ["main.py", "token_store.go", "README.md", "ci.yml", "test_login.py", "settings.json",
+          "package.lock", "oauth.ts", "util.spec.js", "CHANGELOG", "keys.toml", "view.tsx"]
+
+
+def _random_prs(hf, n_prs=200, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n_prs):
+        files = [
+            hf.FileInput(
+                filename=rng.choice(_DIRS) + rng.choice(_NAMES),
+                patch=rng.choice(["", None, "+x = 1", "-old\n+new\n" * rng.randint(1, 40)]),
+                additions=rng.choice([0, 0, 1, 5, 49, 200, rng.randint(0, 2000)]),
+                deletions=rng.choice([0, 1, 10, rng.randint(0, 500)]),
+            )
+            for _ in range(rng.randint(1, 30))
+        ]
+        total = sum(f.additions + f.deletions for f in files)
+        yield files, total
+
+
+@pytest.mark.parametrize("embedder_ready", [False, True])
+def test_score_files_matches_per_file_scorer(hf, monkeypatch, embedder_ready):
+    monkeypatch.setattr(hf, "_embedder", object() if embedder_ready else None)
+    monkeypatch.setattr(hf, "_codebert_embed", _fake_embed)
+
+    rows = 0
+    for files, total in _random_prs(hf):
+        expected = [_legacy_score_file(hf, f, total, embedder_ready) for f in files]
+        assert hf.score_files(files, total) == expected
+        rows += len(files)
+    assert rows > 2000
+
+
+def test_score_files_with_no_changed_lines(hf, monkeypatch):
+    monkeypatch.setattr(hf, "_embedder", object())
+    monkeypatch.setattr(hf, "_codebert_embed", _fake_embed)
+    files = [hf.FileInput(filename=name, additions=0, deletions=0) for name in _NAMES]
+
+    assert hf.score_files(files, 0) == [_legacy_score_file(hf, f, 0, True) for f in files]
+    assert hf.score_file(files[0], 0) == _legacy_score_file(hf, files[0], 0, True)
+
+
+def test_embedder_failure_falls_back_to_features(hf, monkeypatch):
+    def broken(texts):
+        raise RuntimeError("CUDA out of memory")
+
+    monkeypatch.setattr(hf, "_embedder", object())
+    monkeypatch.setattr(hf, "_codebert_embed", broken)
+    files = [hf.FileInput(filename="src/auth.py", additions=3), hf.FileInput(filename="docs/x.md")]
+
+    assert hf.score_files(files, 3) == [_legacy_score_file(hf, f, 3, False) for f in files]
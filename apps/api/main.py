@@ -1,13 +1,17 @@
+import asyncio
 import logging
 import logging.config
+import os
 import sys
+import time
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
-from routers import health, ranking, clustering, retrieval, webhooks
+from routers import analysis, health, ranking, clustering, retrieval, webhooks
+from ml.telemetry import get_telemetry
 
 load_dotenv()
 
@@ -26,10 +30,21 @@ async def lifespan(app: FastAPI):
     from services.queue_service import get_queue_service
     queue = get_queue_service()
     await queue.start()
+
+    # Preload + warm models off the event loop; /ready reports 503 until done
+    warmup_task = None
+    if os.environ.get("MODEL_PRELOAD", "1") != "0":
+        from services.model_registry import get_model_registry
+        warmup_task = asyncio.create_task(asyncio.to_thread(get_model_registry().ensure_loaded))
+
     logger.info("Assert Review API started")
     yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
     # Shutdown
     await queue.stop()
+    from services.github_service import get_github_service
+    await get_github_service().aclose()
     logger.info("Assert Review API shutting down")
 
 
@@ -51,8 +66,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def track_latency(request: Request, call_next):
+    """Per-route latency histogram and status-code counter for /metrics."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        telemetry = get_telemetry()
+        telemetry.observe("request_latency_ms", (time.perf_counter() - start) * 1000,
+                          help="End-to-end request latency in milliseconds.", endpoint=endpoint)
+        telemetry.inc("requests_total", help="Requests served, by route and status code.",
+                      endpoint=endpoint, status=status)
+
+
 app.include_router(health.router)
 app.include_router(ranking.router)
 app.include_router(clustering.router)
 app.include_router(retrieval.router)
+app.include_router(analysis.router)
 app.include_router(webhooks.router)
@@ -54,3 +54,23 @@ class RetrieveRequest(BaseModel):
 
 class RetrieveResponse(BaseModel):
     results: list[dict]
+
+
+class AnalyzeRequest(BaseModel):
+    pr_id: str
+    repo: str
+    files: list[FileInput]
+    k: int = 5
+
+
+class SimilarHunks(BaseModel):
+    filename: str
+    results: list[dict]
+
+
+class AnalyzeResponse(BaseModel):
+    pr_id: str
+    ranked_files: list[RankedFile]
+    groups: list[ClusterOutput]
+    similar: list[SimilarHunks]
+    timings_ms: dict[str, float]
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from models.ranking import AnalyzeRequest, AnalyzeResponse
+from services.ml_service import get_ml_service
+
+router = APIRouter(prefix="/analyze", tags=["analysis"])
+
+
+@router.post("", response_model=AnalyzeResponse)
+# Sync handler: FastAPI runs it in the threadpool, so the model pass never blocks the event loop
+def analyze_pr(request: AnalyzeRequest):
+    """Rank, cluster and retrieve similar hunks for a PR in one pass."""
+    ml = get_ml_service()
+    result = ml.analyze_pr(
+        request.pr_id,
+        request.repo,
+        [f.model_dump() for f in request.files],
+        request.k,
+    )
+    return AnalyzeResponse(**result)
@@ -6,7 +6,7 @@ router = APIRouter(prefix="/cluster", tags=["clustering"])
 
 
 @router.post("", response_model=ClusterResponse)
-async def cluster_pr(request: ClusterRequest):
+def cluster_pr(request: ClusterRequest):
     """Cluster PR files into semantic groups."""
     ml = get_ml_service()
     result = ml.cluster_pr(
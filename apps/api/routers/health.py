@@ -1,4 +1,8 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from services.model_registry import get_model_registry
+from ml.telemetry import get_telemetry
 
 router = APIRouter(tags=["health"])
 
@@ -6,3 +10,16 @@ router = APIRouter(tags=["health"])
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "version": "0.1.0"}
+
+
+@router.get("/ready")
+async def readiness_check():
+    """503 until the model registry is loaded and warm; reports per-model load stats."""
+    registry = get_model_registry()
+    return JSONResponse(status_code=200 if registry.ready else 503, content=registry.status())
+
+
+@router.get("/metrics")
+async def metrics():
+    """Request, stage, batch-size and model-load metrics in Prometheus text format."""
+    return PlainTextResponse(get_telemetry().render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,20 @@
+import logging
 import time
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from models.ranking import RankRequest, RankResponse, RankedFile
 from services.ml_service import get_ml_service
+from ml.streaming import StreamEncoder, negotiate_stream_format
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/rank", tags=["ranking"])
 
 
 @router.post("", response_model=RankResponse)
-async def rank_pr(request: RankRequest):
+def rank_pr(request: RankRequest):
     """Rank PR files by ML-estimated importance."""
     ml = get_ml_service()
     result = ml.rank_pr(
@@ -33,3 +40,34 @@ async def rank_pr(request: RankRequest):
         ranked_files=ranked_files,
         processing_ms=result["processing_ms"],
     )
+
+
+@router.post("/stream")
+def rank_pr_stream(request: RankRequest, http_request: Request, format: Optional[str] = None):
+    """Stream the ranking as NDJSON (default) or SSE (``?format=sse`` / ``Accept: text/event-stream``).
+
+    Emits a heuristic ranking immediately, reranker scores batch by batch,
+    then the final ranking ``POST /rank`` would return.
+    """
+    try:
+        fmt = negotiate_stream_format(http_request.headers.get("accept"), format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    ml = get_ml_service()
+    encoder = StreamEncoder(fmt, "rank_stream")
+    events = ml.rank_pr_stream(request.pr_id, request.repo, [f.model_dump() for f in request.files])
+
+    def guarded():
+        try:
+            yield from events
+        except Exception as e:
+            logger.error(f"Streaming rank failed: {e}")
+            yield {"event": "error", "error": str(e), "code": "STREAM_ERROR"}
+
+    # Sync generator: Starlette iterates it in the threadpool, off the event loop
+    return StreamingResponse(
+        encoder.wrap(guarded()),
+        media_type=encoder.media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
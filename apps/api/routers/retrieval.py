@@ -6,7 +6,7 @@ router = APIRouter(prefix="/retrieve", tags=["retrieval"])
 
 
 @router.post("", response_model=RetrieveResponse)
-async def retrieve_similar(request: RetrieveRequest):
+def retrieve_similar(request: RetrieveRequest):
     """Retrieve similar historical code hunks."""
     ml = get_ml_service()
     result = ml.retrieve(request.query_diff, request.k)
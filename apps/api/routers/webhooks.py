@@ -63,10 +63,11 @@ async def github_webhook(request: Request):
             queue = get_queue_service()
             await queue.enqueue({
                 "action": "rank_pr",
+                "event": action,  # opened outranks synchronize in the queue
                 "pr_id": pr.get("number"),
                 "repo": f"{repo.get('owner', {}).get('login', '')}/{repo.get('name', '')}",
-                "files": [],  # Will be fetched by background worker
             })
+            # No "files": the queue worker fetches them through GitHubService
             logger.info(f"Enqueued PR #{pr.get('number')} for processing")
 
     return Response(status_code=200)
@@ -0,0 +1,106 @@
+"""
+Queue backend benchmark: enqueue, coalesced-enqueue and claim+ack throughput
+for the in-memory and SQLite (WAL) backends of the apps/api PR queue, plus
+claim+ack with several concurrent consumer threads.
+
+Usage: python apps/api/scripts/benchmark_queue.py [--jobs 5000] [--batch-sizes 1 8 32] [--consumers 4]
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Add apps/api to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from services.queue_backends import MemoryQueueBackend, SQLiteQueueBackend  # noqa: E402
+
+
+def _item(pr: int) -> dict:
+    return {"action": "rank_pr", "event": "synchronize", "pr_id": pr, "repo": "bench/repo", "files": []}
+
+
+def _backends(tmp: Path, jobs: int):
+    n = 0
+
+    def make(kind: str):
+        nonlocal n
+        n += 1
+        if kind == "memory":
+            return MemoryQueueBackend(maxsize=jobs * 2)
+        return SQLiteQueueBackend(tmp / f"queue-{n}.sqlite3", maxsize=jobs * 2)
+
+    return make
+
+
+def _fill(backend, jobs: int) -> float:
+    t0 = time.perf_counter()
+    for pr in range(jobs):
+        backend.put(_item(pr), f"rank_pr:bench/repo#{pr}", 1)
+    return time.perf_counter() - t0
+
+
+def _drain(backend, batch_size: int) -> float:
+    t0 = time.perf_counter()
+    while jobs := backend.claim(batch_size, 60):
+        backend.ack([job.id for job in jobs])
+    return time.perf_counter() - t0
+
+
+def _drain_concurrent(backend, batch_size: int, consumers: int) -> float:
+    def consume():
+        while jobs := backend.claim(batch_size, 60):
+            backend.ack([job.id for job in jobs])
+
+    threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def run_benchmark(jobs: int, batch_sizes: list[int], consumers: int) -> list[dict]:
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        make = _backends(Path(tmp), jobs)
+        for kind in ("memory", "sqlite"):
+            backend = make(kind)
+            rows.append({"backend": kind, "op": "enqueue", "batch": "-", "consumers": 1,
+                         "ops_per_s": jobs / _fill(backend, jobs)})
+            rows.append({"backend": kind, "op": "enqueue (coalesced)", "batch": "-", "consumers": 1,
+                         "ops_per_s": jobs / _fill(backend, jobs)})
+            _drain(backend, 1024)
+            for batch_size in batch_sizes:
+                backend = make(kind)
+                _fill(backend, jobs)
+                rows.append({"backend": kind, "op": "claim+ack", "batch": batch_size, "consumers": 1,
+                             "ops_per_s": jobs / _drain(backend, batch_size)})
+            if consumers > 1:
+                backend = make(kind)
+                _fill(backend, jobs)
+                rows.append({"backend": kind, "op": "claim+ack", "batch": batch_sizes[-1], "consumers": consumers,
+                             "ops_per_s": jobs / _drain_concurrent(backend, batch_sizes[-1], consumers)})
+    return rows
+
+
+def print_table(rows: list[dict], jobs: int) -> None:
+    print(f"\n{jobs} jobs per run\n")
+    print("| Backend | Operation | Batch | Consumers | Jobs/s |")
+    print("|---------|-----------|-------|-----------|--------|")
+    for r in rows:
+        print(f"| {r['backend']} | {r['op']} | {r['batch']} | {r['consumers']} | {r['ops_per_s']:,.0f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PR queue backend throughput benchmark")
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--consumers", type=int, default=4)
+    args = parser.parse_args()
+    print_table(run_benchmark(args.jobs, args.batch_sizes, args.consumers), args.jobs)
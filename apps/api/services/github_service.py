@@ -1,33 +1,252 @@
 """
 GitHub API client using httpx.
+
+One long-lived ``AsyncClient`` per service (HTTP/2 when ``h2`` is installed,
+keep-alive connection pool otherwise), so webhook bursts reuse connections
+instead of paying a TLS handshake per call. Every request first takes a token
+from ``RateLimiter``, a token bucket whose level follows GitHub's
+``X-RateLimit-*`` headers. PR file lists are paginated; the first page's
+``Link`` header gives the page count and the remaining pages are fetched
+concurrently under a semaphore.
+
+Responses go through the shared on-disk conditional cache
+(``ml.data.http_cache``): a re-fetch of an unchanged page is a 304, served
+from disk, that costs no rate-limit budget. Hits and misses are counted in
+``github_requests_total{cache=...}``.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
+import re
+import tempfile
+import time
 
 import httpx
 
+from ml.data.http_cache import HTTPCache, open_http_cache
+from ml.telemetry import get_telemetry
+
 logger = logging.getLogger(__name__)
 
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+PER_PAGE = 100
+MAX_FILE_PAGES = 30  # GitHub lists at most 3000 files per PR
+MAX_RETRIES = 3
+DEFAULT_HTTP_CACHE_PATH = os.path.join(tempfile.gettempdir(), "assert-review-github-cache.sqlite3")
+_LAST_PAGE = re.compile(r'<[^>]*[?&]page=(\d+)[^>]*>;\s*rel="last"')
+
+
+class GitHubAPIError(RuntimeError):
+    def __init__(self, status_code: int, url: str):
+        super().__init__(f"GitHub API error {status_code} for {url}")
+        self.status_code = status_code
+
+
+class RateLimiter:
+    """Token bucket sized to the GitHub rate-limit window.
+
+    Holds up to ``limit`` tokens and refills at ``limit`` per hour. Each
+    response's ``X-RateLimit-Remaining`` resets the level (less requests still
+    in flight), so the bucket tracks the server's count rather than drifting.
+    At zero remaining it blocks until ``X-RateLimit-Reset``, when the bucket is
+    full again; ``Retry-After`` (secondary limits) blocks for the given number
+    of seconds.
+    """
+
+    WINDOW_S = 3600.0
+
+    def __init__(self, limit: int = 5000):
+        self.limit = limit
+        self.tokens = float(limit)
+        self.in_flight = 0
+        self.blocked_until = 0.0  # wall clock
+        self.reset_at = 0.0  # wall clock; set while the primary budget is exhausted
+        self.waits = 0
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        if self.reset_at and time.time() >= self.reset_at:
+            self.tokens = float(self.limit)
+            self.reset_at = 0.0
+        now = time.monotonic()
+        self.tokens = min(float(self.limit), self.tokens + (now - self._updated) * self.limit / self.WINDOW_S)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            blocked = self.blocked_until - time.time()
+            if blocked <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                self.in_flight += 1
+                return
+            self.waits += 1
+            # Blocked: wait it out (a primary reset refills the bucket); else until the next token
+            wait = blocked if blocked > 0 else (1 - self.tokens) * self.WINDOW_S / self.limit
+            logger.warning(f"GitHub rate limit: waiting {wait:.1f}s")
+            await asyncio.sleep(min(wait, 60.0))
+
+    def release(self, headers: httpx.Headers | None = None) -> None:
+        """Return an in-flight slot and sync the bucket with the response's rate-limit headers."""
+        self.in_flight = max(0, self.in_flight - 1)
+        if headers is None:
+            return
+        self._refill()
+        if "X-RateLimit-Limit" in headers:
+            self.limit = max(1, int(headers["X-RateLimit-Limit"]))
+        if "X-RateLimit-Remaining" in headers:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            self.tokens = float(max(0, remaining - self.in_flight))
+            if remaining <= 0 and "X-RateLimit-Reset" in headers:
+                self.reset_at = float(headers["X-RateLimit-Reset"])
+                self.blocked_until = max(self.blocked_until, self.reset_at)
+        if "Retry-After" in headers:
+            self.blocked_until = max(self.blocked_until, time.time() + float(headers["Retry-After"]))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "tokens": round(self.tokens, 1),
+            "in_flight": self.in_flight,
+            "blocked_for_s": round(max(0.0, self.blocked_until - time.time()), 1),
+            "waits": self.waits,
+        }
+
 
 class GitHubService:
-    def __init__(self, token: str | None = None):
+    def __init__(
+        self,
+        token: str | None = None,
+        base_url: str | None = None,
+        max_connections: int = 20,
+        page_concurrency: int = 8,
+        cache: HTTPCache | None = None,
+    ):
         self.token = token or os.environ.get("GITHUB_TOKEN", "")
-        self.base_url = "https://api.github.com"
+        self.base_url = (base_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")).rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Accept": "application/vnd.github+json",
             "X-GitHub-Api-Version": "2022-11-28",
         }
+        self.max_connections = max_connections
+        self.page_concurrency = page_concurrency
+        self.rate_limiter = RateLimiter(limit=5000 if self.token else 60)
+        self.cache = cache if cache is not None else open_http_cache(DEFAULT_HTTP_CACHE_PATH)
+        self._telemetry = get_telemetry()
+        self._client: httpx.AsyncClient | None = None
 
-    async def get_pr_files(self, owner: str, repo: str, pr_number: int) -> list[dict]:
-        """Fetch files changed in a PR."""
-        async with httpx.AsyncClient(headers=self.headers, timeout=30.0) as client:
-            resp = await client.get(
-                f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/files"
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=30.0,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60.0,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _send(self, url: str, params: dict | None, headers: dict | None) -> httpx.Response:
+        await self.rate_limiter.acquire()
+        resp_headers = None
+        try:
+            resp = await self.client.get(url, params=params, headers=headers)
+            resp_headers = resp.headers
+        finally:
+            self.rate_limiter.release(resp_headers)
+        return resp
+
+    async def _get(self, path: str, params: dict | None = None) -> httpx.Response:
+        """Rate-limited GET; retries secondary rate limits (403/429 with ``Retry-After``)."""
+        url = f"{self.base_url}{path}"
+        key = self.cache.key(url, params, self.headers) if self.cache is not None else None
+        for attempt in range(MAX_RETRIES):
+            conditional = self.cache.conditional_headers(key) if key is not None else None
+            resp = await self._send(url, params, conditional)
+            if key is not None and resp.status_code in (200, 304):
+                resp = self.cache.resolve(key, resp)
+                if resp.status_code == 304:
+                    # Entry evicted after its validators were sent: fetch the body once more
+                    logger.info(f"GitHub cache entry for {url} gone before its 304, refetching")
+                    resp = await self._send(url, params, None)
+                    if resp.status_code == 200:
+                        resp = self.cache.resolve(key, resp)
+                hit = resp.headers.get("X-Cache") == "HIT"
+                self._telemetry.inc("github_requests_total", help="GitHub API GETs, by conditional-cache outcome.",
+                                    cache="hit" if hit else "miss")
+            limited = resp.status_code == 429 or (
+                resp.status_code == 403 and (
+                    "Retry-After" in resp.headers or resp.headers.get("X-RateLimit-Remaining") == "0"
+                )
             )
+            if not limited:
+                return resp
+            logger.warning(f"GitHub rate limited {url} (attempt {attempt + 1}/{MAX_RETRIES})")
+        return resp
+
+    async def get_pr_files(self, owner: str, repo: str, pr_number: int) -> list[dict]:
+        """Fetch all files changed in a PR; pages after the first are fetched concurrently.
+
+        Returns ``[]`` if the PR does not exist; raises ``GitHubAPIError`` on other failures.
+        """
+        path = f"/repos/{owner}/{repo}/pulls/{pr_number}/files"
+        first = await self._get(path, {"per_page": PER_PAGE, "page": 1})
+        if first.status_code == 404:
+            logger.warning(f"PR {owner}/{repo}#{pr_number} not found")
+            return []
+        if first.status_code != 200:
+            raise GitHubAPIError(first.status_code, path)
+
+        match = _LAST_PAGE.search(first.headers.get("Link", ""))
+        last_page = min(int(match.group(1)), MAX_FILE_PAGES) if match else 1
+        if last_page == 1:
+            files = first.json()
+            self._log_fetch(owner, repo, pr_number, files, 1)
+            return files
+
+        semaphore = asyncio.Semaphore(self.page_concurrency)
+
+        async def fetch(page: int) -> list[dict]:
+            async with semaphore:
+                resp = await self._get(path, {"per_page": PER_PAGE, "page": page})
             if resp.status_code != 200:
-                logger.warning(f"GitHub API error {resp.status_code} for PR files")
-                return []
+                raise GitHubAPIError(resp.status_code, f"{path}?page={page}")
             return resp.json()
+
+        pages = await asyncio.gather(*(fetch(page) for page in range(2, last_page + 1)))
+        files = list(first.json())
+        for page in pages:
+            files.extend(page)
+        self._log_fetch(owner, repo, pr_number, files, last_page)
+        return files
+
+    def _log_fetch(self, owner: str, repo: str, pr_number: int, files: list[dict], pages: int) -> None:
+        cache = f", cache hit rate {self.cache.stats()['hit_rate']:.0%}" if self.cache is not None else ""
+        logger.info(f"Fetched {len(files)} files for {owner}/{repo}#{pr_number} ({pages} pages{cache})")
+
+
+_github_service: GitHubService | None = None
+
+
+def get_github_service() -> GitHubService:
+    global _github_service
+    if _github_service is None:
+        _github_service = GitHubService()
+    return _github_service
@@ -1,108 +1,40 @@
 """
-ML service singleton — lazy-loads models on first request.
-Returns {"error": "model_not_loaded", "status": "unavailable"} with 503 if models not ready.
+ML service singleton — serves requests from the shared ModelRegistry.
+Models are preloaded and warmed at startup (see main.lifespan) or, without a
+lifespan hook, loaded once on the first request.
 """
 from __future__ import annotations
 
 import logging
-import os
-import sys
 import time
-from pathlib import Path
-from typing import Any
-
-logger = logging.getLogger(__name__)
-
-# Add project root to path so ml/ package is importable
-_PROJECT_ROOT = Path(__file__).parent.parent.parent.parent
-if str(_PROJECT_ROOT) not in sys.path:
-    sys.path.insert(0, str(_PROJECT_ROOT))
 
+import numpy as np
 
-class MLService:
-    """Singleton that lazy-loads ML models."""
-
-    def __init__(self):
-        self._reranker: Any = None
-        self._index: Any = None
-        self._reranker_loaded = False
-        self._index_loaded = False
+from services.model_registry import ModelRegistry, get_model_registry
+from services.pr_result_store import FileScore, PRResultStore, file_content_hash
+from ml.heuristics import file_features
+from ml.telemetry import timed
 
-    def _load_reranker(self) -> None:
-        if self._reranker_loaded:
-            return
-        try:
-            from ml.models.reranker import Reranker
-            t0 = time.time()
-            self._reranker = Reranker()
-            logger.info(f"Reranker loaded in {time.time()-t0:.2f}s (zero_shot={self._reranker._zero_shot})")
-        except Exception as e:
-            logger.warning(f"Could not load reranker: {e}")
-            self._reranker = None
-        self._reranker_loaded = True
-
-    def _load_index(self) -> None:
-        if self._index_loaded:
-            return
-        try:
-            from ml.models.index import PRIndex
-
-            # Detect Vercel environment
-            if os.environ.get("VERCEL"):
-                index_path = Path("/tmp/hunk_index.faiss")
-            else:
-                index_path = _PROJECT_ROOT / "ml" / "models" / "faiss" / "hunk_index.faiss"
-
-            if index_path.exists():
-                t0 = time.time()
-                self._index = PRIndex()
-                self._index.load(str(index_path))
-                logger.info(f"FAISS index loaded ({self._index.size} vectors) in {time.time()-t0:.2f}s")
-            else:
-                logger.info(f"No FAISS index found at {index_path}. Retrieval will be unavailable.")
-                self._index = None
-        except Exception as e:
-            logger.warning(f"Could not load FAISS index: {e}")
-            self._index = None
-        self._index_loaded = True
+logger = logging.getLogger(__name__)
 
-    def rank_pr(self, pr_id: str, repo: str, files: list[dict]) -> dict:
-        """Rank files in a PR by importance."""
-        self._load_reranker()
-        self._load_index()
 
-        if not files:
-            return {"pr_id": pr_id, "ranked_files": [], "processing_ms": 0}
+class MLService:
+    """Singleton request handler over the process-wide model registry."""
 
-        t0 = time.time()
+    def __init__(self, registry: ModelRegistry | None = None):
+        self._registry = registry or get_model_registry()
 
-        # Build texts for scoring
-        texts = [
+    @staticmethod
+    def _file_texts(files: list[dict]) -> list[str]:
+        return [
             f"<file>{f.get('filename','')}</file>"
             f"<diff>{(f.get('patch','') or '')[:512]}</diff>"
             for f in files
         ]
 
-        # Reranker scores
-        if self._reranker:
-            reranker_scores = self._reranker.score(texts)
-        else:
-            reranker_scores = [0.5] * len(files)
-
-        # Retrieval scores (if index available)
-        retrieval_scores = [0.0] * len(files)
-        if self._index:
-            try:
-                from ml.models.embedder import CodeEmbedder
-                embedder = CodeEmbedder()
-                for i, text in enumerate(texts):
-                    emb = embedder.embed_single(text)
-                    results = self._index.search(emb, k=3)
-                    retrieval_scores[i] = float(results[0].score) if results else 0.0
-            except Exception as e:
-                logger.warning(f"Retrieval scoring failed: {e}")
-
-        # Blend scores (60% reranker, 40% retrieval)
+    @staticmethod
+    def _build_ranked(files: list[dict], reranker_scores, retrieval_scores) -> list[dict]:
+        """Blend scores (60% reranker, 40% retrieval), explain, sort and rank."""
         ranked_files = []
         for i, f in enumerate(files):
             r_score = reranker_scores[i]
@@ -132,7 +64,84 @@ class MLService:
         ranked_files.sort(key=lambda x: x["final_score"], reverse=True)
         for rank, rf in enumerate(ranked_files, 1):
             rf["rank"] = rank
+        return ranked_files
+
+    @staticmethod
+    def _top1_scores(hits) -> list[float]:
+        if not hits.ids.shape[1]:
+            return [0.0] * len(hits.ids)
+        top = np.where(hits.ids[:, 0] >= 0, hits.scores[:, 0], 0.0)
+        return top.astype(float).tolist()
+
+    @staticmethod
+    def _groups(embeddings: np.ndarray, files: list[dict]) -> list[dict]:
+        from ml.models.clusterer import SemanticClusterer
+
+        metadata = [{"filename": f.get("filename", "")} for f in files]
+        with timed("hdbscan"):
+            clusters = SemanticClusterer().cluster(embeddings, metadata)
+        return [
+            {
+                "cluster_id": c.cluster_id,
+                "label": c.label,
+                "files": c.files,
+                "coherence": c.coherence,
+            }
+            for c in clusters
+        ]
 
+    @staticmethod
+    def _singleton_groups(files: list[dict]) -> list[dict]:
+        return [
+            {"cluster_id": i, "label": f.get("filename","").split("/")[-1],
+             "files": [f.get("filename","")], "coherence": 1.0}
+            for i, f in enumerate(files)
+        ]
+
+    def _score_files(self, files: list[dict], endpoint: str) -> tuple[list[float], list[float]]:
+        """Per-file reranker and top-1 retrieval scores (0.5 / 0.0 when a model is missing)."""
+        reg = self._registry
+        texts = self._file_texts(files)
+
+        # Reranker scores
+        with timed("rerank", endpoint=endpoint):
+            if reg.reranker:
+                reranker_scores = reg.reranker.score(texts)
+            else:
+                reranker_scores = [0.5] * len(files)
+
+        # Retrieval scores (if index available)
+        retrieval_scores = [0.0] * len(files)
+        if reg.index and reg.embedder:
+            try:
+                # One batched forward pass + one FAISS call for the whole batch
+                with timed("embed", endpoint=endpoint):
+                    embeddings = reg.embedder.embed(texts)
+                with timed("faiss_search", endpoint=endpoint):
+                    hits = reg.index.search_batch(embeddings, k=1)
+                retrieval_scores = self._top1_scores(hits)
+            except Exception as e:
+                logger.warning(f"Retrieval scoring failed: {e}")
+        return list(reranker_scores), retrieval_scores
+
+    def _scorer_key(self) -> str:
+        """Which models produce ``_score_files`` output; cached scores are only reused under the same key."""
+        reg = self._registry
+        reranker = type(reg.reranker).__name__ if reg.reranker else "none"
+        retrieval = "faiss" if reg.index and reg.embedder else "none"
+        return f"{reranker}/{retrieval}"
+
+    def rank_pr(self, pr_id: str, repo: str, files: list[dict]) -> dict:
+        """Rank files in a PR by importance."""
+        reg = self._registry
+        reg.ensure_loaded()
+
+        if not files:
+            return {"pr_id": pr_id, "ranked_files": [], "processing_ms": 0}
+
+        t0 = time.time()
+        reranker_scores, retrieval_scores = self._score_files(files, "rank")
+        ranked_files = self._build_ranked(files, reranker_scores, retrieval_scores)
         processing_ms = int((time.time() - t0) * 1000)
         return {
             "pr_id": pr_id,
@@ -140,62 +149,223 @@ class MLService:
             "processing_ms": processing_ms,
         }
 
-    def cluster_pr(self, pr_id: str, files: list[dict]) -> dict:
-        """Cluster PR files into semantic groups."""
+    @staticmethod
+    def _heuristic_scores(files: list[dict]) -> list[float]:
+        """Model-free priority: the ``ml.heuristics`` features the Space's ``score_files`` also uses."""
+        additions = [f.get("additions", 0) for f in files]
+        deletions = [f.get("deletions", 0) for f in files]
+        scores = file_features(
+            [f.get("filename", "") for f in files], additions, deletions, sum(additions) + sum(deletions)
+        )["score"]
+        return [round(float(s), 4) for s in scores]
+
+    def rank_pr_stream(self, pr_id: str, repo: str, files: list[dict], batch_size: int = 32):
+        """``rank_pr`` as a stream of events: heuristic, one ``refined`` per reranker batch, final.
+
+        The heuristic event is yielded before any model is loaded or called; the
+        final event carries the same ranking ``rank_pr`` returns.
+        """
         t0 = time.time()
+        heuristic = self._heuristic_scores(files)
+        order = sorted(range(len(files)), key=lambda i: heuristic[i], reverse=True)
+        yield {
+            "event": "heuristic",
+            "pr_id": pr_id,
+            "ranked_files": [
+                {"rank": rank, "filename": files[i].get("filename", ""), "final_score": heuristic[i]}
+                for rank, i in enumerate(order, 1)
+            ],
+        }
 
-        try:
-            from ml.models.clusterer import SemanticClusterer
-            from ml.models.embedder import CodeEmbedder
-            import numpy as np
+        self._registry.ensure_loaded()
+        reranker_scores: list[float] = []
+        retrieval_scores: list[float] = []
+        for batch_index, start in enumerate(range(0, len(files), batch_size)):
+            batch = files[start:start + batch_size]
+            batch_reranker, batch_retrieval = self._score_files(batch, "rank_stream")
+            reranker_scores.extend(batch_reranker)
+            retrieval_scores.extend(batch_retrieval)
+            yield {
+                "event": "refined",
+                "batch": batch_index,
+                "files": [
+                    {"filename": f.get("filename", ""), "reranker_score": round(r, 4),
+                     "retrieval_score": round(ret, 4)}
+                    for f, r, ret in zip(batch, batch_reranker, batch_retrieval)
+                ],
+            }
+
+        yield {
+            "event": "final",
+            "pr_id": pr_id,
+            "ranked_files": self._build_ranked(files, reranker_scores, retrieval_scores),
+            "processing_ms": int((time.time() - t0) * 1000),
+        }
+
+    def rank_pr_incremental(self, pr_id: str, repo: str, files: list[dict], store: PRResultStore) -> dict:
+        """``rank_pr`` that only scores files whose content changed since the PR was last ranked.
 
+        Unchanged files reuse their stored scores; the merged set is blended and
+        sorted exactly as ``rank_pr`` would. The result carries an
+        ``incremental`` block with scored/skipped counts and the hit ratio.
+        """
+        return self.rank_prs_incremental([(pr_id, repo, files)], store)[0]
+
+    def rank_prs_incremental(self, prs: list[tuple[str, str, list[dict]]], store: PRResultStore) -> list[dict]:
+        """``rank_pr_incremental`` for several ``(pr_id, repo, files)`` with one scoring pass.
+
+        The changed files of every PR go through the reranker (and embedder +
+        FAISS) together, so a batch of queued PRs costs one model call.
+        """
+        self._registry.ensure_loaded()
+        t0 = time.time()
+        scorer = self._scorer_key()
+
+        plans = []
+        stale_files: list[dict] = []
+        for pr_id, repo, files in prs:
+            cached = store.get(repo, pr_id, scorer)
+            hashes = [file_content_hash(f) for f in files]
+            reranker_scores = [0.0] * len(files)
+            retrieval_scores = [0.0] * len(files)
+            stale = []
+            for i, f in enumerate(files):
+                hit = cached.get(f.get("filename", ""))
+                if hit is not None and hit.content_hash == hashes[i]:
+                    reranker_scores[i], retrieval_scores[i] = hit.reranker_score, hit.retrieval_score
+                else:
+                    stale.append(i)
+            stale_files.extend(files[i] for i in stale)
+            plans.append((pr_id, repo, files, hashes, stale, reranker_scores, retrieval_scores))
+
+        fresh_reranker, fresh_retrieval = self._score_files(stale_files, "rank") if stale_files else ([], [])
+
+        results, offset = [], 0
+        for pr_id, repo, files, hashes, stale, reranker_scores, retrieval_scores in plans:
+            for j, i in enumerate(stale, offset):
+                reranker_scores[i], retrieval_scores[i] = fresh_reranker[j], fresh_retrieval[j]
+            offset += len(stale)
+            store.put(repo, pr_id, scorer, {
+                f.get("filename", ""): FileScore(h, reranker_scores[i], retrieval_scores[i])
+                for i, (f, h) in enumerate(zip(files, hashes))
+            })
+            skipped = len(files) - len(stale)
+            results.append({
+                "pr_id": pr_id,
+                "ranked_files": self._build_ranked(files, reranker_scores, retrieval_scores) if files else [],
+                "processing_ms": int((time.time() - t0) * 1000),
+                "incremental": {
+                    "files_total": len(files),
+                    "files_scored": len(stale),
+                    "files_skipped": skipped,
+                    "hit_ratio": round(skipped / len(files), 4) if files else 0.0,
+                },
+            })
+        return results
+
+    def cluster_pr(self, pr_id: str, files: list[dict]) -> dict:
+        """Cluster PR files into semantic groups."""
+        try:
             if not files:
                 return {"pr_id": pr_id, "groups": []}
 
+            reg = self._registry
+            reg.ensure_loaded()
+            if reg.embedder is None:
+                raise RuntimeError("embedder not available")
+
             texts = [
                 f"// {f.get('filename','')}\n{(f.get('patch','') or '')[:256]}"
                 for f in files
             ]
-
-            embedder = CodeEmbedder()
-            embeddings = embedder.embed(texts)
-            metadata = [{"filename": f.get("filename", "")} for f in files]
-
-            clusterer = SemanticClusterer()
-            clusters = clusterer.cluster(embeddings, metadata)
-
-            groups = [
-                {
-                    "cluster_id": c.cluster_id,
-                    "label": c.label,
-                    "files": c.files,
-                    "coherence": c.coherence,
-                }
-                for c in clusters
-            ]
+            with timed("embed", endpoint="cluster"):
+                embeddings = reg.embedder.embed(texts)
+            groups = self._groups(embeddings, files)
 
         except Exception as e:
             logger.warning(f"Clustering failed: {e}")
-            groups = [
-                {"cluster_id": i, "label": f.get("filename","").split("/")[-1],
-                 "files": [f.get("filename","")], "coherence": 1.0}
-                for i, f in enumerate(files)
-            ]
+            groups = self._singleton_groups(files)
 
         return {"pr_id": pr_id, "groups": groups}
 
+    def analyze_pr(self, pr_id: str, repo: str, files: list[dict], k: int = 5) -> dict:
+        """Rank, cluster and find similar hunks for a PR from one embedding pass.
+
+        Each file is encoded once; the same matrix feeds the retrieval half of
+        the ranking blend, HDBSCAN grouping and the per-file FAISS lookup.
+        """
+        reg = self._registry
+        reg.ensure_loaded()
+        if not files:
+            return {"pr_id": pr_id, "ranked_files": [], "groups": [], "similar": [],
+                    "timings_ms": {"total": 0.0}}
+
+        timings: dict[str, float] = {}
+        texts = self._file_texts(files)
+
+        with timed("total", endpoint="analyze") as total:
+            embeddings = None
+            with timed("embed", endpoint="analyze") as t:
+                if reg.embedder:
+                    try:
+                        embeddings = reg.embedder.embed(texts)
+                    except Exception as e:
+                        logger.warning(f"Embedding failed: {e}")
+            timings["embed"] = t.ms
+
+            with timed("rerank", endpoint="analyze") as t:
+                reranker_scores = reg.reranker.score(texts) if reg.reranker else [0.5] * len(files)
+            timings["rerank"] = t.ms
+
+            retrieval_scores = [0.0] * len(files)
+            similar: list[dict] = [{"filename": f.get("filename", ""), "results": []} for f in files]
+            with timed("faiss_search", endpoint="analyze") as t:
+                if reg.index and embeddings is not None:
+                    try:
+                        hits = reg.index.search_batch(embeddings, k=max(k, 1))
+                        retrieval_scores = self._top1_scores(hits)
+                        for i, entry in enumerate(similar):
+                            results = reg.index.materialize(hits.scores[i], hits.ids[i])[:k]
+                            entry["results"] = [r.model_dump() for r in results]
+                    except Exception as e:
+                        logger.warning(f"Retrieval failed: {e}")
+            timings["retrieve"] = t.ms
+
+            with timed("cluster", endpoint="analyze") as t:
+                try:
+                    if embeddings is None:
+                        raise RuntimeError("embedder not available")
+                    groups = self._groups(embeddings, files)
+                except Exception as e:
+                    logger.warning(f"Clustering failed: {e}")
+                    groups = self._singleton_groups(files)
+            timings["cluster"] = t.ms
+
+            ranked_files = self._build_ranked(files, reranker_scores, retrieval_scores)
+        timings["total"] = total.ms
+        return {
+            "pr_id": pr_id,
+            "ranked_files": ranked_files,
+            "groups": groups,
+            "similar": similar,
+            "timings_ms": timings,
+        }
+
     def retrieve(self, query_diff: str, k: int = 10) -> dict:
         """Retrieve similar historical hunks."""
-        self._load_index()
+        reg = self._registry
+        reg.ensure_loaded()
 
-        if not self._index:
+        if not reg.index:
             return {"results": [], "error": "index_not_loaded"}
+        if not reg.embedder:
+            return {"results": [], "error": "embedder_not_loaded"}
 
         try:
-            from ml.models.embedder import CodeEmbedder
-            embedder = CodeEmbedder()
-            query_emb = embedder.embed_single(query_diff)
-            results = self._index.search(query_emb, k=k)
+            with timed("embed", endpoint="retrieve"):
+                query_emb = reg.embedder.embed_single(query_diff)
+            with timed("faiss_search", endpoint="retrieve"):
+                results = reg.index.search(query_emb, k=k)
             return {
                 "results": [r.model_dump() for r in results]
             }
@@ -0,0 +1,179 @@
+"""
+Process-wide model registry — owns one embedder, reranker and FAISS index.
+
+Loaded and warmed once (from the FastAPI lifespan hook, or lazily on the first
+request when there is no lifespan, e.g. on Vercel) so every request reuses the
+same weights instead of reloading CodeBERT from disk.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = Path(__file__).parent.parent.parent.parent
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from ml.memory import rss_mb as _rss_mb  # noqa: E402
+
+WARMUP_TEXTS = [
+    "<file>src/app.py</file><diff>+def handler(request):\n+    return None</diff>",
+    "<file>src/auth/token.py</file><diff>" + "+    token = jwt.encode(payload, secret)\n" * 40 + "</diff>",
+]
+
+
+def _torch_param_mb(model: Any) -> float | None:
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters()) / 1e6
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """Loads, warms and hands out the shared ML models.
+
+    ``state`` moves cold → loading → warm; components that fail to load are
+    recorded as unavailable and the service degrades (zero-shot reranker, no
+    retrieval) rather than failing readiness.
+    """
+
+    def __init__(self):
+        self.embedder: Any = None
+        self.reranker: Any = None
+        self.index: Any = None
+        self.state = "cold"
+        self.warmup_s: float | None = None
+        self._components: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "warm"
+
+    def ensure_loaded(self) -> None:
+        """Load and warm all models once; concurrent callers wait for the first."""
+        if self.ready:
+            return
+        with self._lock:
+            if self.ready:
+                return
+            self.state = "loading"
+            t0 = time.time()
+            self._load_embedder()
+            self._load_reranker()
+            self._load_index()
+            self._warmup()
+            self.state = "warm"
+            logger.info(f"Model registry warm in {time.time()-t0:.2f}s")
+
+    def _record(self, name: str, t0: float, rss0: float, loaded: bool, **extra: Any) -> None:
+        from ml.telemetry import get_telemetry
+
+        load_s = round(time.time() - t0, 3)
+        get_telemetry().set_gauge("model_load_seconds", load_s, help="Wall time spent loading each model component.",
+                                  component=name, state="ready" if loaded else "failed")
+        self._components[name] = {
+            "loaded": loaded,
+            "load_s": load_s,
+            "rss_delta_mb": round(_rss_mb() - rss0, 1),
+            **extra,
+        }
+
+    def _load_embedder(self) -> None:
+        t0, rss0 = time.time(), _rss_mb()
+        try:
+            from ml.models.embedder import CodeEmbedder
+            from ml.models.embedding_cache import get_embedding_cache
+            embedder = CodeEmbedder(cache=get_embedding_cache())
+            embedder._load()
+            self.embedder = embedder
+            self._record("embedder", t0, rss0, True,
+                         model=embedder.model_name, param_mb=_torch_param_mb(embedder._model))
+        except Exception as e:
+            logger.warning(f"Could not load embedder: {e}")
+            self.embedder = None
+            self._record("embedder", t0, rss0, False, error=str(e))
+
+    def _load_reranker(self) -> None:
+        t0, rss0 = time.time(), _rss_mb()
+        try:
+            from ml.models.reranker import Reranker
+            reranker = Reranker()
+            reranker._try_load()
+            self.reranker = reranker
+            backend = reranker._backend
+            param_mb = _torch_param_mb(backend.model) if hasattr(backend, "model") else None
+            if param_mb is None and hasattr(backend, "path"):
+                param_mb = backend.path.stat().st_size / 1e6
+            self._record("reranker", t0, rss0, True, zero_shot=reranker._zero_shot,
+                         backend=reranker.backend_name, param_mb=param_mb)
+        except Exception as e:
+            logger.warning(f"Could not load reranker: {e}")
+            self.reranker = None
+            self._record("reranker", t0, rss0, False, error=str(e))
+
+    def _load_index(self) -> None:
+        t0, rss0 = time.time(), _rss_mb()
+        try:
+            from ml.models.index import PRIndex
+
+            # Detect Vercel environment
+            if os.environ.get("VERCEL"):
+                index_path = Path("/tmp/hunk_index.faiss")
+            else:
+                index_path = _PROJECT_ROOT / "ml" / "models" / "faiss" / "hunk_index.faiss"
+
+            if not index_path.exists():
+                logger.info(f"No FAISS index found at {index_path}. Retrieval will be unavailable.")
+                self.index = None
+                self._record("index", t0, rss0, False, error="index file not found")
+                return
+            index = PRIndex()
+            index.load(str(index_path))
+            self.index = index
+            self._record("index", t0, rss0, True, vectors=index.size,
+                         param_mb=round(index.size * index.dim * 4 / 1e6, 1))
+        except Exception as e:
+            logger.warning(f"Could not load FAISS index: {e}")
+            self.index = None
+            self._record("index", t0, rss0, False, error=str(e))
+
+    def _warmup(self) -> None:
+        """Push dummy batches through every model so first requests hit warm kernels."""
+        t0 = time.time()
+        try:
+            if self.embedder is not None:
+                emb = self.embedder.embed(WARMUP_TEXTS)
+                if self.index is not None:
+                    self.index.search(emb[0], k=1)
+            if self.reranker is not None:
+                self.reranker.score(WARMUP_TEXTS)
+        except Exception as e:
+            logger.warning(f"Model warmup failed: {e}")
+        self.warmup_s = round(time.time() - t0, 3)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "rss_mb": round(_rss_mb(), 1),
+            "warmup_s": self.warmup_s,
+            "components": dict(self._components),
+        }
+
+
+_model_registry: ModelRegistry | None = None
+
+
+def get_model_registry() -> ModelRegistry:
+    global _model_registry
+    if _model_registry is None:
+        _model_registry = ModelRegistry()
+    return _model_registry
@@ -0,0 +1,81 @@
+"""
+Per-PR file scores for incremental re-ranking.
+
+A ``synchronize`` push usually touches a handful of files, yet the ranking
+covers the whole PR. The store remembers, for each ``(repo, pr_number)``, a
+content hash and the reranker/retrieval scores of every file, so the next event
+only scores files whose patch changed. Both scores are per-file (no
+normalization across the PR), so merged results equal a full re-rank.
+
+Entries are tagged with the scorer that produced them (which models were
+loaded); a PR scored before the models finished loading is re-scored in full.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class FileScore:
+    content_hash: str
+    reranker_score: float
+    retrieval_score: float
+
+
+def file_content_hash(f: dict) -> str:
+    """Hash of everything the scorers read from a file entry."""
+    h = hashlib.sha256()
+    for field in ("filename", "patch", "additions", "deletions"):
+        h.update(str(f.get(field) or "").encode("utf-8", "surrogatepass"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class PRResultStore:
+    """LRU of per-PR file scores, keyed by ``(repo, pr_number)``."""
+
+    def __init__(self, max_prs: int = 1000):
+        self.max_prs = max_prs
+        self._prs: OrderedDict[tuple[str, str], tuple[str, dict[str, FileScore]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, repo: str, pr_number: str, scorer: str) -> dict[str, FileScore]:
+        """Cached scores by filename; empty if unknown or scored by a different scorer."""
+        key = (repo, str(pr_number))
+        with self._lock:
+            entry = self._prs.get(key)
+            if entry is None or entry[0] != scorer:
+                return {}
+            self._prs.move_to_end(key)
+            return dict(entry[1])
+
+    def put(self, repo: str, pr_number: str, scorer: str, scores: dict[str, FileScore]) -> None:
+        """Replace the PR's entry (files no longer in the PR drop out)."""
+        key = (repo, str(pr_number))
+        with self._lock:
+            self._prs[key] = (scorer, dict(scores))
+            self._prs.move_to_end(key)
+            while len(self._prs) > self.max_prs:
+                self._prs.popitem(last=False)
+
+    def forget(self, repo: str, pr_number: str) -> None:
+        with self._lock:
+            self._prs.pop((repo, str(pr_number)), None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._prs)
+
+
+_store: PRResultStore | None = None
+
+
+def get_pr_result_store() -> PRResultStore:
+    global _store
+    if _store is None:
+        _store = PRResultStore(max_prs=int(os.environ.get("PR_RESULT_STORE_SIZE", "1000")))
+    return _store
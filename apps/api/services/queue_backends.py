@@ -0,0 +1,306 @@
+"""
+Storage backends for the PR queue.
+
+Both backends expose the same synchronous interface, called by
+``QueueService`` through ``asyncio.to_thread``:
+
+- ``put(item, key, priority)`` adds an item, or merges it into the pending item
+  with the same coalescing key (latest payload wins, higher priority kept).
+- ``claim(n, visibility_timeout_s)`` leases up to ``n`` jobs, highest priority first.
+- ``ack(ids)`` deletes finished jobs.
+- ``nack(ids, delay_s)`` makes failed jobs visible again after ``delay_s``.
+- ``take_discarded()`` returns how many jobs ``claim`` dropped after
+  ``max_attempts`` since the last call, so the service can count them.
+
+``SQLiteQueueBackend`` (the default) survives restarts and deploys. A claimed
+job that is not acked within its visibility timeout — because the worker
+crashed or the process was replaced — becomes claimable again. Delivery is
+therefore at-least-once, and processing must be idempotent; re-ranking a PR is.
+``MemoryQueueBackend`` keeps the previous in-process behaviour, for tests and
+read-only filesystems.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Protocol
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    id: int
+    item: dict
+    enqueued_at: float  # wall clock, so waits stay meaningful across restarts
+    attempts: int
+
+
+class QueueBackend(Protocol):
+    def put(self, item: dict, key: str | None, priority: int) -> str:
+        """Returns ``"queued"``, ``"coalesced"`` or ``"full"``."""
+        ...
+
+    def claim(self, n: int, visibility_timeout_s: float) -> list[Job]: ...
+
+    def ack(self, ids: list[int]) -> None: ...
+
+    def nack(self, ids: list[int], delay_s: float = 0.0) -> None: ...
+
+    def depth(self) -> int: ...
+
+    def take_discarded(self) -> int: ...
+
+
+class _DiscardCounter:
+    """Jobs dropped by ``claim`` after ``max_attempts``, until the service reads them."""
+
+    def __init__(self):
+        self._discarded = 0
+        self._discard_lock = threading.Lock()
+
+    def _count_discarded(self, n: int) -> None:
+        with self._discard_lock:
+            self._discarded += n
+
+    def take_discarded(self) -> int:
+        with self._discard_lock:
+            n, self._discarded = self._discarded, 0
+        return n
+
+
+class MemoryQueueBackend(_DiscardCounter):
+    """In-process heap with the same leasing semantics; pending items are lost on restart."""
+
+    def __init__(self, maxsize: int = 100, max_attempts: int = 5):
+        super().__init__()
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        # key -> [priority, seq, enqueued_at, item, attempts, visible_at]; the heap
+        # holds (priority, seq, key). A coalesced item keeps its seq (its place in
+        # line); a priority upgrade pushes a second heap entry and the outdated
+        # one is skipped on pop.
+        self._pending: dict[Any, list] = {}
+        self._heap: list[tuple[int, int, Any]] = []
+        self._claimed: dict[int, tuple[Any, list, float]] = {}  # id -> (key, entry, lease deadline)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def put(self, item: dict, key: str | None, priority: int) -> str:
+        with self._lock:
+            existing = self._pending.get(key) if key is not None else None
+            if existing is not None:
+                existing[3] = item
+                if priority < existing[0]:
+                    existing[0] = priority
+                    heapq.heappush(self._heap, (priority, existing[1], key))
+                return "coalesced"
+            if len(self._pending) + len(self._claimed) >= self.maxsize:
+                return "full"
+            seq = next(self._seq)
+            now = time.time()
+            self._requeue(key if key is not None else f"item:{seq}", [priority, seq, now, item, 0, now])
+            return "queued"
+
+    def _requeue(self, key: Any, entry: list) -> None:
+        # Caller holds the lock. A newer pending event for the same PR supersedes a retry.
+        if key in self._pending:
+            return
+        self._pending[key] = entry
+        heapq.heappush(self._heap, (entry[0], entry[1], key))
+
+    def claim(self, n: int, visibility_timeout_s: float) -> list[Job]:
+        now = time.time()
+        jobs, deferred = [], []
+        with self._lock:
+            for job_id, (key, entry, deadline) in list(self._claimed.items()):
+                if deadline <= now:  # lease expired: deliver again
+                    del self._claimed[job_id]
+                    self._requeue(key, entry)
+            while self._heap and len(jobs) < n:
+                priority, seq, key = heapq.heappop(self._heap)
+                entry = self._pending.get(key)
+                if entry is None or entry[0] != priority or entry[1] != seq:
+                    continue  # superseded by a priority upgrade
+                if entry[5] > now:
+                    deferred.append((priority, seq, key))
+                    continue
+                del self._pending[key]
+                if entry[4] >= self.max_attempts:
+                    logger.error(f"Discarding queue job after {self.max_attempts} attempts")
+                    self._count_discarded(1)
+                    continue
+                entry[4] += 1
+                self._claimed[seq] = (key, entry, now + visibility_timeout_s)
+                jobs.append(Job(id=seq, item=entry[3], enqueued_at=entry[2], attempts=entry[4]))
+            for heap_entry in deferred:
+                heapq.heappush(self._heap, heap_entry)
+        return jobs
+
+    def ack(self, ids: list[int]) -> None:
+        with self._lock:
+            for job_id in ids:
+                self._claimed.pop(job_id, None)
+
+    def nack(self, ids: list[int], delay_s: float = 0.0) -> None:
+        with self._lock:
+            for job_id in ids:
+                claimed = self._claimed.pop(job_id, None)
+                if claimed is not None:
+                    key, entry, _ = claimed
+                    entry[5] = time.time() + delay_s
+                    self._requeue(key, entry)
+
+    def depth(self) -> int:
+        """Jobs not yet acked (pending plus in flight)."""
+        with self._lock:
+            return len(self._pending) + len(self._claimed)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key  TEXT,
+    priority    INTEGER NOT NULL,
+    payload     TEXT    NOT NULL,
+    state       TEXT    NOT NULL DEFAULT 'ready',  -- ready | claimed
+    enqueued_at REAL    NOT NULL,
+    visible_at  REAL    NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0
+);
+-- One pending job per PR; a claimed (in-flight) job does not block a newer one
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_key ON jobs(dedupe_key) WHERE state = 'ready';
+CREATE INDEX IF NOT EXISTS jobs_claim_order ON jobs(priority, id);
+"""
+
+
+class SQLiteQueueBackend(_DiscardCounter):
+    """Durable queue in a SQLite file (WAL mode), safe across threads and processes.
+
+    Claims run in ``BEGIN IMMEDIATE`` transactions, so concurrent workers (or
+    replicas sharing the file) never lease the same visible job twice.
+    """
+
+    def __init__(self, path: str | Path, maxsize: int = 10_000, max_attempts: int = 5):
+        super().__init__()
+        self.path = str(path)
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit so transactions are explicit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, item: dict, key: str | None, priority: int) -> str:
+        conn = self._conn()
+        payload = json.dumps(item)
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if key is not None:
+                cur = conn.execute(
+                    "UPDATE jobs SET payload = ?, priority = MIN(priority, ?) "
+                    "WHERE dedupe_key = ? AND state = 'ready'",
+                    (payload, priority, key),
+                )
+                if cur.rowcount:
+                    conn.execute("COMMIT")
+                    return "coalesced"
+            (depth,) = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            if depth >= self.maxsize:
+                conn.execute("COMMIT")
+                return "full"
+            conn.execute(
+                "INSERT INTO jobs (dedupe_key, priority, payload, enqueued_at, visible_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, priority, payload, now, now),
+            )
+            conn.execute("COMMIT")
+            return "queued"
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, n: int, visibility_timeout_s: float) -> list[Job]:
+        """Lease up to ``n`` visible jobs; jobs past ``max_attempts`` are discarded."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, payload, enqueued_at, attempts FROM jobs "
+                "WHERE visible_at <= ? ORDER BY priority, id LIMIT ?",
+                (now, n),
+            ).fetchall()
+            dead = [r[0] for r in rows if r[3] >= self.max_attempts]
+            live = [r for r in rows if r[3] < self.max_attempts]
+            if dead:
+                conn.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(dead))})", dead)
+                logger.error(f"Discarding {len(dead)} queue jobs after {self.max_attempts} attempts")
+            if live:
+                conn.execute(
+                    f"UPDATE jobs SET state = 'claimed', visible_at = ?, attempts = attempts + 1 "
+                    f"WHERE id IN ({','.join('?' * len(live))})",
+                    [now + visibility_timeout_s, *(r[0] for r in live)],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if dead:
+            self._count_discarded(len(dead))
+        return [Job(id=r[0], item=json.loads(r[1]), enqueued_at=r[2], attempts=r[3] + 1) for r in live]
+
+    def ack(self, ids: list[int]) -> None:
+        if ids:
+            self._conn().execute(
+                f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(ids))}) AND state = 'claimed'", ids
+            )
+
+    def nack(self, ids: list[int], delay_s: float = 0.0) -> None:
+        """Release claimed jobs for a retry after ``delay_s``.
+
+        A job whose PR already has a newer pending event is dropped instead: the
+        pending one carries the latest payload.
+        """
+        if not ids:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for job_id in ids:
+                conn.execute(
+                    "DELETE FROM jobs WHERE id = ? AND state = 'claimed' AND dedupe_key IN "
+                    "(SELECT dedupe_key FROM jobs WHERE state = 'ready')",
+                    (job_id,),
+                )
+                conn.execute(
+                    "UPDATE jobs SET state = 'ready', visible_at = ? WHERE id = ? AND state = 'claimed'",
+                    (time.time() + delay_s, job_id),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def depth(self) -> int:
+        """Jobs not yet acked (pending plus in flight)."""
+        (depth,) = self._conn().execute("SELECT COUNT(*) FROM jobs").fetchone()
+        return depth
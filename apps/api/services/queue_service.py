@@ -1,58 +1,267 @@
 """
-In-memory asyncio.Queue for background PR processing.
+Durable priority queue for background PR processing.
+
+Items live in a ``QueueBackend`` (``services.queue_backends``): SQLite in WAL
+mode by default (``QUEUE_BACKEND=sqlite``, file at ``QUEUE_DB_PATH``, default
+``apps/api/data/queue.sqlite3``; required on Vercel), so
+pending PRs survive restarts and deploys; ``QUEUE_BACKEND=memory`` keeps them
+in-process.
+
+A pool of ``QUEUE_WORKERS`` asyncio workers each lease up to
+``QUEUE_BATCH_SIZE`` jobs and rank them in one model pass on an executor
+(threads by default, ``QUEUE_EXECUTOR=process`` for a process pool — each
+process then loads its own models), so webhook intake never waits on
+inference. ``rank_pr`` items without ``files`` (webhook events) first have
+their file list fetched through the pooled ``GitHubService``, concurrently
+across the batch, and are ranked as soon as it arrives. A job is acked only
+after it is processed; one that fails is retried with backoff, and one whose
+worker died reappears after ``QUEUE_VISIBILITY_TIMEOUT_S`` (at-least-once
+delivery).
+
+Pending events for the same PR are coalesced: the latest payload wins and the
+item keeps the higher of the two priorities (``opened`` before
+``synchronize``) and its place in line. Depth, wait time, coalesced, retried
+and dropped items are exported through ``ml.telemetry``.
 """
 from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Any
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from ml.telemetry import BATCH_SIZE_BUCKETS, get_telemetry
+from services.github_service import GitHubService, get_github_service
+from services.queue_backends import Job, MemoryQueueBackend, QueueBackend, SQLiteQueueBackend
 
 logger = logging.getLogger(__name__)
 
+# Lower runs first
+EVENT_PRIORITY = {"opened": 0, "reopened": 0, "ready_for_review": 0, "synchronize": 1}
+DEFAULT_PRIORITY = 1
+
+# Under the app so pending PRs survive restarts; gitignored
+DEFAULT_DB_PATH = str(Path(__file__).parent.parent / "data" / "queue.sqlite3")
+MAX_RETRY_DELAY_S = 60.0
+
+
+def _priority(item: dict) -> int:
+    return EVENT_PRIORITY.get(item.get("event", ""), DEFAULT_PRIORITY)
+
+
+def _coalesce_key(item: dict) -> str | None:
+    if item.get("action") == "rank_pr" and item.get("pr_id") is not None:
+        return f"rank_pr:{item.get('repo', '')}#{item['pr_id']}"
+    return None
+
+
+def _process_items(items: list[dict]) -> list[dict | None]:
+    """Run queue items to completion, all ``rank_pr`` items in one model pass.
+
+    Executor side; must stay picklable for the process pool.
+    """
+    from services.ml_service import get_ml_service
+    from services.pr_result_store import get_pr_result_store
+
+    results: list[dict | None] = [None] * len(items)
+    rank = [i for i, item in enumerate(items) if item.get("action") == "rank_pr"]
+    if rank:
+        ranked = get_ml_service().rank_prs_incremental(
+            [(str(items[i].get("pr_id", "")), items[i].get("repo", ""), items[i].get("files", [])) for i in rank],
+            get_pr_result_store(),
+        )
+        for i, result in zip(rank, ranked):
+            results[i] = result
+    return results
+
+
+def _default_backend(maxsize: int) -> QueueBackend:
+    kind = os.environ.get("QUEUE_BACKEND", "sqlite")
+    max_attempts = int(os.environ.get("QUEUE_MAX_ATTEMPTS", "5"))
+    if kind == "memory":
+        return MemoryQueueBackend(maxsize=maxsize, max_attempts=max_attempts)
+    if kind == "sqlite":
+        path = os.environ.get("QUEUE_DB_PATH")
+        if not path:
+            if os.environ.get("VERCEL"):
+                # Only /tmp is writable there, and it does not outlive the instance
+                raise RuntimeError(
+                    "QUEUE_DB_PATH must point at persistent storage on Vercel "
+                    "(or set QUEUE_BACKEND=memory to accept losing pending PRs on restart)"
+                )
+            path = DEFAULT_DB_PATH
+        return SQLiteQueueBackend(path, maxsize=maxsize, max_attempts=max_attempts)
+    raise ValueError(f"QUEUE_BACKEND must be 'sqlite' or 'memory', got {kind!r}")
+
 
 class QueueService:
-    def __init__(self, maxsize: int = 100):
-        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
-        self._worker_task: asyncio.Task | None = None
+    def __init__(
+        self,
+        maxsize: int = 100,
+        workers: int | None = None,
+        executor: str | None = None,
+        backend: QueueBackend | None = None,
+        batch_size: int | None = None,
+        visibility_timeout_s: float | None = None,
+        poll_interval_s: float | None = None,
+        github: GitHubService | None = None,
+    ):
+        self.maxsize = maxsize
+        self.workers = workers or int(os.environ.get("QUEUE_WORKERS", "2"))
+        self.executor_kind = executor or os.environ.get("QUEUE_EXECUTOR", "thread")
+        if self.executor_kind not in ("thread", "process"):
+            raise ValueError(f"QUEUE_EXECUTOR must be 'thread' or 'process', got {self.executor_kind!r}")
+        self.batch_size = batch_size or int(os.environ.get("QUEUE_BATCH_SIZE", "8"))
+        self.visibility_timeout_s = visibility_timeout_s or float(
+            os.environ.get("QUEUE_VISIBILITY_TIMEOUT_S", "300")
+        )
+        # Idle workers re-poll this often: picks up expired leases and retries
+        self.poll_interval_s = poll_interval_s or float(os.environ.get("QUEUE_POLL_S", "1.0"))
+        self._backend = backend if backend is not None else _default_backend(maxsize)
+        self._github = github
+        self._work_available: asyncio.Event | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._executor: Executor | None = None
+        self._telemetry = get_telemetry()
 
     async def start(self) -> None:
-        """Start the background worker."""
-        self._worker_task = asyncio.create_task(self._worker())
-        logger.info("Queue worker started")
+        """Start the worker pool and its executor."""
+        self._executor = (
+            ProcessPoolExecutor(max_workers=self.workers) if self.executor_kind == "process"
+            else ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="queue")
+        )
+        self._work_available = asyncio.Event()
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(
+            f"Queue started: backend={type(self._backend).__name__} workers={self.workers} "
+            f"executor={self.executor_kind} batch_size={self.batch_size}"
+        )
 
     async def stop(self) -> None:
-        if self._worker_task:
-            self._worker_task.cancel()
+        # Jobs still in flight stay leased and are redelivered after the visibility timeout
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._github is not None:
+            await self._github.aclose()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def qsize(self) -> int:
+        """Jobs not yet acked (pending plus in flight)."""
+        return self._backend.depth()
 
-    async def enqueue(self, item: dict) -> None:
-        try:
-            self._queue.put_nowait(item)
-        except asyncio.QueueFull:
-            logger.warning("Queue full, dropping item")
+    async def enqueue(self, item: dict) -> bool:
+        """Queue ``item``; returns False (and counts the drop) if the queue is full."""
+        status = await asyncio.to_thread(self._backend.put, item, _coalesce_key(item), _priority(item))
+        if status == "full":
+            self._telemetry.inc("queue_dropped_total", help="Queue items rejected or abandoned.", reason="full")
+            logger.warning(f"Queue full ({self.maxsize}), dropping {item.get('action')} for PR {item.get('pr_id')}")
+            return False
+        if status == "coalesced":
+            self._telemetry.inc("queue_coalesced_total", help="Queue items merged into a pending item for the same PR.")
+        await self._set_depth()
+        if self._work_available is not None:
+            self._work_available.set()
+        return True
 
-    async def _worker(self) -> None:
+    async def _claim(self) -> list[Job]:
+        jobs = await asyncio.to_thread(self._backend.claim, self.batch_size, self.visibility_timeout_s)
+        discarded = self._backend.take_discarded()
+        if discarded:
+            self._telemetry.inc("queue_dropped_total", discarded, help="Queue items rejected or abandoned.",
+                                reason="max_attempts")
+        if jobs:
+            now = time.time()
+            for job in jobs:
+                self._telemetry.observe("queue_wait_ms", (now - job.enqueued_at) * 1000,
+                                        help="Time a queue item waited for a worker.")
+            self._telemetry.observe("queue_batch_size", len(jobs), BATCH_SIZE_BUCKETS,
+                                    help="Jobs leased per worker batch.")
+            await self._set_depth()
+        return jobs
+
+    async def _set_depth(self) -> None:
+        depth = await asyncio.to_thread(self._backend.depth)
+        self._telemetry.set_gauge("queue_depth", depth, help="Items pending or in flight in the PR queue.")
+
+    async def _worker(self, worker_id: int) -> None:
         while True:
             try:
-                item = await self._queue.get()
-                await self._process(item)
-                self._queue.task_done()
+                jobs = await self._claim()
+                if not jobs:
+                    self._work_available.clear()
+                    try:
+                        await asyncio.wait_for(self._work_available.wait(), self.poll_interval_s)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                jobs, failed = await self._fetch_files(jobs)
+                if failed:
+                    await self._retry(failed, worker_id, "file fetch failed")
+                if jobs:
+                    try:
+                        await self._process_batch([job.item for job in jobs])
+                    except Exception as e:
+                        await self._retry(jobs, worker_id, str(e))
+                    else:
+                        await asyncio.to_thread(self._backend.ack, [job.id for job in jobs])
+                await self._set_depth()
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Queue worker error: {e}")
+                logger.error(f"Queue worker {worker_id} error: {e}")
+                await asyncio.sleep(self.poll_interval_s)
+
+    async def _retry(self, jobs: list[Job], worker_id: int, reason: str) -> None:
+        delay = min(MAX_RETRY_DELAY_S, 2.0 ** max(job.attempts for job in jobs))
+        self._telemetry.inc("queue_retries_total", len(jobs), help="Queue items released for a retry.")
+        logger.error(f"Queue worker {worker_id} failed {len(jobs)} jobs, retrying in {delay:.0f}s: {reason}")
+        await asyncio.to_thread(self._backend.nack, [job.id for job in jobs], delay)
+
+    async def _fetch_files(self, jobs: list[Job]) -> tuple[list[Job], list[Job]]:
+        """Fill in ``files`` for ``rank_pr`` jobs that arrived without them; returns (ready, failed)."""
+        pending = [job for job in jobs if job.item.get("action") == "rank_pr" and job.item.get("files") is None]
+        if not pending:
+            return jobs, []
+        github = self._github or get_github_service()
+
+        async def fetch(job: Job) -> None:
+            owner, _, name = job.item.get("repo", "").partition("/")
+            with self._telemetry.timer("github_fetch", action="rank_pr"):
+                job.item["files"] = await github.get_pr_files(owner, name, int(job.item["pr_id"]))
+
+        outcomes = await asyncio.gather(*(fetch(job) for job in pending), return_exceptions=True)
+        failed_ids = set()
+        for job, outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                logger.warning(f"Fetching files for {job.item.get('repo')}#{job.item.get('pr_id')} failed: {outcome}")
+                failed_ids.add(job.id)
+        return [job for job in jobs if job.id not in failed_ids], [job for job in jobs if job.id in failed_ids]
 
     async def _process(self, item: dict) -> None:
-        from services.ml_service import get_ml_service
-        action = item.get("action")
-        logger.info(f"Processing queue item: action={action}")
-
-        if action == "rank_pr":
-            ml = get_ml_service()
-            files = item.get("files", [])
-            pr_id = str(item.get("pr_id", ""))
-            repo = item.get("repo", "")
-            result = ml.rank_pr(pr_id, repo, files)
-            logger.info(f"Ranked PR {pr_id}: {len(result.get('ranked_files', []))} files")
+        await self._process_batch([item])
+
+    async def _process_batch(self, items: list[dict]) -> None:
+        actions = ",".join(sorted({str(item.get("action")) for item in items}))
+        logger.info(f"Processing {len(items)} queue items: actions={actions}")
+
+        loop = asyncio.get_running_loop()
+        with self._telemetry.timer("queue_process", action=actions):
+            results = await loop.run_in_executor(self._executor, _process_items, items)
+
+        for item, result in zip(items, results):
+            if item.get("action") == "rank_pr" and result is not None:
+                stats = result["incremental"]
+                logger.info(
+                    f"Ranked PR {result['pr_id']}: {len(result.get('ranked_files', []))} files, "
+                    f"scored={stats['files_scored']} skipped={stats['files_skipped']} "
+                    f"hit_ratio={stats['hit_ratio']:.2f}"
+                )
 
 
 _queue_service: QueueService | None = None
@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import patch
+from httpx import ASGITransport, AsyncClient
+import numpy as np
+import sys
+import os
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app
+from services.ml_service import MLService
+
+
+MOCK_ANALYZE_RESULT = {
+    "pr_id": "42",
+    "ranked_files": [
+        {
+            "filename": "src/auth/login.py",
+            "rank": 1,
+            "reranker_score": 0.9,
+            "retrieval_score": 0.8,
+            "final_score": 0.86,
+            "explanation": "security-sensitive path → high priority",
+        }
+    ],
+    "groups": [{"cluster_id": 0, "label": "login.py", "files": ["src/auth/login.py"], "coherence": 1.0}],
+    "similar": [{"filename": "src/auth/login.py", "results": []}],
+    "timings_ms": {"embed": 3.1, "rerank": 2.0, "retrieve": 0.4, "cluster": 0.1, "total": 5.9},
+}
+
+
+@pytest.mark.asyncio
+async def test_analyze_endpoint():
+    with patch("services.ml_service.MLService.analyze_pr", return_value=MOCK_ANALYZE_RESULT):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/analyze", json={
+                "pr_id": "42",
+                "repo": "test/repo",
+                "files": [{"filename": "src/auth/login.py", "additions": 50, "deletions": 10}],
+            })
+    assert response.status_code == 200
+    data = response.json()
+    assert data["ranked_files"][0]["rank"] == 1
+    assert data["groups"][0]["files"] == ["src/auth/login.py"]
+    assert set(data["timings_ms"]) == {"embed", "rerank", "retrieve", "cluster", "total"}
+
+
+@pytest.mark.asyncio
+async def test_analyze_runs_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def analyze(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return MOCK_ANALYZE_RESULT
+
+    with patch("services.ml_service.MLService.analyze_pr", side_effect=analyze):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/analyze", json={"pr_id": "42", "repo": "test/repo", "files": []})
+    assert response.status_code == 200
+    assert threads and threads[0] != loop_thread
+
+
+class _CountingEmbedder:
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        rng = np.random.default_rng(len(texts))
+        vecs = rng.standard_normal((len(texts), 8)).astype(np.float32)
+        return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+class _FakeRegistry:
+    def __init__(self):
+        self.embedder = _CountingEmbedder()
+        self.reranker = None
+        self.index = None
+
+    def ensure_loaded(self):
+        pass
+
+
+def test_analyze_pr_embeds_each_file_once():
+    registry = _FakeRegistry()
+    files = [{"filename": f"src/mod_{i}.py", "patch": f"+x = {i}"} for i in range(5)]
+
+    result = MLService(registry).analyze_pr("1", "o/r", files)
+
+    assert registry.embedder.calls == 1
+    assert [rf["rank"] for rf in result["ranked_files"]] == [1, 2, 3, 4, 5]
+    assert sorted(f for g in result["groups"] for f in g["files"]) == sorted(f["filename"] for f in files)
+    assert len(result["similar"]) == 5
+    assert result["timings_ms"]["total"] >= result["timings_ms"]["embed"]
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from unittest.mock import patch
+import httpx
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Tests that want the conditional cache pass one explicitly
+os.environ.setdefault("GITHUB_HTTP_CACHE_PATH", "off")
+
+from ml.data.http_cache import HTTPCache
+from ml.telemetry import Telemetry
+from services.github_service import GitHubAPIError, GitHubService, RateLimiter
+from services.queue_backends import MemoryQueueBackend
+from services.queue_service import QueueService
+
+N_FILES = 250
+
+
+class _MockGitHub(BaseHTTPRequestHandler):
+    """Serves paginated PR files with rate-limit headers and records how it was called."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", str(self.server.remaining))
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        state = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with state.lock:
+            state.ports.add(self.client_address[1])
+            state.requests.append(self.path)
+            state.active += 1
+            state.max_active = max(state.max_active, state.active)
+        try:
+            if state.secondary_limit_hits:
+                state.secondary_limit_hits -= 1
+                return self._send(403, {"message": "secondary rate limit"}, {"Retry-After": "0"})
+            if url.path == "/repos/o/r/pulls/1/files":
+                time.sleep(0.05)
+                page, per_page = int(query["page"][0]), int(query["per_page"][0])
+                last = -(-N_FILES // per_page)
+                files = [{"filename": f"src/f{i}.py", "patch": f"+x = {i}", "additions": 1, "deletions": 0}
+                         for i in range((page - 1) * per_page, min(page * per_page, N_FILES))]
+                link = (f'<{state.base_url}/repos/o/r/pulls/1/files?per_page={per_page}&page={last}>; rel="last"')
+                etag = f'"files-{page}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with state.lock:
+                        state.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("X-RateLimit-Remaining", str(state.remaining))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                return self._send(200, files, {"Link": link, "ETag": etag})
+            return self._send(404, {"message": "Not Found"})
+        finally:
+            with state.lock:
+                state.active -= 1
+
+
+@pytest.fixture
+def github_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockGitHub)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.lock = threading.Lock()
+    server.ports, server.requests = set(), []
+    server.active = server.max_active = 0
+    server.remaining = 4999
+    server.secondary_limit_hits = 0
+    server.not_modified = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_get_pr_files_fetches_all_pages_concurrently(github_server):
+    github = GitHubService(token="t", base_url=github_server.base_url, page_concurrency=4)
+    try:
+        files = await github.get_pr_files("o", "r", 1)
+        again = await github.get_pr_files("o", "r", 1)
+    finally:
+        await github.aclose()
+
+    assert [f["filename"] for f in files] == [f"src/f{i}.py" for i in range(N_FILES)]
+    assert again == files
+    assert len(github_server.requests) == 6
+    assert github_server.max_active == 2  # pages 2 and 3 in parallel
+    # Both calls went over the pooled keep-alive connections
+    assert len(github_server.ports) <= 2
+
+
+@pytest.mark.asyncio
+async def test_unchanged_pr_is_served_from_etag_cache(github_server, tmp_path):
+    cache = HTTPCache(tmp_path / "github.sqlite3")
+    github = GitHubService(token="t", base_url=github_server.base_url, cache=cache)
+    github._telemetry = Telemetry()
+    try:
+        files = await github.get_pr_files("o", "r", 1)
+        again = await github.get_pr_files("o", "r", 1)
+    finally:
+        await github.aclose()
+
+    assert again == files
+    assert len(files) == N_FILES
+    assert github_server.not_modified == 3  # every page of the re-fetch was a 304
+    assert cache.stats()["hit_rate"] == 0.5
+    metrics = github._telemetry.render_prometheus()
+    assert 'github_requests_total{cache="hit"} 3' in metrics
+    assert 'github_requests_total{cache="miss"} 3' in metrics
+
+
+@pytest.mark.asyncio
+async def test_304_for_evicted_entry_is_refetched(github_server, tmp_path):
+    cache = HTTPCache(tmp_path / "github.sqlite3")
+    github = GitHubService(token="t", base_url=github_server.base_url, cache=cache)
+    send_validators = cache.conditional_headers
+
+    def validators_then_evict(key):
+        headers = send_validators(key)
+        cache._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        cache._db.commit()
+        return headers
+
+    try:
+        files = await github.get_pr_files("o", "r", 1)
+        cache.conditional_headers = validators_then_evict
+        again = await github.get_pr_files("o", "r", 1)
+    finally:
+        await github.aclose()
+
+    assert again == files
+    assert github_server.not_modified == 3
+    assert len(github_server.requests) == 9  # each 304 followed by one unconditional GET
+    assert cache.stats()["entries"] == 3  # re-stored from the refetch
+
+
+@pytest.mark.asyncio
+async def test_missing_pr_returns_empty_and_errors_raise(github_server):
+    github = GitHubService(token="t", base_url=github_server.base_url)
+    try:
+        assert await github.get_pr_files("o", "r", 404) == []
+        with patch.object(httpx.AsyncClient, "get", return_value=httpx.Response(502)):
+            with pytest.raises(GitHubAPIError):
+                await github.get_pr_files("o", "r", 1)
+    finally:
+        await github.aclose()
+
+
+@pytest.mark.asyncio
+async def test_secondary_rate_limit_is_retried(github_server):
+    github_server.secondary_limit_hits = 1
+    github = GitHubService(token="t", base_url=github_server.base_url)
+    try:
+        files = await github.get_pr_files("o", "r", 1)
+    finally:
+        await github.aclose()
+    assert len(files) == N_FILES
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_follows_headers():
+    limiter = RateLimiter(limit=5000)
+    await limiter.acquire()
+    await limiter.acquire()
+    limiter.release(httpx.Headers({"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "40"}))
+    # One request still in flight is not yet reflected in the server's count
+    assert limiter.tokens == 39
+
+    limiter.release(httpx.Headers({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(time.time() + 0.2)}))
+    t0 = time.monotonic()
+    await limiter.acquire()
+    assert time.monotonic() - t0 >= 0.15
+    assert limiter.waits >= 1
+    assert limiter.tokens == 4999  # full budget again after the reset
+
+
+@pytest.mark.asyncio
+async def test_queue_worker_fetches_files_before_ranking(github_server):
+    ranked = []
+    done = threading.Event()
+
+    def process(items):
+        ranked.extend(items)
+        done.set()
+        return [None] * len(items)
+
+    github = GitHubService(token="t", base_url=github_server.base_url)
+    queue = QueueService(workers=1, backend=MemoryQueueBackend(), poll_interval_s=0.05, github=github)
+    with patch("services.queue_service._process_items", process):
+        await queue.start()
+        try:
+            await queue.enqueue({"action": "rank_pr", "event": "opened", "pr_id": 1, "repo": "o/r"})
+            t0 = time.monotonic()
+            while not done.is_set() and time.monotonic() - t0 < 5:
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    assert len(ranked) == 1
+    assert len(ranked[0]["files"]) == N_FILES
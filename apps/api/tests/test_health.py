@@ -1,4 +1,5 @@
 import pytest
+from unittest.mock import patch
 from httpx import ASGITransport, AsyncClient
 
 import sys
@@ -18,3 +19,32 @@ async def test_health_returns_ok():
     data = response.json()
     assert data["status"] == "ok"
     assert data["version"] == "0.1.0"
+
+
+@pytest.mark.asyncio
+async def test_ready_returns_503_until_warm():
+    from services.model_registry import ModelRegistry
+
+    registry = ModelRegistry()
+    with patch("routers.health.get_model_registry", return_value=registry):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get("/ready")
+            assert response.status_code == 503
+            assert response.json()["state"] == "cold"
+
+            registry.state = "warm"
+            response = await client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+
+
+@pytest.mark.asyncio
+async def test_metrics_exposes_per_route_latency_in_prometheus_format():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.get("/health")
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE assert_review_request_latency_ms histogram" in response.text
+    assert 'assert_review_request_latency_ms_count{endpoint="/health"}' in response.text
+    assert 'assert_review_requests_total{endpoint="/health",status="200"}' in response.text
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.telemetry import Telemetry
+from services.queue_backends import MemoryQueueBackend, SQLiteQueueBackend
+from services.queue_service import DEFAULT_DB_PATH, QueueService, _coalesce_key, _default_backend, _priority
+
+
+def _rank_item(pr_id, event="synchronize", **extra):
+    return {"action": "rank_pr", "event": event, "pr_id": pr_id, "repo": "o/r", "files": [], **extra}
+
+
+def _put(backend, item):
+    return backend.put(item, _coalesce_key(item), _priority(item))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryQueueBackend(maxsize=10, max_attempts=2)
+    return SQLiteQueueBackend(tmp_path / "queue.sqlite3", maxsize=10, max_attempts=2)
+
+
+def test_coalesces_pending_events_and_prioritizes_opened(backend):
+    _put(backend, _rank_item(1, push=1))
+    _put(backend, _rank_item(2))
+    _put(backend, _rank_item(3, event="opened"))
+    assert _put(backend, _rank_item(1, push=2)) == "coalesced"
+
+    assert backend.depth() == 3
+    jobs = backend.claim(10, 60)
+    assert [job.item["pr_id"] for job in jobs] == [3, 1, 2]
+    assert jobs[1].item["push"] == 2
+
+
+def test_coalesced_item_keeps_higher_priority(backend):
+    _put(backend, _rank_item(1, event="opened"))
+    _put(backend, _rank_item(2))
+    _put(backend, _rank_item(1, event="synchronize"))
+
+    job = backend.claim(1, 60)[0]
+    assert (job.item["pr_id"], job.item["event"]) == (1, "synchronize")
+
+
+def test_in_flight_job_does_not_absorb_new_event(backend):
+    _put(backend, _rank_item(1, push=1))
+    in_flight = backend.claim(1, 60)
+    assert _put(backend, _rank_item(1, push=2)) == "queued"
+
+    backend.ack([job.id for job in in_flight])
+    assert [job.item["push"] for job in backend.claim(10, 60)] == [2]
+
+
+def test_expired_lease_is_redelivered_until_max_attempts(backend):
+    _put(backend, _rank_item(1))
+    first = backend.claim(1, 0.05)
+    assert backend.claim(1, 0.05) == []  # still leased
+
+    time.sleep(0.1)
+    second = backend.claim(1, 0.05)
+    assert [(job.id, job.attempts) for job in second] == [(first[0].id, 2)]
+
+    time.sleep(0.1)
+    assert backend.claim(1, 0.05) == []  # max_attempts reached: discarded
+    assert backend.depth() == 0
+
+
+def test_nack_delays_redelivery(backend):
+    _put(backend, _rank_item(1))
+    job = backend.claim(1, 60)[0]
+    backend.nack([job.id], delay_s=0.1)
+    assert backend.claim(1, 60) == []
+    time.sleep(0.15)
+    assert [j.id for j in backend.claim(1, 60)] == [job.id]
+
+
+def test_sqlite_queue_survives_restart(tmp_path):
+    path = tmp_path / "queue.sqlite3"
+    _put(SQLiteQueueBackend(path), _rank_item(1, event="opened"))
+    leased = SQLiteQueueBackend(path).claim(1, 0.05)  # worker dies without acking
+
+    time.sleep(0.1)
+    reopened = SQLiteQueueBackend(path)
+    assert [job.item["pr_id"] for job in reopened.claim(1, 60)] == [leased[0].item["pr_id"]]
+    assert reopened._conn().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_default_db_path_lives_under_the_app():
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert DEFAULT_DB_PATH == os.path.join(app_dir, "data", "queue.sqlite3")
+
+
+def test_sqlite_backend_uses_queue_db_path(tmp_path, monkeypatch):
+    monkeypatch.delenv("QUEUE_BACKEND", raising=False)
+    monkeypatch.setenv("QUEUE_DB_PATH", str(tmp_path / "q.sqlite3"))
+    monkeypatch.setenv("VERCEL", "1")
+    assert _default_backend(10).path == str(tmp_path / "q.sqlite3")
+
+
+def test_sqlite_backend_without_path_fails_on_vercel(monkeypatch):
+    monkeypatch.delenv("QUEUE_DB_PATH", raising=False)
+    monkeypatch.delenv("QUEUE_BACKEND", raising=False)
+    monkeypatch.setenv("VERCEL", "1")
+    with pytest.raises(RuntimeError, match="QUEUE_DB_PATH"):
+        _default_backend(10)
+    monkeypatch.setenv("QUEUE_BACKEND", "memory")
+    assert isinstance(_default_backend(10), MemoryQueueBackend)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_reports_drop():
+    queue = QueueService(maxsize=1, workers=1, backend=MemoryQueueBackend(maxsize=1))
+    assert await queue.enqueue(_rank_item(1)) is True
+    assert await queue.enqueue(_rank_item(2)) is False
+    # An update for an already-pending PR is not a new slot
+    assert await queue.enqueue(_rank_item(1)) is True
+    assert queue.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_job_past_max_attempts_counts_as_dropped(backend, monkeypatch):
+    attempts = []
+
+    def process(items):
+        attempts.append(len(items))
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr("services.queue_service.MAX_RETRY_DELAY_S", 0.0)
+    _put(backend, _rank_item(1))
+    queue = QueueService(workers=1, backend=backend, poll_interval_s=0.02)
+    queue._telemetry = telemetry = Telemetry()
+    with patch("services.queue_service._process_items", process):
+        await queue.start()
+        try:
+            t0 = time.monotonic()
+            while "max_attempts" not in telemetry.render_prometheus() and time.monotonic() - t0 < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    assert attempts == [1, 1]  # max_attempts=2, then discarded
+    assert backend.depth() == 0
+    assert 'queue_dropped_total{reason="max_attempts"} 1' in telemetry.render_prometheus()
+    assert backend.take_discarded() == 0  # already reported
+
+
+@pytest.mark.asyncio
+async def test_worker_ranks_claimed_batch_in_one_call(tmp_path):
+    calls = []
+    done = threading.Event()
+
+    def process(items):
+        calls.append([item["pr_id"] for item in items])
+        done.set()
+        return [None] * len(items)
+
+    backend = SQLiteQueueBackend(tmp_path / "queue.sqlite3")
+    for pr in (1, 2, 3):
+        _put(backend, _rank_item(pr))
+    queue = QueueService(workers=1, backend=backend, batch_size=8, poll_interval_s=0.05)
+    with patch("services.queue_service._process_items", process):
+        await queue.start()
+        try:
+            t0 = time.monotonic()
+            while not done.is_set() and time.monotonic() - t0 < 2:
+                await asyncio.sleep(0.01)
+            while backend.depth() and time.monotonic() - t0 < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    assert calls == [[1, 2, 3]]
+    assert backend.depth() == 0  # acked
+
+
+@pytest.mark.asyncio
+async def test_workers_run_items_off_the_event_loop():
+    release = threading.Event()
+    threads = set()
+
+    def blocking_process(items):
+        threads.add(threading.current_thread().name)
+        release.wait(2)
+        return [None] * len(items)
+
+    queue = QueueService(workers=2, backend=MemoryQueueBackend(), batch_size=1, poll_interval_s=0.05)
+    with patch("services.queue_service._process_items", blocking_process):
+        await queue.start()
+        try:
+            await queue.enqueue(_rank_item(1))
+            await queue.enqueue(_rank_item(2))
+            t0 = time.monotonic()
+            while len(threads) < 2 and time.monotonic() - t0 < 2:
+                await asyncio.sleep(0.01)  # the loop keeps running while both items block
+            assert len(threads) == 2
+            assert threading.current_thread().name not in threads
+        finally:
+            release.set()
+            await queue.stop()
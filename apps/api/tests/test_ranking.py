@@ -1,12 +1,17 @@
+import json
 import pytest
+from functools import partialmethod
 from unittest.mock import MagicMock, patch
 from httpx import ASGITransport, AsyncClient
 import sys
 import os
+import threading
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from main import app
+from services.ml_service import MLService
+from services.pr_result_store import PRResultStore
 
 
 MOCK_RANK_RESULT = {
@@ -54,3 +59,126 @@ async def test_rank_empty_files():
             })
     assert response.status_code == 200
     assert response.json()["ranked_files"] == []
+
+
+def _events(body: str) -> list[dict]:
+    return [json.loads(line) for line in body.splitlines() if line]
+
+
+@pytest.mark.asyncio
+async def test_rank_stream_heuristic_first_then_final():
+    reranker = MagicMock()
+    reranker.score.side_effect = lambda texts: [0.2 if "README" in t else 0.9 for t in texts]
+    registry = MagicMock(reranker=reranker, index=None, embedder=None)
+    files = [
+        {"filename": "README.md", "additions": 200, "deletions": 0},
+        {"filename": "src/auth/login.py", "additions": 5, "deletions": 1},
+        {"filename": "docs/guide.md", "additions": 1, "deletions": 1},
+    ]
+
+    with patch("routers.ranking.get_ml_service", return_value=MLService(registry)), \
+         patch.object(MLService, "rank_pr_stream", partialmethod(MLService.rank_pr_stream, batch_size=2)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/rank/stream", json={"pr_id": "7", "repo": "o/r", "files": files})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = _events(response.text)
+    assert [e["event"] for e in events] == ["heuristic", "refined", "refined", "final"]
+    assert events[0]["ranked_files"][0]["filename"] == "src/auth/login.py"
+    assert [len(e["files"]) for e in events[1:3]] == [2, 1]
+    final = events[-1]["ranked_files"]
+    assert [f["rank"] for f in final] == [1, 2, 3]
+    assert final == MLService(registry).rank_pr("7", "o/r", files)["ranked_files"]
+
+
+@pytest.mark.asyncio
+async def test_rank_stream_sse_and_bad_format():
+    registry = MagicMock(reranker=None, index=None, embedder=None)
+    body = {"pr_id": "7", "repo": "o/r", "files": [{"filename": "a.py", "additions": 1, "deletions": 0}]}
+    with patch("routers.ranking.get_ml_service", return_value=MLService(registry)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            sse = await client.post("/rank/stream", json=body, headers={"Accept": "text/event-stream"})
+            bad = await client.post("/rank/stream?format=xml", json=body)
+
+    assert sse.headers["content-type"].startswith("text/event-stream")
+    assert sse.text.startswith("event: heuristic\ndata: ")
+    assert bad.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_rank_stream_error_event_carries_a_code():
+    reranker = MagicMock()
+    reranker.score.side_effect = RuntimeError("reranker exploded")
+    registry = MagicMock(reranker=reranker, index=None, embedder=None)
+    body = {"pr_id": "7", "repo": "o/r", "files": [{"filename": "src/auth.py", "additions": 1, "deletions": 0}]}
+    with patch("routers.ranking.get_ml_service", return_value=MLService(registry)):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/rank/stream", json=body)
+
+    events = _events(response.text)
+    assert [e["event"] for e in events] == ["heuristic", "error"]
+    assert events[0]["ranked_files"][0]["final_score"] == MLService._heuristic_scores(body["files"])[0]
+    assert events[-1] == {"event": "error", "error": "reranker exploded", "code": "STREAM_ERROR"}
+
+
+@pytest.mark.asyncio
+async def test_rank_stream_setup_runs_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def service():
+        threads.append(threading.get_ident())
+        return MLService(MagicMock(reranker=None, index=None, embedder=None))
+
+    body = {"pr_id": "7", "repo": "o/r", "files": [{"filename": "a.py", "additions": 1, "deletions": 0}]}
+    with patch("routers.ranking.get_ml_service", side_effect=service):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/rank/stream", json=body)
+    assert response.status_code == 200
+    assert threads and threads[0] != loop_thread
+
+
+class _CountingReranker:
+    def __init__(self):
+        self.scored = []
+
+    def score(self, texts):
+        self.scored.extend(texts)
+        return [min(1.0, len(t) / 100) for t in texts]
+
+
+def test_rank_pr_incremental_scores_only_changed_files():
+    registry = MagicMock(reranker=_CountingReranker(), index=None, embedder=None)
+    ml = MLService(registry)
+    store = PRResultStore()
+    files = [
+        {"filename": "src/auth/login.py", "patch": "+token = 1", "additions": 1, "deletions": 0},
+        {"filename": "src/app.py", "patch": "+x = 1", "additions": 1, "deletions": 0},
+        {"filename": "README.md", "patch": "+docs", "additions": 1, "deletions": 0},
+    ]
+
+    first = ml.rank_pr_incremental("7", "o/r", files, store)
+    assert first["incremental"]["files_scored"] == 3
+
+    pushed = [dict(files[0], patch="+token = jwt.encode(payload, secret)"), files[1]]
+    registry.reranker.scored.clear()
+    second = ml.rank_pr_incremental("7", "o/r", pushed, store)
+
+    assert len(registry.reranker.scored) == 1
+    assert second["incremental"] == {"files_total": 2, "files_scored": 1, "files_skipped": 1, "hit_ratio": 0.5}
+    assert second["ranked_files"] == ml.rank_pr("7", "o/r", pushed)["ranked_files"]
+    assert set(store.get("o/r", "7", ml._scorer_key())) == {"src/auth/login.py", "src/app.py"}
+
+
+def test_rank_pr_incremental_rescores_when_models_change():
+    registry = MagicMock(reranker=None, index=None, embedder=None)
+    ml = MLService(registry)
+    store = PRResultStore()
+    files = [{"filename": "a.py", "patch": "+a", "additions": 1, "deletions": 0}]
+    ml.rank_pr_incremental("1", "o/r", files, store)
+
+    registry.reranker = _CountingReranker()
+    result = ml.rank_pr_incremental("1", "o/r", files, store)
+    assert result["incremental"]["files_scored"] == 1
+    assert result["ranked_files"][0]["reranker_score"] == 0.32
@@ -7,6 +7,8 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep enqueued test events out of the on-disk queue
+os.environ.setdefault("QUEUE_BACKEND", "memory")
 
 
 def make_signature(payload: bytes, secret: str) -> str:
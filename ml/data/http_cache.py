@@ -0,0 +1,175 @@
+"""
+On-disk conditional-request cache for the GitHub REST API.
+
+GitHub answers a request carrying ``If-None-Match`` / ``If-Modified-Since``
+with ``304 Not Modified`` when the resource is unchanged, and 304s do not count
+against the rate limit. ``HTTPCache`` stores each validated 200 response
+(body, ``ETag``, ``Last-Modified``, ``Link``) in SQLite, adds the validators to
+the next request for the same URL and turns a 304 back into the stored 200, so
+re-scrapes and re-fetches of unchanged PRs cost neither budget nor bandwidth.
+
+Shared by ``ml.data.scraper.GitHubScraper`` and the API's ``GitHubService``:
+
+    key = cache.key(url, params, client.headers)
+    resp = await client.get(url, params=params, headers=cache.conditional_headers(key))
+    resp = cache.resolve(key, resp)
+
+Entries are keyed by URL, query, ``Accept`` and a hash of the credentials, so
+tokens with different access never share a body. ``GITHUB_HTTP_CACHE_PATH``
+relocates the file (``off`` disables caching).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Mapping
+
+import httpx
+import structlog
+
+log = structlog.get_logger()
+
+# Response headers worth replaying with a cached body
+_STORED_HEADERS = ("content-type", "etag", "last-modified", "link")
+
+
+class HTTPCache:
+    """Thread-safe SQLite store of validated GET responses, evicted least-recently-used."""
+
+    def __init__(self, path: str | Path, max_entries: int = 50_000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, headers TEXT NOT NULL, "
+            "body BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def key(url: str, params: Mapping | None = None, request_headers: Mapping | None = None) -> str:
+        """Cache key for a GET: canonical URL with query, ``Accept`` and a credentials hash."""
+        headers = httpx.Headers(request_headers or {})
+        h = hashlib.sha256()
+        for part in (
+            str(httpx.URL(url, params=params)),
+            headers.get("accept", ""),
+            hashlib.sha256(headers.get("authorization", "").encode()).hexdigest(),
+        ):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def conditional_headers(self, key: str) -> dict[str, str]:
+        """``If-None-Match`` / ``If-Modified-Since`` for a cached entry, else ``{}``."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def resolve(self, key: str, response: httpx.Response) -> httpx.Response:
+        """Serve a 304 from disk, store a validated 200; other responses pass through.
+
+        A response served from disk is a 200 carrying the stored body and
+        headers, the live response's rate-limit headers, and ``X-Cache: HIT``.
+        """
+        if response.status_code == 304:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT headers, body FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self.hits += 1
+                    self.bytes_saved += len(row[1])
+            if row is None:  # evicted since the validators were sent
+                return response
+            headers = httpx.Headers(json.loads(row[0]))
+            for name, value in response.headers.items():
+                if name.lower().startswith("x-ratelimit") or name.lower() == "date":
+                    headers[name] = value
+            headers["X-Cache"] = "HIT"
+            return httpx.Response(200, headers=headers, content=row[1], request=response.request)
+
+        if response.status_code == 200:
+            etag = response.headers.get("etag")
+            last_modified = response.headers.get("last-modified")
+            with self._lock:
+                self.misses += 1
+                if etag or last_modified:
+                    stored = {name: response.headers[name] for name in _STORED_HEADERS if name in response.headers}
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, etag, last_modified, headers, body, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, etag, last_modified, json.dumps(stored), response.content, time.time()),
+                    )
+                    self._evict()
+                    self._db.commit()
+        return response
+
+    async def get(self, client: httpx.AsyncClient, url: str, params: Mapping | None = None) -> httpx.Response:
+        """Conditional ``client.get`` through the cache."""
+        key = self.key(url, params, client.headers)
+        response = await client.get(url, params=params, headers=self.conditional_headers(key))
+        return self.resolve(key, response)
+
+    def _evict(self) -> None:
+        # Caller holds the lock; drop the least recently used tenth when over budget
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries + self.max_entries // 10,),
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_http_cache(default_path: str | Path) -> HTTPCache | None:
+    """Cache at ``GITHUB_HTTP_CACHE_PATH`` (``off`` disables), else at ``default_path``."""
+    path = os.environ.get("GITHUB_HTTP_CACHE_PATH") or str(default_path)
+    if path.lower() == "off":
+        return None
+    cache = HTTPCache(path, max_entries=int(os.environ.get("GITHUB_HTTP_CACHE_SIZE", "50000")))
+    log.info("github http cache ready", path=path)
+    return cache
@@ -1,6 +1,8 @@
 """
 GitHub PR scraper — fetches merged PRs using GITHUB_TOKEN.
 Rate-limit aware: sleeps when X-RateLimit-Remaining < 10.
+Requests go through the on-disk conditional cache (ml.data.http_cache), so a
+re-scrape only downloads PR listings and file lists that changed.
 """
 import asyncio
 import json
@@ -11,6 +13,8 @@ from pathlib import Path
 import httpx
 from dotenv import load_dotenv
 
+from ml.data.http_cache import HTTPCache, open_http_cache
+
 load_dotenv()
 
 DEFAULT_REPOS = [
@@ -20,10 +24,11 @@ DEFAULT_REPOS = [
 ]
 
 RAW_DIR = Path(__file__).parent / "raw"
+HTTP_CACHE_PATH = RAW_DIR / "http_cache.sqlite3"
 
 
 class GitHubScraper:
-    def __init__(self, token: str | None = None):
+    def __init__(self, token: str | None = None, cache: HTTPCache | None = None):
         self.token = token or os.environ.get("GITHUB_TOKEN", "")
         self.headers = {
             "Authorization": f"Bearer {self.token}",
@@ -31,6 +36,12 @@ class GitHubScraper:
             "X-GitHub-Api-Version": "2022-11-28",
         }
         self.base_url = "https://api.github.com"
+        self.cache = cache if cache is not None else open_http_cache(HTTP_CACHE_PATH)
+
+    async def _get(self, client: httpx.AsyncClient, url: str, params: dict) -> httpx.Response:
+        if self.cache is None:
+            return await client.get(url, params=params)
+        return await self.cache.get(client, url, params)
 
     async def _check_rate_limit(self, response: httpx.Response) -> None:
         remaining = int(response.headers.get("X-RateLimit-Remaining", 100))
@@ -60,7 +71,7 @@ class GitHubScraper:
                 url = f"{self.base_url}/repos/{repo}/pulls"
                 params = {"state": "closed", "sort": "updated", "direction": "desc",
                          "per_page": per_page, "page": page}
-                resp = await client.get(url, params=params)
+                resp = await self._get(client, url, params)
                 await self._check_rate_limit(resp)
                 resp.raise_for_status()
                 
@@ -81,7 +92,7 @@ class GitHubScraper:
     async def fetch_pr_files(self, repo: str, pr_number: int, client: httpx.AsyncClient) -> list[dict]:
         """Fetch files changed in a PR."""
         url = f"{self.base_url}/repos/{repo}/pulls/{pr_number}/files"
-        resp = await client.get(url, params={"per_page": 100})
+        resp = await self._get(client, url, {"per_page": 100})
         await self._check_rate_limit(resp)
         if resp.status_code != 200:
             return []
@@ -120,6 +131,12 @@ class GitHubScraper:
             for pr in all_prs:
                 f.write(json.dumps(pr) + "\n")
         print(f"Saved {len(all_prs)} PRs to {out_file}")
+        if self.cache is not None:
+            stats = self.cache.stats()
+            print(
+                f"HTTP cache: {stats['hits']}/{stats['hits'] + stats['misses']} responses unchanged "
+                f"({stats['hit_rate']:.0%}), {stats['bytes_saved'] / 1e6:.1f} MB not re-downloaded"
+            )
         return all_prs
 
 
@@ -0,0 +1,75 @@
+import httpx
+import pytest
+from ml.data.http_cache import HTTPCache, open_http_cache
+
+URL = "https://api.github.com/repos/o/r/pulls/1/files"
+
+
+def _response(status, content=b"", headers=None):
+    return httpx.Response(status, headers=headers, content=content, request=httpx.Request("GET", URL))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = HTTPCache(tmp_path / "cache.sqlite3")
+    yield c
+    c.close()
+
+
+def test_key_separates_query_and_credentials():
+    base = HTTPCache.key(URL, {"page": 1}, {"Authorization": "Bearer a"})
+    assert base == HTTPCache.key(URL, {"page": 1}, {"authorization": "Bearer a"})
+    assert base != HTTPCache.key(URL, {"page": 2}, {"Authorization": "Bearer a"})
+    assert base != HTTPCache.key(URL, {"page": 1}, {"Authorization": "Bearer b"})
+
+
+def test_not_modified_is_served_from_disk(cache):
+    key = cache.key(URL)
+    assert cache.conditional_headers(key) == {}
+
+    body = b'[{"filename": "a.py"}]'
+    cache.resolve(key, _response(200, body, {"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+                                             "Content-Type": "application/json"}))
+    assert cache.conditional_headers(key) == {
+        "If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+    }
+
+    hit = cache.resolve(key, _response(304, headers={"X-RateLimit-Remaining": "4990"}))
+    assert hit.status_code == 200
+    assert hit.json() == [{"filename": "a.py"}]
+    assert hit.headers["X-Cache"] == "HIT"
+    assert hit.headers["X-RateLimit-Remaining"] == "4990"
+    assert cache.stats() == {
+        "path": cache.path, "entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5, "bytes_saved": len(body),
+    }
+
+
+def test_unvalidated_and_error_responses_are_not_stored(cache):
+    key = cache.key(URL)
+    cache.resolve(key, _response(200, b"[]"))
+    cache.resolve(key, _response(404, b"{}", {"ETag": '"v1"'}))
+    assert cache.conditional_headers(key) == {}
+    assert cache.stats()["entries"] == 0
+
+
+def test_cache_persists_and_evicts_least_recently_used(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = HTTPCache(path, max_entries=10)
+    for page in range(12):
+        cache.resolve(cache.key(URL, {"page": page}), _response(200, b"[]", {"ETag": f'"{page}"'}))
+    assert cache.stats()["entries"] <= 10
+    assert cache.conditional_headers(cache.key(URL, {"page": 0})) == {}
+    cache.close()
+
+    reopened = HTTPCache(path)
+    assert reopened.conditional_headers(reopened.key(URL, {"page": 11})) == {"If-None-Match": '"11"'}
+    reopened.close()
+
+
+def test_open_http_cache_can_be_disabled(monkeypatch, tmp_path):
+    monkeypatch.setenv("GITHUB_HTTP_CACHE_PATH", "off")
+    assert open_http_cache(tmp_path / "unused.sqlite3") is None
+    monkeypatch.delenv("GITHUB_HTTP_CACHE_PATH")
+    cache = open_http_cache(tmp_path / "cache.sqlite3")
+    assert cache.path == str(tmp_path / "cache.sqlite3")
+    cache.close()
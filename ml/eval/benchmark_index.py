@@ -0,0 +1,155 @@
+"""
+Index benchmark: recall@k vs exact search and per-query latency for
+flat / IVF-Flat / IVF-PQ / HNSW at several corpus sizes.
+
+The corpus is synthesized from real hunk embeddings (reconstructed from an
+existing FAISS index, if one is found) plus Gaussian noise, so neighbourhood
+structure resembles production rather than uniform random vectors.
+
+Usage: python -m ml.eval.benchmark_index [--sizes 10000 50000 200000] [--k 10]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parents[2]
+SEED_INDEXES = [
+    ROOT / "ml" / "models" / "faiss" / "hunk_index.faiss",
+    ROOT / "apps" / "api-hf" / "hunk_index.faiss",
+]
+RESULTS_JSON = Path(__file__).parent / "index_benchmark_results.json"
+RESULTS_MD = Path(__file__).parent / "index_benchmark_table.md"
+
+DIM = 768
+SIZES = [10_000, 50_000, 200_000]
+N_QUERIES = 200
+NOISE = 0.05
+
+# (index_spec, query-time parameter name, values swept)
+SWEEP = [
+    ("flat", None, [None]),
+    ("ivf_flat", "nprobe", [1, 4, 16, 64]),
+    ("ivf_pq", "nprobe", [4, 16, 64]),
+    ("hnsw", "ef_search", [16, 64, 256]),
+]
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=1, keepdims=True).clip(min=1e-9)).astype(np.float32)
+
+
+def load_seed_vectors() -> np.ndarray:
+    """Real embeddings from the first existing index, else random unit vectors."""
+    import faiss
+
+    for path in SEED_INDEXES:
+        if path.exists():
+            index = faiss.read_index(str(path))
+            vecs = index.reconstruct_n(0, index.ntotal)
+            logger.info(f"Seeding corpus from {path} ({len(vecs)} vectors)")
+            return _normalize(vecs)
+    logger.warning("No FAISS index found — seeding corpus with random vectors")
+    return _normalize(np.random.default_rng(0).standard_normal((1000, DIM)))
+
+
+def synthesize(seed: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    base = seed[rng.integers(0, len(seed), size=n)]
+    return _normalize(base + NOISE * rng.standard_normal(base.shape).astype(np.float32))
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    k = exact_ids.shape[1]
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx_ids, exact_ids))
+    return hits / (k * len(exact_ids))
+
+
+def time_queries(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float]]:
+    """Single-query latency (the serving pattern) plus the hit ids."""
+    ids, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        batch = index.search_batch(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        ids.append(batch.ids[0])
+    return np.vstack(ids), latencies
+
+
+def benchmark_size(seed: np.ndarray, n: int, k: int, n_queries: int) -> list[dict]:
+    from ml.models.index import PRIndex, resolve_index_spec
+
+    rng = np.random.default_rng(n)
+    corpus = synthesize(seed, n, rng)
+    queries = synthesize(seed, n_queries, rng)
+    metadata = [{} for _ in range(n)]
+
+    rows = []
+    exact_ids = None
+    for spec, param, values in SWEEP:
+        index = PRIndex(dim=DIM, index_spec=spec)
+        t0 = time.perf_counter()
+        index.build(corpus, metadata)
+        build_s = time.perf_counter() - t0
+
+        for value in values:
+            if param:
+                index.set_search_params(**{param: value})
+            ids, latencies = time_queries(index, queries, k)
+            if spec == "flat":
+                exact_ids = ids
+            p50, p99 = np.percentile(latencies, [50, 99])
+            row = {
+                "n": n,
+                "index": resolve_index_spec(spec, n, DIM),
+                "param": f"{param}={value}" if param else "-",
+                "recall_at_k": round(recall_at_k(ids, exact_ids), 4),
+                "p50_ms": round(float(p50), 3),
+                "p99_ms": round(float(p99), 3),
+                "build_s": round(build_s, 2),
+            }
+            logger.info(str(row))
+            rows.append(row)
+    return rows
+
+
+def write_results(rows: list[dict], k: int) -> None:
+    RESULTS_JSON.write_text(json.dumps({"k": k, "results": rows}, indent=2))
+    lines = [
+        f"| Corpus | Index | Param | Recall@{k} | p50 ms | p99 ms | Build s |",
+        "|--------|-------|-------|-----------|--------|--------|---------|",
+    ]
+    for r in rows:
+        lines.append(
+            f"| {r['n']} | {r['index']} | {r['param']} | {r['recall_at_k']} "
+            f"| {r['p50_ms']} | {r['p99_ms']} | {r['build_s']} |"
+        )
+    RESULTS_MD.write_text("\n".join(lines) + "\n")
+    logger.info(f"Results saved to {RESULTS_JSON} and {RESULTS_MD}")
+    print("\n" + "\n".join(lines))
+
+
+def run_benchmark(sizes: list[int] = SIZES, k: int = 10, n_queries: int = N_QUERIES) -> list[dict]:
+    seed = load_seed_vectors()
+    rows = []
+    for n in sizes:
+        logger.info(f"Benchmarking corpus size {n} ...")
+        rows.extend(benchmark_size(seed, n, k, n_queries))
+    write_results(rows, k)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAISS index recall/latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=N_QUERIES)
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.k, args.queries)
@@ -0,0 +1,76 @@
+"""
+Model-free file importance features shared by both APIs.
+
+The Space's ``score_files`` and the main API's streamed ``heuristic`` event
+rank files from the same signals: where the file lives, its share of the PR's
+churn and whether its path looks security-sensitive, damped for tests and
+small config edits. ``file_features`` computes them for a whole PR at once so
+both callers agree on weights and keyword lists.
+"""
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+PATH_WEIGHT = 0.3
+SIZE_WEIGHT = 0.3
+SECURITY_WEIGHT = 0.4
+
+_HIGH_PATHS = ["src/", "lib/", "core/", "app/", "api/", "auth", "crypto",
+               "secret", "token", "password", "security"]
+_LOW_PATHS = ["docs/", ".md", ".txt", ".github/", "LICENSE", "CHANGELOG"]
+_SECURITY_KEYWORDS = ["auth", "crypto", "secret", "token", "password",
+                      "security", "permission", "oauth", "jwt", "key"]
+_TEST_KEYWORDS = ["test", "spec", "__tests__", ".test.", ".spec."]
+_CONFIG_EXTS = [".json", ".yaml", ".yml", ".toml", ".lock", ".env"]
+
+
+def path_score(filename: str) -> float:
+    f = filename.lower()
+    if any(p in f for p in _HIGH_PATHS):
+        return 0.9
+    if any(f.endswith(p) or p in f for p in _LOW_PATHS):
+        return 0.2
+    return 0.5
+
+
+def size_score(additions: np.ndarray, deletions: np.ndarray, total: int) -> np.ndarray:
+    """Sigmoid of each file's share of the PR's changed lines; 0.5 when nothing changed."""
+    if total == 0:
+        return np.full(len(additions), 0.5)
+    ratio = (additions + deletions) / max(total, 1)
+    return 1 / (1 + np.exp(-5 * (ratio - 0.3)))
+
+
+def security_score(filename: str) -> float:
+    return 1.0 if any(k in filename.lower() for k in _SECURITY_KEYWORDS) else 0.0
+
+
+def penalty_for_test(filename: str) -> float:
+    return 0.7 if any(k in filename.lower() for k in _TEST_KEYWORDS) else 1.0
+
+
+def penalty_for_config(filename: str, additions: int, deletions: int) -> float:
+    if any(filename.endswith(e) for e in _CONFIG_EXTS) and (additions + deletions) < 50:
+        return 0.5
+    return 1.0
+
+
+def file_features(
+    filenames: Sequence[str],
+    additions: Sequence[int],
+    deletions: Sequence[int],
+    total_changes: int,
+) -> dict[str, np.ndarray]:
+    """Per-file ``path``, ``size`` and ``security`` features and the combined ``score``."""
+    adds = np.asarray(additions, dtype=np.float64)
+    dels = np.asarray(deletions, dtype=np.float64)
+    path = np.array([path_score(n) for n in filenames], dtype=np.float64)
+    size = size_score(adds, dels, total_changes)
+    security = np.array([security_score(n) for n in filenames], dtype=np.float64)
+
+    score = PATH_WEIGHT * path + SIZE_WEIGHT * size + SECURITY_WEIGHT * security
+    score *= np.array([penalty_for_test(n) for n in filenames])
+    score *= np.array([penalty_for_config(n, a, d) for n, a, d in zip(filenames, additions, deletions)])
+    return {"path": path, "size": size, "security": security, "score": score}
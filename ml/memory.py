@@ -0,0 +1,245 @@
+"""
+Memory instrumentation for the serving processes.
+
+Always-on numbers are cheap reads: RSS / peak RSS from ``/proc`` (falling back
+to ``getrusage``) and torch allocator counters when torch is already imported.
+
+``tracemalloc`` hooks every Python allocation, so ``MemoryProfiler`` only runs
+it inside an explicit window, bounded by time and/or a request budget. While a
+window is open, each request is bracketed by snapshots and the growth between
+them is attributed to the request's endpoint as top allocation sites.
+Snapshots are process-wide, so overlapping requests can bleed into each
+other's attribution — open windows on a quiet replica, or with a small
+``max_requests``, when the numbers need to be exact.
+"""
+from __future__ import annotations
+
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any
+
+import structlog
+
+log = structlog.get_logger()
+
+MAX_WINDOW_S = float(os.environ.get("MEMORY_TRACE_MAX_S", "300"))
+TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "5"))
+TOP_SITES = 10
+
+# Keep the profiler's own bookkeeping out of the attribution
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+]
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux /proc, falls back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """High-water resident set size in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == "darwin" else peak * 1024 / 1e6
+
+
+def torch_memory() -> dict | None:
+    """Allocator counters from torch, without importing it; None if torch isn't loaded."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    stats: dict[str, Any] = {"num_threads": torch.get_num_threads()}
+    try:
+        if torch.cuda.is_available():
+            stats["cuda"] = {
+                "allocated_mb": round(torch.cuda.memory_allocated() / 1e6, 1),
+                "reserved_mb": round(torch.cuda.memory_reserved() / 1e6, 1),
+                "max_allocated_mb": round(torch.cuda.max_memory_allocated() / 1e6, 1),
+            }
+    except Exception:
+        pass
+    return stats
+
+
+def memory_stats() -> dict:
+    """RSS, peak RSS and torch allocator stats — safe to call on every scrape."""
+    return {
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "torch": torch_memory(),
+    }
+
+
+class MemoryProfiler:
+    """On-demand tracemalloc windows with per-endpoint allocation attribution."""
+
+    def __init__(self, max_window_s: float = MAX_WINDOW_S, frames: int = TRACE_FRAMES):
+        self.max_window_s = max_window_s
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._deadline: float | None = None
+        self._requests_left: int | None = None
+        self._endpoints: set[str] | None = None
+        self._window: dict | None = None
+        self._last: dict | None = None
+        # Only stop tracemalloc on close if this window started it
+        # (PYTHONTRACEMALLOC or a benchmark may already be tracing)
+        self._started_tracing = False
+        # endpoint -> {"requests": n, "sites": {site: [size_bytes, count]}}
+        self._sites: dict[str, dict] = {}
+
+    @property
+    def active(self) -> bool:
+        return self._window is not None
+
+    def start(
+        self,
+        duration_s: float = 30.0,
+        max_requests: int | None = None,
+        endpoints: list[str] | None = None,
+    ) -> dict:
+        """Open a tracing window; it closes after ``duration_s`` or ``max_requests`` traced requests."""
+        if duration_s <= 0:
+            raise ValueError("duration_s must be positive")
+        duration_s = min(duration_s, self.max_window_s)
+        with self._lock:
+            if self._window is not None:
+                raise RuntimeError("a tracing window is already open")
+            self._sites = {}
+            self._deadline = time.monotonic() + duration_s
+            self._requests_left = max_requests
+            self._endpoints = set(endpoints) if endpoints else None
+            self._window = {
+                "started_at": time.time(),
+                "duration_s": duration_s,
+                "max_requests": max_requests,
+                "endpoints": sorted(self._endpoints) if self._endpoints else None,
+                "traced_requests": 0,
+            }
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(self.frames)
+            self._timer = threading.Timer(duration_s, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        log.info("memory tracing started", duration_s=duration_s, max_requests=max_requests,
+                 endpoints=endpoints)
+        return self.report()
+
+    def stop(self) -> dict:
+        """Close the window (if open), keeping its report; stops tracemalloc only if it started it."""
+        with self._lock:
+            if self._window is None:
+                return self._last or {"active": False}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            current, peak = tracemalloc.get_traced_memory()
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+            self._window.update(
+                stopped_at=time.time(),
+                traced_current_mb=round(current / 1e6, 1),
+                traced_peak_mb=round(peak / 1e6, 1),
+            )
+            self._last = {"active": False, "window": self._window, "endpoints": self._endpoint_report()}
+            self._window = None
+            self._deadline = None
+        log.info("memory tracing stopped", traced_requests=self._last["window"]["traced_requests"])
+        return self._last
+
+    def begin_request(self, path: str) -> tracemalloc.Snapshot | None:
+        """Snapshot before a request, if a window is open and ``path`` is traced."""
+        if self._window is None:
+            return None
+        if self._endpoints is not None and path not in self._endpoints:
+            return None
+        try:
+            return _snapshot()
+        except RuntimeError:  # window closed between the check and the snapshot
+            return None
+
+    def end_request(self, before: tracemalloc.Snapshot | None, endpoint: str) -> None:
+        """Attribute allocation growth since ``before`` to ``endpoint``."""
+        if before is None:
+            return
+        try:
+            after = _snapshot()
+        except RuntimeError:
+            return
+        diff = after.compare_to(before, "traceback")
+        close = False
+        with self._lock:
+            if self._window is None:
+                return
+            entry = self._sites.setdefault(endpoint, {"requests": 0, "sites": defaultdict(lambda: [0, 0])})
+            entry["requests"] += 1
+            for stat in diff:
+                if stat.size_diff <= 0:
+                    continue
+                site = entry["sites"][self._format_site(stat.traceback)]
+                site[0] += stat.size_diff
+                site[1] += stat.count_diff
+            self._window["traced_requests"] += 1
+            if self._requests_left is not None:
+                self._requests_left -= 1
+                close = self._requests_left <= 0
+        if close:
+            self.stop()
+
+    @staticmethod
+    def _format_site(traceback: tracemalloc.Traceback) -> str:
+        # Innermost frame first; outer frames show which call path allocated
+        return " <- ".join(f"{frame.filename}:{frame.lineno}" for frame in reversed(traceback))
+
+    def _endpoint_report(self, top: int = TOP_SITES) -> dict:
+        # Caller holds the lock
+        report = {}
+        for endpoint, entry in sorted(self._sites.items()):
+            ranked = sorted(entry["sites"].items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+            report[endpoint] = {
+                "requests": entry["requests"],
+                "top_sites": [
+                    {"site": site, "size_kb": round(size / 1024, 1), "count": count,
+                     "per_request_kb": round(size / 1024 / entry["requests"], 1)}
+                    for site, (size, count) in ranked
+                ],
+            }
+        return report
+
+    def report(self) -> dict:
+        """Live view of the open window, else the last closed window's report."""
+        with self._lock:
+            if self._window is None:
+                return self._last or {"active": False}
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                "active": True,
+                "window": {
+                    **self._window,
+                    "remaining_s": round(max(0.0, self._deadline - time.monotonic()), 1),
+                    "requests_left": self._requests_left,
+                    "traced_current_mb": round(current / 1e6, 1),
+                    "traced_peak_mb": round(peak / 1e6, 1),
+                },
+                "endpoints": self._endpoint_report(),
+            }
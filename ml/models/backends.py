@@ -0,0 +1,216 @@
+"""
+Pluggable inference backends for the sequence-classification reranker.
+
+``torch`` runs the Hugging Face checkpoint eagerly; ``onnxruntime`` serves the
+graph produced by ``ml.models.export_onnx`` / ``ml.models.quantize`` (INT8 by
+default). Both take tokenizer output as numpy arrays and return one logit per
+row, so callers can swap them without touching tokenization.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Protocol
+
+import numpy as np
+import structlog
+from pydantic import BaseModel
+
+log = structlog.get_logger()
+
+ONNX_DIR = Path(__file__).parent / "reranker_onnx"
+DEFAULT_ONNX_PATH = ONNX_DIR / "model_int8.onnx"
+# Written by ``ml.models.export_onnx`` next to the graphs it produces
+ONNX_SOURCE_FILE = "source.json"
+
+BACKENDS = ("onnxruntime", "torch")
+
+
+class OrtSessionConfig(BaseModel):
+    """onnxruntime ``SessionOptions`` knobs (0 threads = let ORT decide)."""
+
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    graph_optimization_level: str = "all"  # disable | basic | extended | all
+
+    @classmethod
+    def from_env(cls) -> "OrtSessionConfig":
+        return cls(
+            intra_op_num_threads=int(os.environ.get("ORT_INTRA_OP_THREADS", "0")),
+            inter_op_num_threads=int(os.environ.get("ORT_INTER_OP_THREADS", "0")),
+            graph_optimization_level=os.environ.get("ORT_GRAPH_OPT_LEVEL", "all"),
+        )
+
+
+def write_onnx_source(onnx_dir: str | Path, model_name_or_path: str) -> None:
+    """Record which checkpoint the graphs in ``onnx_dir`` were exported from."""
+    (Path(onnx_dir) / ONNX_SOURCE_FILE).write_text(json.dumps({"source": model_name_or_path}) + "\n")
+
+
+def onnx_source(onnx_path: str | Path) -> str | None:
+    """The checkpoint a graph was exported from, or None if it was not recorded."""
+    sidecar = Path(onnx_path).parent / ONNX_SOURCE_FILE
+    try:
+        return json.loads(sidecar.read_text())["source"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _same_checkpoint(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    # Local checkpoints may be recorded as relative or absolute paths
+    return Path(a).exists() and Path(b).exists() and Path(a).resolve() == Path(b).resolve()
+
+
+def _check_onnx_source(onnx_path: str | Path, model_name_or_path: str) -> None:
+    source = onnx_source(onnx_path)
+    if source is None:
+        raise ValueError(f"{onnx_path} has no {ONNX_SOURCE_FILE}; re-export it with ml.models.export_onnx")
+    if not _same_checkpoint(source, model_name_or_path):
+        raise ValueError(f"{onnx_path} was exported from {source!r}, not {model_name_or_path!r}")
+
+
+class InferenceBackend(Protocol):
+    name: str
+
+    def __call__(self, encoded: dict[str, np.ndarray]) -> np.ndarray:
+        """Run a forward pass on tokenizer output; returns logits of shape (N,)."""
+        ...
+
+
+class TorchBackend:
+    """Eager PyTorch ``AutoModelForSequenceClassification``."""
+
+    name = "torch"
+
+    def __init__(self, model_name_or_path: str, device: str = "cpu", **from_pretrained_kwargs: Any):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        self._torch = torch
+        self.device = device
+        self._model = AutoModelForSequenceClassification.from_pretrained(
+            model_name_or_path, num_labels=1, **from_pretrained_kwargs
+        )
+        self._model.eval()
+        self._model.to(device=device)
+
+    def __call__(self, encoded: dict[str, np.ndarray]) -> np.ndarray:
+        torch = self._torch
+        inputs = {k: torch.as_tensor(np.asarray(v)).to(self.device) for k, v in encoded.items()}
+        with torch.no_grad():
+            logits = self._model(**inputs).logits
+        return logits.reshape(-1).float().cpu().numpy()
+
+    @property
+    def model(self) -> Any:
+        return self._model
+
+
+class OnnxRuntimeBackend:
+    """onnxruntime ``InferenceSession`` over an exported (optionally INT8) graph."""
+
+    name = "onnxruntime"
+
+    _OPT_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+
+    def __init__(self, onnx_path: str | Path, config: OrtSessionConfig | None = None):
+        import onnxruntime as ort
+
+        path = Path(onnx_path)
+        if not path.exists():
+            raise FileNotFoundError(f"ONNX model not found at {path}")
+
+        config = config or OrtSessionConfig()
+        if config.graph_optimization_level not in self._OPT_LEVELS:
+            raise ValueError(
+                f"unknown graph_optimization_level {config.graph_optimization_level!r}; "
+                f"expected one of {sorted(self._OPT_LEVELS)}"
+            )
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = config.intra_op_num_threads
+        opts.inter_op_num_threads = config.inter_op_num_threads
+        opts.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, self._OPT_LEVELS[config.graph_optimization_level]
+        )
+        self.path = path
+        self.config = config
+        self._session = ort.InferenceSession(
+            str(path), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [i.name for i in self._session.get_inputs()]
+
+    def __call__(self, encoded: dict[str, np.ndarray]) -> np.ndarray:
+        input_ids = np.asarray(encoded["input_ids"], dtype=np.int64)
+        feed = {}
+        for name in self._input_names:
+            if name in encoded:
+                feed[name] = np.asarray(encoded[name], dtype=np.int64)
+            else:
+                # RoBERTa tokenizers emit no token_type_ids but the export declares them.
+                feed[name] = np.zeros_like(input_ids)
+        return np.asarray(self._session.run(None, feed)[0], dtype=np.float32).reshape(-1)
+
+
+def load_backend(
+    preference: str = "auto",
+    model_name_or_path: str | None = None,
+    onnx_path: str | Path | None = None,
+    device: str = "cpu",
+    session_config: OrtSessionConfig | None = None,
+    **from_pretrained_kwargs: Any,
+) -> InferenceBackend:
+    """Load the preferred backend, falling back to the others in ``BACKENDS`` order.
+
+    Args:
+        preference: ``"auto"`` (ONNX first), ``"onnxruntime"`` or ``"torch"``.
+        model_name_or_path: Checkpoint for the torch backend.
+        onnx_path: Graph for the onnxruntime backend. Defaults to
+            ``ml/models/reranker_onnx/model_int8.onnx``. When
+            ``model_name_or_path`` is given, the graph is only used if its
+            recorded source (``source.json``) is that checkpoint.
+        device: Torch device; the ONNX backend always runs on CPU.
+        session_config: onnxruntime session options.
+
+    Raises:
+        RuntimeError: If no backend could be loaded.
+    """
+    if preference != "auto" and preference not in BACKENDS:
+        raise ValueError(f"unknown backend {preference!r}; expected 'auto' or one of {BACKENDS}")
+
+    order = list(BACKENDS)
+    if preference in BACKENDS:
+        order.remove(preference)
+        order.insert(0, preference)
+
+    errors: dict[str, str] = {}
+    for name in order:
+        try:
+            if name == "onnxruntime":
+                path = onnx_path or DEFAULT_ONNX_PATH
+                if model_name_or_path is not None and Path(path).exists():
+                    # A graph from another checkpoint would pair its logits with the wrong tokenizer
+                    _check_onnx_source(path, model_name_or_path)
+                backend: InferenceBackend = OnnxRuntimeBackend(path, session_config)
+            else:
+                if model_name_or_path is None:
+                    raise ValueError("no checkpoint given for the torch backend")
+                backend = TorchBackend(model_name_or_path, device=device, **from_pretrained_kwargs)
+        except Exception as e:
+            errors[name] = str(e)
+            log.info("inference backend unavailable", backend=name, error=str(e))
+            continue
+        if errors:
+            log.warning("falling back to inference backend", backend=name, preference=preference, errors=errors)
+        else:
+            log.info("inference backend loaded", backend=name)
+        return backend
+
+    raise RuntimeError(f"no inference backend could be loaded: {errors}")
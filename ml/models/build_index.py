@@ -1,17 +1,40 @@
 """
 Build FAISS index from HuggingFace dataset.
-Usage: python -m ml.models.build_index
+Usage: python -m ml.models.build_index [--index-spec flat|ivf_flat|ivf_pq|hnsw|<factory>]
+                                       [--incremental [--prune]] [--records PATH.jsonl]
+                                       [--chunk-size N] [--checkpoint-every N] [--no-resume]
+                                       [--workers N [--threads-per-worker T]]
+
+Records are streamed in chunks (Arrow slices of the HF dataset, or JSONL
+lines), embedded, and appended to the index and the columnar metadata store
+chunk by chunk, so memory stays flat as the corpus grows. Full builds write a
+checkpoint every ``--checkpoint-every`` chunks; rerunning the same command
+after an interruption resumes from the last one. ``--workers N`` embeds chunks
+on N processes (see ``ml.models.embed_workers``) while keeping index order
+deterministic.
 """
+import argparse
+import hashlib
 import json
 import os
+import resource
 import time
 from pathlib import Path
+from typing import Any, Iterator
 
 import numpy as np
 import structlog
 
+from .embed_workers import EmbeddingWorkerPool, SerialEmbedder
 from .embedder import CodeEmbedder
-from .index import PRIndex
+from .index import (
+    COLUMNAR_SUFFIX,
+    MANIFEST_SUFFIX,
+    ColumnarMetadataWriter,
+    PRIndex,
+    index_key,
+    write_manifest,
+)
 
 log = structlog.get_logger()
 
@@ -19,6 +42,19 @@ FAISS_DIR = Path(__file__).parent / "faiss"
 HF_DATASET_DIR = Path(__file__).parent.parent / "data" / "hf_dataset"
 PROCESSED_DIR = Path(__file__).parent.parent / "data" / "processed"
 
+CHUNK_SIZE = 2048
+CHECKPOINT_EVERY = 8  # chunks
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+PARTIAL_SUFFIX = ".partial"
+
+METADATA_SCHEMA = {
+    "filename": "str",
+    "importance_score": "float64",
+    "hunk_preview": "str",
+    "pr_id": "int64",
+    "repo": "str",
+}
+
 
 def format_hunk_text(record: dict) -> str:
     """Format a hunk record as text for embedding."""
@@ -27,105 +63,438 @@ def format_hunk_text(record: dict) -> str:
     return f"// {filename}\n{raw[:1024]}"
 
 
-def load_records() -> list[dict]:
-    """Load records from HF dataset or fallback to JSONL."""
+def record_key(record: dict) -> str:
+    """Manifest key: (repo, pr_id, hunk), where hunk is ``filename:hunk_index`` for hunk records."""
+    hunk = record.get("filename", "")
+    if record.get("hunk_index") is not None:
+        hunk = f"{hunk}:{record['hunk_index']}"
+    return index_key(record.get("repo", ""), record.get("pr_id", 0), hunk)
+
+
+def record_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def record_metadata(record: dict) -> dict:
+    raw = record.get("raw", "") or record.get("patch", "") or ""
+    return {
+        "filename": record.get("filename", ""),
+        "importance_score": record.get("importance_score", 0.0),
+        "hunk_preview": raw[:200],
+        "pr_id": record.get("pr_id", 0),
+        "repo": record.get("repo", ""),
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def find_source(records_path: str | Path | None = None) -> tuple[str, Any]:
+    """Locate the corpus: ``("hf", train_split)`` or ``("jsonl", path)``."""
+    if records_path:
+        return "jsonl", Path(records_path)
+
     # Try HF dataset first
     if HF_DATASET_DIR.exists():
         try:
             from datasets import load_from_disk
-            ds = load_from_disk(str(HF_DATASET_DIR))
-            train = ds["train"]
-            records = [train[i] for i in range(len(train))]
-            log.info("loaded records from HF dataset", n=len(records), split="train")
-            return records
+            return "hf", load_from_disk(str(HF_DATASET_DIR))["train"]
         except Exception as e:
             log.warning("could not load HF dataset, falling back to JSONL", error=str(e))
-    
+
     # Fallback to JSONL
     hunks_path = PROCESSED_DIR / "pr_hunks.jsonl"
-    if hunks_path.exists():
-        records = []
-        with open(hunks_path) as f:
-            for line in f:
-                if line.strip():
-                    records.append(json.loads(line))
-        log.info("loaded hunk records from JSONL", n=len(records))
-        return records
-    
     files_path = PROCESSED_DIR / "pr_files.jsonl"
-    if files_path.exists():
-        records = []
-        with open(files_path) as f:
-            for line in f:
-                if line.strip():
-                    records.append(json.loads(line))
-        log.info("loaded file records from JSONL", n=len(records))
-        return records
-    
+    for path in (hunks_path, files_path):
+        if path.exists():
+            return "jsonl", path
+
     raise FileNotFoundError(
         f"No dataset found. Run `python -m ml.data.build_dataset` first.\n"
         f"Looked in: {HF_DATASET_DIR}, {hunks_path}"
     )
 
 
+def _source_id(source: tuple[str, Any]) -> str:
+    kind, handle = source
+    return f"hf:{HF_DATASET_DIR}" if kind == "hf" else f"jsonl:{Path(handle).resolve()}"
+
+
+def count_records(source: tuple[str, Any]) -> int:
+    kind, handle = source
+    if kind == "hf":
+        return len(handle)
+    with open(handle) as f:
+        return sum(1 for line in f if line.strip())
+
+
+def iter_record_chunks(
+    source: tuple[str, Any],
+    chunk_size: int = CHUNK_SIZE,
+    start: int = 0,
+) -> Iterator[list[dict]]:
+    """Yield lists of up to ``chunk_size`` records, skipping the first ``start``."""
+    kind, handle = source
+    if kind == "hf":
+        for lo in range(start, len(handle), chunk_size):
+            # Slicing reads one Arrow record batch as columns
+            columns = handle[lo : lo + chunk_size]
+            yield [dict(zip(columns, values)) for values in zip(*columns.values())]
+        return
+
+    chunk: list[dict] = []
+    seen = 0
+    with open(handle) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            seen += 1
+            if seen <= start:
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def load_records(records_path: str | Path | None = None) -> list[dict]:
+    """Load every record into memory (small corpora / notebooks only)."""
+    source = find_source(records_path)
+    return [r for chunk in iter_record_chunks(source) for r in chunk]
+
+
+def _limited_chunks(source, chunk_size: int, start: int, total: int) -> Iterator[list[dict]]:
+    done = start
+    for chunk in iter_record_chunks(source, chunk_size, start):
+        if done >= total:
+            return
+        chunk = chunk[: total - done]
+        done += len(chunk)
+        yield chunk
+
+
+class _Progress:
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.embedded = 0
+        self.embed_s = 0.0
+        self.t0 = time.time()
+
+    def track(self, stream: Iterator[tuple[Any, np.ndarray | None]]) -> Iterator[tuple[Any, np.ndarray | None]]:
+        """Count embedded records and time spent waiting on the embedder."""
+        while True:
+            t0 = time.time()
+            try:
+                payload, embeddings = next(stream)
+            except StopIteration:
+                return
+            self.embed_s += time.time() - t0
+            if embeddings is not None:
+                self.embedded += len(embeddings)
+            yield payload, embeddings
+
+    def records_per_s(self) -> float:
+        return round(self.embedded / max(time.time() - self.t0, 1e-9), 1)
+
+    def log_chunk(self, n: int) -> None:
+        self.done += n
+        log.info("chunk indexed", done=self.done, total=self.total,
+                 records_per_s=self.records_per_s(), peak_rss_mb=_peak_rss_mb())
+
+
+def _build_streaming(
+    source, total: int, save_path: str, index: PRIndex, executor: SerialEmbedder | EmbeddingWorkerPool,
+    chunk_size: int, checkpoint_every: int, resume: bool,
+) -> _Progress:
+    ckpt_path = Path(save_path + CHECKPOINT_SUFFIX)
+    partial_index = save_path + PARTIAL_SUFFIX
+    partial_manifest = Path(save_path + MANIFEST_SUFFIX + PARTIAL_SUFFIX)
+    source_id = _source_id(source)
+
+    ckpt = json.loads(ckpt_path.read_text()) if resume and ckpt_path.exists() else None
+    if ckpt and (ckpt["source"] != source_id or ckpt["index_spec"] != index.index_spec):
+        log.warning("ignoring checkpoint from a different build", checkpoint=str(ckpt_path))
+        ckpt = None
+
+    if ckpt:
+        index.load_vectors(partial_index)
+        writer = ColumnarMetadataWriter(save_path + COLUMNAR_SUFFIX, METADATA_SCHEMA,
+                                        resume_rows=ckpt["rows"])
+        index.set_metadata_store(writer)
+        os.truncate(partial_manifest, ckpt["manifest_bytes"])
+        log.info("resuming from checkpoint", records_done=ckpt["records_done"], total=total)
+    else:
+        writer = ColumnarMetadataWriter(save_path + COLUMNAR_SUFFIX, METADATA_SCHEMA)
+        partial_manifest.write_text("")
+
+    progress = _Progress(total, ckpt["records_done"] if ckpt else 0)
+    trained = ckpt is not None
+    # IVF/PQ need a training sample before anything can be added
+    need = 0 if index.index_spec in ("flat", "hnsw") else min(total, index.train_sample or total)
+    pending: list[tuple] = []
+
+    with open(partial_manifest, "a") as manifest_f:
+
+        def append(embeddings, metadata, keys, digests):
+            ids = index.add(embeddings, metadata)
+            manifest_f.writelines(
+                json.dumps([key, int(idx), digest]) + "\n"
+                for key, idx, digest in zip(keys, ids, digests)
+            )
+
+        def train(sample_size: int):
+            index.train(np.vstack([p[0] for p in pending]), expected_size=total)
+            index.set_metadata_store(writer)
+            for p in pending:
+                append(*p)
+            pending.clear()
+            log.info("index trained", index_spec=index.index_spec, sample=sample_size)
+
+        def checkpoint():
+            writer.flush()
+            manifest_f.flush()
+            os.fsync(manifest_f.fileno())
+            index.save_vectors(partial_index)
+            tmp = ckpt_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps({
+                "source": source_id,
+                "index_spec": index.index_spec,
+                "records_done": progress.done,
+                "rows": len(writer),
+                "manifest_bytes": manifest_f.tell(),
+            }))
+            os.replace(tmp, ckpt_path)
+            log.info("checkpoint written", records_done=progress.done)
+
+        buffered = 0
+        def chunk_texts():
+            for chunk in _limited_chunks(source, chunk_size, progress.done, total):
+                texts = [format_hunk_text(r) for r in chunk]
+                yield (chunk, texts), texts
+
+        embedded = progress.track(executor.map_ordered(chunk_texts()))
+        for n_chunk, ((chunk, texts), embeddings) in enumerate(embedded, start=1):
+            item = (
+                embeddings,
+                [record_metadata(r) for r in chunk],
+                [record_key(r) for r in chunk],
+                [record_digest(t) for t in texts],
+            )
+            if trained:
+                append(*item)
+            else:
+                pending.append(item)
+                buffered += len(chunk)
+                if buffered >= need:
+                    train(buffered)
+                    trained = True
+            progress.log_chunk(len(chunk))
+            if trained and n_chunk % checkpoint_every == 0:
+                checkpoint()
+
+        if pending:
+            train(buffered)
+        if index.size == 0 and not trained:
+            raise ValueError("no records to index")
+
+    writer.close()
+    index.save_vectors(save_path)
+    with open(partial_manifest) as f:
+        write_manifest(save_path + MANIFEST_SUFFIX, (json.loads(line) for line in f), len(writer))
+    for leftover in (Path(partial_index), partial_manifest, ckpt_path):
+        leftover.unlink(missing_ok=True)
+    return progress
+
+
+def _update_incremental(
+    source, total: int, save_path: str, index: PRIndex, executor: SerialEmbedder | EmbeddingWorkerPool,
+    chunk_size: int, prune: bool,
+) -> _Progress:
+    index.load(save_path)
+    progress = _Progress(total, 0)
+    seen: set[str] = set()
+    unchanged = 0
+
+    def changed_records():
+        nonlocal unchanged
+        for chunk in _limited_chunks(source, chunk_size, 0, total):
+            keys = [record_key(r) for r in chunk]
+            texts = [format_hunk_text(r) for r in chunk]
+            digests = [record_digest(t) for t in texts]
+            seen.update(keys)
+            # Last occurrence of a key wins, matching the manifest semantics
+            latest = {key: i for i, key in enumerate(keys)}
+            todo = [i for key, i in latest.items()
+                    if index.manifest.get(key, (None, None))[1] != digests[i]]
+            unchanged += len(latest) - len(todo)
+            payload = (
+                len(chunk),
+                [record_metadata(chunk[i]) for i in todo],
+                [keys[i] for i in todo],
+                [digests[i] for i in todo],
+            )
+            yield payload, [texts[i] for i in todo]
+
+    # Replaced and pruned ids are removed in one pass at the end: an HNSW
+    # removal rebuilds the whole graph, so one per chunk would cost more than
+    # a full build
+    replaced: list[int] = []
+    for (n, metadata, keys, digests), embeddings in progress.track(executor.map_ordered(changed_records())):
+        if embeddings is not None:
+            index.upsert(embeddings, metadata, keys, digests, pending_removals=replaced)
+        progress.log_chunk(n)
+
+    stale = [key for key in index.manifest if key not in seen] if prune else []
+    if replaced or stale:
+        index.remove(replaced + [index.manifest[key][0] for key in stale])
+    log.info("incremental FAISS update", n_records=total, n_embedded=progress.embedded,
+             n_unchanged=unchanged, n_pruned=len(stale))
+    index.save(save_path)
+    return progress
+
+
 def build_index(
     max_records: int | None = None,
     batch_size: int = 32,
     index_path: str | None = None,
+    index_spec: str = "flat",
+    nprobe: int = 16,
+    ef_search: int = 64,
+    incremental: bool = False,
+    prune: bool = False,
+    records_path: str | None = None,
+    chunk_size: int = CHUNK_SIZE,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+    resume: bool = True,
+    workers: int = 1,
+    threads_per_worker: int | None = None,
 ) -> PRIndex:
-    """Build FAISS index from dataset records."""
-    records = load_records()
+    """Build FAISS index from dataset records.
+
+    ``index_spec`` picks exact (``flat``) or approximate search (``ivf_flat``,
+    ``ivf_pq``, ``hnsw`` or a ``faiss.index_factory`` string); see
+    ``ml.eval.benchmark_index`` for the recall/latency trade-off. IVF/PQ specs
+    are trained on the first ``PRIndex.train_sample`` records of the stream.
+
+    With ``incremental``, an existing index and manifest at ``index_path`` are
+    reused: only records whose key is new or whose content changed are
+    embedded and upserted (``prune`` also removes keys no longer in the corpus).
+    IVF/PQ centroids are not retrained, so run a full build after large
+    distribution shifts.
+
+    ``workers`` > 1 embeds on that many processes, each pinned to
+    ``threads_per_worker`` threads (default: cores / workers).
+    """
+    source = find_source(records_path)
+    total = count_records(source)
     if max_records:
-        records = records[:max_records]
-    
-    log.info("building FAISS index", n_records=len(records))
-    
-    embedder = CodeEmbedder()
-    texts = [format_hunk_text(r) for r in records]
-    
-    log.info("embedding records", n=len(texts))
-    t0 = time.time()
-    embeddings = embedder.embed(texts, batch_size=batch_size)
-    embed_time = time.time() - t0
-    log.info("embedding complete", n=len(texts), elapsed_s=round(embed_time, 1), records_per_s=round(len(texts)/embed_time, 1))
-    
-    metadata = []
-    for r in records:
-        raw = r.get("raw", "") or r.get("patch", "") or ""
-        metadata.append({
-            "filename": r.get("filename", ""),
-            "importance_score": r.get("importance_score", 0.0),
-            "hunk_preview": raw[:200],
-            "pr_id": r.get("pr_id", 0),
-            "repo": r.get("repo", ""),
-        })
-    
-    index = PRIndex(dim=768)
-    index.build(embeddings, metadata)
-    
+        total = min(total, max_records)
+
     save_path = index_path or str(FAISS_DIR / "hunk_index.faiss")
-    index.save(save_path)
-    
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    if incremental and not Path(save_path + MANIFEST_SUFFIX).exists():
+        log.warning("no manifest next to index, falling back to a full build", path=save_path)
+        incremental = False
+
+    index = PRIndex(dim=768, index_spec=index_spec, nprobe=nprobe, ef_search=ef_search)
+    if workers > 1:
+        executor = EmbeddingWorkerPool(workers, threads_per_worker, factory=CodeEmbedder, batch_size=batch_size)
+    else:
+        executor = SerialEmbedder(CodeEmbedder(), batch_size=batch_size)
+    log.info("building FAISS index", n_records=total, incremental=incremental,
+             chunk_size=chunk_size, workers=workers)
+    try:
+        if incremental:
+            progress = _update_incremental(source, total, save_path, index, executor,
+                                           chunk_size, prune)
+        else:
+            progress = _build_streaming(source, total, save_path, index, executor,
+                                        chunk_size, checkpoint_every, resume)
+            index.load(save_path)
+    except BaseException:
+        if isinstance(executor, EmbeddingWorkerPool):
+            executor.terminate()
+        raise
+    executor.close()
+
+    throughput = executor.report()
+    for worker_id, stats in throughput["workers"].items():
+        log.info("embedding worker throughput", worker=worker_id, **stats)
+
     index_size_mb = Path(save_path).stat().st_size / 1e6 if Path(save_path).exists() else 0
-    log.info("saved FAISS index", path=save_path, size_mb=round(index_size_mb, 1), n_vectors=index.size)
-    
+    log.info("saved FAISS index", path=save_path, size_mb=round(index_size_mb, 1), n_vectors=index.size,
+             index_spec=index_spec, n_embedded=progress.embedded, embed_s=round(progress.embed_s, 1),
+             records_per_s=progress.records_per_s(), peak_rss_mb=_peak_rss_mb(),
+             workers=workers, parallel_efficiency=throughput["parallel_efficiency"])
+
     # Log to W&B if available
     try:
         import wandb
         if os.environ.get("WANDB_API_KEY"):
             wandb.init(project=os.environ.get("WANDB_PROJECT", "assert-review"), job_type="build_index")
             wandb.log({
-                "embed_time_s": embed_time,
+                "embed_time_s": progress.embed_s,
                 "n_vectors": index.size,
                 "index_size_mb": index_size_mb,
                 "embedding_dim": 768,
+                "index_spec": index_spec,
+                "n_embedded": progress.embedded,
+                "records_per_s": progress.records_per_s(),
+                "peak_rss_mb": _peak_rss_mb(),
+                "workers": workers,
+                "parallel_efficiency": throughput["parallel_efficiency"],
             })
             wandb.finish()
     except Exception:
         pass
-    
+
     return index
 
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build the FAISS hunk index.")
+    parser.add_argument("--max-records", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--index-path", default=None)
+    parser.add_argument("--index-spec", default="flat",
+                        help="flat, ivf_flat, ivf_pq, hnsw or a faiss.index_factory string")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW search beam width")
+    parser.add_argument("--incremental", action="store_true",
+                        help="embed only records missing from (or changed since) the existing index")
+    parser.add_argument("--prune", action="store_true",
+                        help="with --incremental, remove indexed keys no longer in the corpus")
+    parser.add_argument("--records", default=None, help="JSONL corpus to index instead of the default dataset")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="records embedded per chunk")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="chunks between resumable checkpoints")
+    parser.add_argument("--no-resume", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--workers", type=int, default=1, help="embedding processes, each with its own model")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch/BLAS threads per worker (default: cores / workers)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    build_index()
+    args = parse_args()
+    build_index(
+        max_records=args.max_records,
+        batch_size=args.batch_size,
+        index_path=args.index_path,
+        index_spec=args.index_spec,
+        nprobe=args.nprobe,
+        ef_search=args.ef_search,
+        incremental=args.incremental,
+        prune=args.prune,
+        records_path=args.records,
+        chunk_size=args.chunk_size,
+        checkpoint_every=args.checkpoint_every,
+        resume=not args.no_resume,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+    )
@@ -7,6 +7,9 @@ from __future__ import annotations
 import numpy as np
 from typing import TYPE_CHECKING
 
+from .batching import encode_in_length_buckets
+from .embedding_cache import EmbeddingCache
+
 if TYPE_CHECKING:
     pass
 
@@ -16,11 +19,28 @@ class CodeEmbedder:
     
     Mean-pools last hidden state and L2-normalizes the output.
     Returns numpy arrays of shape (N, 768).
+    
+    With ``max_tokens`` set (the default), texts are sorted by token length and
+    packed into batches under that padded-token budget instead of fixed-size
+    input-order batches; rows are returned in input order either way.
+    
+    With an ``EmbeddingCache``, texts seen before (same model, truncation and
+    content) are served from the cache and only misses reach the model.
     """
     
-    def __init__(self, model_name: str = "microsoft/codebert-base", device: str = "cpu"):
+    MAX_LENGTH = 512
+    
+    def __init__(
+        self,
+        model_name: str = "microsoft/codebert-base",
+        device: str = "cpu",
+        max_tokens: int | None = 32 * 512,
+        cache: EmbeddingCache | None = None,
+    ):
         self.model_name = model_name
         self.device = device
+        self.max_tokens = max_tokens
+        self.cache = cache
         self._model = None
         self._tokenizer = None
     
@@ -46,32 +66,77 @@ class CodeEmbedder:
         count = mask.sum(dim=1).clamp(min=1e-9)
         return summed / count
     
-    def embed(self, texts: list[str], batch_size: int = 32) -> np.ndarray:
-        """Embed a list of texts. Returns shape (N, 768), L2-normalized rows."""
-        self._load()
+    def _encode_batch(self, encoded) -> np.ndarray:
+        """Forward one padded batch → L2-normalized pooled embeddings."""
         torch = self._torch
-        all_embeddings = []
+        encoded = {k: v.to(self.device) for k, v in encoded.items()}
+        
+        with torch.no_grad():
+            outputs = self._model(**encoded)
+        
+        pooled = self._mean_pool(outputs.last_hidden_state, encoded["attention_mask"])
         
+        # L2 normalize
+        norms = pooled.norm(dim=-1, keepdim=True).clamp(min=1e-9)
+        return (pooled / norms).cpu().numpy()
+    
+    def embed(
+        self,
+        texts: list[str],
+        batch_size: int = 32,
+        max_tokens: int | None = None,
+    ) -> np.ndarray:
+        """Embed a list of texts. Returns shape (N, 768), L2-normalized rows.
+        
+        ``max_tokens`` overrides the instance token budget for length-bucketed
+        batching; ``batch_size`` is only used when bucketing is disabled.
+        """
+        if self.cache is None:
+            return self._embed_uncached(texts, batch_size, max_tokens)
+        
+        keys = [
+            EmbeddingCache.make_key(self.model_name, f"max_length={self.MAX_LENGTH}", t)
+            for t in texts
+        ]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        if missing:
+            fresh = self._embed_uncached([texts[i] for i in missing], batch_size, max_tokens)
+            self.cache.put_many([keys[i] for i in missing], fresh)
+            for i, vec in zip(missing, fresh):
+                cached[i] = vec
+        if not texts:
+            return np.zeros((0, 768), dtype=np.float32)
+        return np.vstack(cached).astype(np.float32)
+    
+    def _embed_uncached(
+        self,
+        texts: list[str],
+        batch_size: int = 32,
+        max_tokens: int | None = None,
+    ) -> np.ndarray:
+        self._load()
+        max_tokens = max_tokens or self.max_tokens
+        
+        if max_tokens:
+            out = np.zeros((len(texts), self._model.config.hidden_size), dtype=np.float32)
+            for idx, encoded in encode_in_length_buckets(
+                self._tokenizer, texts, self.MAX_LENGTH, max_tokens, return_tensors="pt"
+            ):
+                out[idx] = self._encode_batch(encoded)
+            return out
+        
+        all_embeddings = []
         for i in range(0, len(texts), batch_size):
             batch = texts[i : i + batch_size]
             encoded = self._tokenizer(
                 batch,
                 padding=True,
                 truncation=True,
-                max_length=512,
+                max_length=self.MAX_LENGTH,
                 return_tensors="pt",
             )
-            encoded = {k: v.to(self.device) for k, v in encoded.items()}
-            
-            with torch.no_grad():
-                outputs = self._model(**encoded)
-            
-            pooled = self._mean_pool(outputs.last_hidden_state, encoded["attention_mask"])
-            
-            # L2 normalize
-            norms = pooled.norm(dim=-1, keepdim=True).clamp(min=1e-9)
-            normalized = (pooled / norms).cpu().numpy()
-            all_embeddings.append(normalized)
+            all_embeddings.append(self._encode_batch(encoded))
         
         return np.vstack(all_embeddings).astype(np.float32)
     
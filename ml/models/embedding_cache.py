@@ -0,0 +1,173 @@
+"""
+Content-addressed embedding cache.
+
+Keys are a SHA-256 over (model id, truncation settings, content parts) so an
+unchanged file diff maps to the same vector across /rank, /cluster and
+/retrieve and across re-pushes of a PR. Two tiers:
+
+- a bounded in-memory LRU (``max_entries`` vectors)
+- an optional on-disk SQLite tier (``disk_path``) that survives restarts;
+  disk hits are promoted back into memory.
+
+Configure the process-wide instance with ``EMBEDDING_CACHE_SIZE`` and
+``EMBEDDING_CACHE_PATH``.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import structlog
+
+log = structlog.get_logger()
+
+
+class EmbeddingCache:
+    """Thread-safe two-tier (LRU memory + optional SQLite) embedding cache."""
+
+    def __init__(self, max_entries: int = 10_000, disk_path: str | Path | None = None):
+        self.max_entries = max_entries
+        self.disk_path = str(disk_path) if disk_path else None
+        self._mem: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_path:
+            Path(self.disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model_id: str, truncation: str, *parts: str) -> str:
+        """Content hash of the model, its truncation settings and the input parts."""
+        h = hashlib.sha256()
+        for part in (model_id, truncation, *parts):
+            data = (part or "").encode("utf-8", "surrogatepass")
+            # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> list[np.ndarray | None]:
+        """Look up ``keys``; returns a vector or None per key."""
+        found: list[np.ndarray | None] = [None] * len(keys)
+        to_disk: list[int] = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._mem.get(key)
+                if vec is not None:
+                    self._mem.move_to_end(key)
+                    found[i] = vec
+                    self.hits += 1
+                else:
+                    to_disk.append(i)
+
+            if to_disk and self._db is not None:
+                wanted = list({keys[i] for i in to_disk})
+                rows: dict[str, np.ndarray] = {}
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start : start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    for key, dim, blob in self._db.execute(
+                        f"SELECT key, dim, vec FROM embeddings WHERE key IN ({placeholders})",
+                        chunk,
+                    ):
+                        rows[key] = np.frombuffer(blob, dtype=np.float32, count=dim).copy()
+                still_missing = []
+                for i in to_disk:
+                    vec = rows.get(keys[i])
+                    if vec is None:
+                        still_missing.append(i)
+                        continue
+                    found[i] = vec
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(keys[i], vec)
+                to_disk = still_missing
+
+            self.misses += len(to_disk)
+        return found
+
+    def put_many(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        """Store one vector per key in memory (and on disk, if configured)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for key, vec in zip(keys, vectors):
+                self._remember(key, vec.copy())
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vec) VALUES (?, ?, ?)",
+                    [(key, int(vec.shape[0]), vec.tobytes()) for key, vec in zip(keys, vectors)],
+                )
+                self._db.commit()
+
+    def get(self, key: str) -> np.ndarray | None:
+        return self.get_many([key])[0]
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        self.put_many([key], np.asarray(vector, dtype=np.float32).reshape(1, -1))
+
+    def _remember(self, key: str, vec: np.ndarray) -> None:
+        # Caller holds the lock
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._mem),
+                "max_entries": self.max_entries,
+                "disk_path": self.disk_path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+
+_embedding_cache: EmbeddingCache | None = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide cache configured from ``EMBEDDING_CACHE_SIZE`` / ``EMBEDDING_CACHE_PATH``."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    max_entries=int(os.environ.get("EMBEDDING_CACHE_SIZE", "10000")),
+                    disk_path=os.environ.get("EMBEDDING_CACHE_PATH") or None,
+                )
+                log.info("embedding cache ready", **_embedding_cache.stats())
+    return _embedding_cache
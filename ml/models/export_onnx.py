@@ -1,6 +1,6 @@
 """
 ONNX export and INT8 quantization of the distilled student reranker.
-Usage: python -m ml.models.export_onnx
+Usage: python -m ml.models.export_onnx [--out-dir DIR] [--int8-only] [--no-fallback]
 """
 from __future__ import annotations
 
@@ -8,6 +8,8 @@ from pathlib import Path
 
 import structlog
 
+from .backends import write_onnx_source
+
 log = structlog.get_logger()
 
 CHECKPOINT_DIR = Path(__file__).parent / "reranker"
@@ -17,18 +19,29 @@ ONNX_DIR = Path(__file__).parent / "reranker_onnx"
 def export_reranker_to_onnx(
     checkpoint_path: str | None = None,
     output_path: str | None = None,
-) -> None:
+    allow_fallback: bool = True,
+) -> str:
     """Export the distilled student reranker to ONNX format (opset 14).
 
     Load order: local checkpoint → ``ritunjaym/prism-reranker`` on HF Hub →
     ``microsoft/codebert-base`` (final fallback).  Verifies that the maximum
-    absolute difference between PyTorch and ONNX outputs is < 1e-3.
+    absolute difference between PyTorch and ONNX outputs is < 1e-3.  The
+    checkpoint used is recorded in ``source.json`` next to the graph.
 
     Args:
         checkpoint_path: Path to a local model directory.  Defaults to
             ``ml/models/reranker``.
         output_path: Destination ``.onnx`` file path.  Defaults to
             ``ml/models/reranker_onnx/model.onnx``.
+        allow_fallback: When False, raise instead of exporting
+            ``microsoft/codebert-base`` with an untrained scoring head.
+
+    Returns:
+        The checkpoint the graph was exported from.
+
+    Raises:
+        RuntimeError: If ``allow_fallback`` is False and the trained reranker
+            could not be loaded.
     """
     import torch
     from transformers import AutoModelForSequenceClassification, AutoTokenizer
@@ -48,6 +61,8 @@ def export_reranker_to_onnx(
             # Quick check: try loading tokenizer to detect format issues
             AutoTokenizer.from_pretrained(model_name, cache_dir="/tmp/hf-cache")
         except Exception as e:
+            if not allow_fallback:
+                raise RuntimeError(f"could not load {model_name}: {e}") from e
             log.warning(f"HF Hub load failed ({e}). Falling back to microsoft/codebert-base")
             model_name = "microsoft/codebert-base"
 
@@ -57,6 +72,8 @@ def export_reranker_to_onnx(
             model_name, num_labels=1, cache_dir="/tmp/hf-cache"
         )
     except Exception as e:
+        if not allow_fallback:
+            raise RuntimeError(f"could not load {model_name}: {e}") from e
         log.warning(f"Failed to load {model_name} ({e}). Falling back to microsoft/codebert-base")
         model_name = "microsoft/codebert-base"
         tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir="/tmp/hf-cache")
@@ -100,6 +117,8 @@ def export_reranker_to_onnx(
     log.info(f"Max output diff PyTorch vs ONNX: {diff:.6f} ({'OK' if diff < 1e-3 else 'WARNING'})")
 
     log.info("exported ONNX model", path=str(out), size_mb=round(out.stat().st_size/1e6, 1), max_diff=round(float(diff), 6), status="ok" if diff < 1e-3 else "WARNING")
+    write_onnx_source(out.parent, model_name)
+    return model_name
 
 
 def quantize_onnx_model(
@@ -150,8 +169,23 @@ def quantize_onnx_model(
 
 
 if __name__ == "__main__":
-    export_reranker_to_onnx()
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out-dir", type=Path, default=ONNX_DIR,
+                        help="Directory for model.onnx and model_int8.onnx")
+    parser.add_argument("--int8-only", action="store_true",
+                        help="Delete the FP32 graph once the INT8 one is written")
+    parser.add_argument("--no-fallback", action="store_true",
+                        help="Fail instead of exporting an untrained codebert-base head")
+    args = parser.parse_args()
+
+    fp32, int8 = args.out_dir / "model.onnx", args.out_dir / "model_int8.onnx"
+    export_reranker_to_onnx(output_path=str(fp32), allow_fallback=not args.no_fallback)
     try:
-        quantize_onnx_model()
+        quantize_onnx_model(str(fp32), str(int8))
     except FileNotFoundError as e:
         log.warning("skipping quantization", error=str(e))
+    else:
+        if args.int8_only:
+            fp32.unlink()
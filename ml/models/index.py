@@ -1,16 +1,54 @@
 """
 FAISS index for dense retrieval over code hunks.
-Uses IndexFlatIP (inner product = cosine sim on L2-normalized vectors).
+Inner product = cosine sim on L2-normalized vectors. Exact search by default
+(IndexFlatIP); ``index_spec`` selects an approximate index instead:
+
+- ``"flat"``      exact brute force
+- ``"ivf_flat"``  inverted lists, full vectors (tune ``nprobe``)
+- ``"ivf_pq"``    inverted lists, product-quantized codes (tune ``nprobe``)
+- ``"hnsw"``      HNSW graph (tune ``ef_search``)
+- any other string is passed to ``faiss.index_factory`` as-is,
+  e.g. ``"IVF1024,PQ48"`` or ``"HNSW64"``.
+
+Metadata is stored next to the index as a columnar directory
+(``<index>.cols/``): numeric columns as ``.npy`` arrays and string columns as
+an offsets array plus a UTF-8 data buffer, all memory-mapped on load so only
+rows for returned hits are materialized. Legacy pickled ``<index>.meta``
+sidecars are still readable; convert them with
+``python -m ml.models.index convert <index>.meta``.
+
+Vectors live in an ID-mapped index whose ids are metadata row numbers, so
+``add``/``remove``/``upsert`` work without a rebuild. Rows added to a loaded
+index are kept beside the memory-mapped columns (``AppendedMetadata``) and
+``save`` streams both into a fresh columnar directory, so the existing rows are
+never decoded. Removed rows stay in the metadata store as unreachable
+tombstones until the next full build. A
+manifest (``<index>.manifest.json``) maps each ``(repo, pr_id, hunk)`` key to
+its id and content digest for incremental builds.
 """
 from __future__ import annotations
 
+import argparse
+import json
+import math
+import os
 import pickle
+import shutil
 from pathlib import Path
-from typing import NamedTuple
+from typing import Any, Iterable, NamedTuple, Sequence
 
 import numpy as np
+import structlog
 from pydantic import BaseModel
 
+log = structlog.get_logger()
+
+COLUMNAR_SUFFIX = ".cols"
+COPY_CHUNK_ROWS = 65_536
+_KIND_RANK = {"int64": 0, "float64": 1, "str": 2}
+LEGACY_META_SUFFIX = ".meta"
+MANIFEST_SUFFIX = ".manifest.json"
+
 
 class RetrievalResult(BaseModel):
     score: float
@@ -21,13 +59,368 @@ class RetrievalResult(BaseModel):
     repo: str = ""
 
 
+class BatchSearchResult(NamedTuple):
+    """Raw top-k hits for N queries; metadata is looked up only on demand."""
+    scores: np.ndarray  # (N, k) float32, descending per row
+    ids: np.ndarray     # (N, k) int64, -1 where fewer than k hits
+
+
+def _column_kind(values: list[Any]) -> str:
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (bool, int, np.integer)) for v in present):
+        return "int64"
+    if present and all(isinstance(v, (bool, int, float, np.integer, np.floating)) for v in present):
+        return "float64"
+    return "str"
+
+
+def _merged_schema(schema: dict[str, str], rows: Sequence[dict]) -> dict[str, str]:
+    """``schema`` widened to hold ``rows`` too, as ``write_columnar_metadata`` would type them."""
+    merged = dict(schema)
+    for row in rows:
+        for name in row:
+            merged.setdefault(name, "")
+    for name, kind in merged.items():
+        values = [row.get(name) for row in rows]
+        if any(v is not None for v in values):
+            new = _column_kind(values)
+            kind = new if not kind or _KIND_RANK[new] > _KIND_RANK[kind] else kind
+        merged[name] = kind or "str"
+    return merged
+
+
+def write_columnar_metadata(rows: Sequence[dict], directory: str | Path) -> Path:
+    """Write ``rows`` (list of flat dicts) as a columnar metadata directory."""
+    names: list[str] = []
+    for row in rows:
+        names.extend(k for k in row if k not in names)
+    schema = {name: _column_kind([row.get(name) for row in rows]) for name in names}
+
+    writer = ColumnarMetadataWriter(directory, schema)
+    writer.extend(rows)
+    return writer.close()
+
+
+def _truncate_or_create(path: Path, size: int) -> None:
+    if not path.exists():
+        if size:
+            raise ValueError(f"cannot resume: {path} is missing")
+        path.touch()
+        return
+    if path.stat().st_size < size:
+        raise ValueError(f"cannot resume: {path} is shorter than the checkpoint")
+    os.truncate(path, size)
+
+
+class ColumnarMetadataWriter:
+    """Append-only writer for the ``ColumnarMetadata`` layout with bounded memory.
+
+    Rows are streamed to raw staging files in ``<directory>.partial/`` and
+    ``close()`` turns them into the ``.npy`` columns. ``resume_rows`` reopens an
+    existing staging directory truncated to that many rows, so an interrupted
+    build can continue from its last checkpoint.
+    """
+
+    def __init__(self, directory: str | Path, schema: dict[str, str], resume_rows: int = 0):
+        self.directory = Path(directory)
+        self.schema = dict(schema)
+        self.staging = Path(str(directory) + ".partial")
+        if not resume_rows and self.staging.exists():
+            shutil.rmtree(self.staging)
+        self.staging.mkdir(parents=True, exist_ok=True)
+        self._files: dict[str, list] = {}
+        for name, kind in self.schema.items():
+            if kind == "str":
+                lengths_path = self.staging / f"{name}.lengths"
+                data_path = self.staging / f"{name}.data"
+                n_bytes = 0
+                if resume_rows and lengths_path.exists():
+                    n_bytes = int(np.fromfile(lengths_path, dtype=np.int64, count=resume_rows).sum())
+                _truncate_or_create(lengths_path, resume_rows * 8)
+                _truncate_or_create(data_path, n_bytes)
+                self._files[name] = [open(lengths_path, "ab"), open(data_path, "ab")]
+            else:
+                values_path = self.staging / f"{name}.values"
+                _truncate_or_create(values_path, resume_rows * np.dtype(kind).itemsize)
+                self._files[name] = [open(values_path, "ab")]
+        self._rows = resume_rows
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def extend(self, rows: Sequence[dict]) -> None:
+        rows = list(rows)
+        for name, kind in self.schema.items():
+            values = [row.get(name) for row in rows]
+            if kind == "str":
+                encoded = [("" if v is None else str(v)).encode("utf-8") for v in values]
+                lengths_f, data_f = self._files[name]
+                lengths_f.write(np.array([len(b) for b in encoded], dtype=np.int64).tobytes())
+                data_f.write(b"".join(encoded))
+            else:
+                arr = np.array([0 if v is None else v for v in values], dtype=kind)
+                self._files[name][0].write(arr.tobytes())
+        self._rows += len(rows)
+
+    def copy_from(self, meta: ColumnarMetadata, chunk_rows: int = COPY_CHUNK_ROWS) -> None:
+        """Append every row of ``meta`` column by column, ``chunk_rows`` at a time, without building dicts.
+
+        Columns missing from ``meta`` are filled like ``None``; numeric columns
+        widen to ``float64`` or ``str`` when this writer's schema does.
+        """
+        n = len(meta)
+        for name, kind in self.schema.items():
+            source = meta.schema.get(name)
+            for start in range(0, n, chunk_rows):
+                stop = min(start + chunk_rows, n)
+                if kind == "str":
+                    lengths_f, data_f = self._files[name]
+                    if source == "str":
+                        offsets, data = meta._strings[name]
+                        bounds = np.asarray(offsets[start : stop + 1], dtype=np.int64)
+                        lengths_f.write(np.diff(bounds).tobytes())
+                        data_f.write(np.asarray(data[bounds[0] : bounds[-1]]).tobytes())
+                    elif source is None:
+                        lengths_f.write(np.zeros(stop - start, dtype=np.int64).tobytes())
+                    else:
+                        encoded = [str(meta.value(name, i)).encode("utf-8") for i in range(start, stop)]
+                        lengths_f.write(np.array([len(b) for b in encoded], dtype=np.int64).tobytes())
+                        data_f.write(b"".join(encoded))
+                elif source is None:
+                    self._files[name][0].write(np.zeros(stop - start, dtype=kind).tobytes())
+                else:
+                    self._files[name][0].write(
+                        np.asarray(meta.column(name)[start:stop]).astype(kind).tobytes()
+                    )
+        self._rows += n
+
+    def flush(self) -> None:
+        """Make everything appended so far durable (called at checkpoints)."""
+        for files in self._files.values():
+            for f in files:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self) -> Path:
+        """Finalize into ``directory``, replacing any previous contents only once complete.
+
+        Columns are written to ``<directory>.tmp`` and swapped in by rename, so
+        readers never see a half-written directory and a crash leaves the old
+        one in place. Existing memory maps of the old files stay valid.
+        """
+        self.flush()
+        for files in self._files.values():
+            for f in files:
+                f.close()
+        tmp = Path(str(self.directory) + ".tmp")
+        old = Path(str(self.directory) + ".old")
+        for leftover in (tmp, old):
+            if leftover.exists():
+                shutil.rmtree(leftover)
+        tmp.mkdir(parents=True)
+
+        for name, kind in self.schema.items():
+            if kind == "str":
+                lengths = np.fromfile(self.staging / f"{name}.lengths", dtype=np.int64)
+                offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+                np.save(tmp / f"{name}.offsets.npy", offsets)
+                data_path = self.staging / f"{name}.data"
+                data = (
+                    np.memmap(data_path, dtype=np.uint8, mode="r")
+                    if data_path.stat().st_size else np.zeros(0, dtype=np.uint8)
+                )
+                np.save(tmp / f"{name}.data.npy", data)
+            else:
+                np.save(tmp / f"{name}.npy",
+                        np.fromfile(self.staging / f"{name}.values", dtype=kind))
+
+        (tmp / "schema.json").write_text(
+            json.dumps({"n_rows": self._rows, "columns": self.schema}, indent=2)
+        )
+        if self.directory.exists():
+            os.replace(self.directory, old)
+        os.replace(tmp, self.directory)
+        if old.exists():
+            shutil.rmtree(old)
+        shutil.rmtree(self.staging)
+        return self.directory
+
+
+class ColumnarMetadata:
+    """Read-only, memory-mapped columnar metadata; rows are built on access."""
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        spec = json.loads((self.directory / "schema.json").read_text())
+        self.n_rows: int = spec["n_rows"]
+        self.schema: dict[str, str] = spec["columns"]
+        self._numeric: dict[str, np.ndarray] = {}
+        self._strings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for name, kind in self.schema.items():
+            if kind == "str":
+                self._strings[name] = (
+                    np.load(self.directory / f"{name}.offsets.npy", mmap_mode="r"),
+                    np.load(self.directory / f"{name}.data.npy", mmap_mode="r"),
+                )
+            else:
+                self._numeric[name] = np.load(self.directory / f"{name}.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def column(self, name: str) -> np.ndarray:
+        """Memory-mapped numeric column (no copy)."""
+        return self._numeric[name]
+
+    def value(self, name: str, i: int) -> Any:
+        if name in self._strings:
+            offsets, data = self._strings[name]
+            return bytes(data[offsets[i] : offsets[i + 1]]).decode("utf-8")
+        v = self._numeric[name][i]
+        return int(v) if self.schema[name] == "int64" else float(v)
+
+    def __getitem__(self, i: int) -> dict:
+        i = int(i)
+        if i < 0:
+            i += self.n_rows
+        if not 0 <= i < self.n_rows:
+            raise IndexError(f"row {i} out of range for {self.n_rows} rows")
+        return {name: self.value(name, i) for name in self.schema}
+
+    def rows(self, ids: Sequence[int]) -> list[dict]:
+        return [self[i] for i in ids]
+
+    def __iter__(self):
+        return (self[i] for i in range(self.n_rows))
+
+
+class AppendedMetadata:
+    """A loaded ``ColumnarMetadata`` plus rows added since; the mapped rows are never copied."""
+
+    def __init__(self, base: ColumnarMetadata):
+        self.base = base
+        self.appended: list[dict] = []
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.appended)
+
+    def __getitem__(self, i: int) -> dict:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if 0 <= i < len(self.base):
+            return self.base[i]
+        if not 0 <= i < len(self):
+            raise IndexError(f"row {i} out of range for {len(self)} rows")
+        return self.appended[i - len(self.base)]
+
+    def extend(self, rows: Sequence[dict]) -> None:
+        self.appended.extend(rows)
+
+    def rows(self, ids: Sequence[int]) -> list[dict]:
+        return [self[i] for i in ids]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def write_metadata(
+    metadata: Sequence[dict] | ColumnarMetadata | AppendedMetadata, directory: str | Path
+) -> Path:
+    """Write any in-memory or mapped metadata as a columnar directory, streaming mapped rows."""
+    if isinstance(metadata, AppendedMetadata):
+        base, appended = metadata.base, metadata.appended
+    elif isinstance(metadata, ColumnarMetadata):
+        base, appended = metadata, []
+    else:
+        return write_columnar_metadata(metadata, directory)
+    writer = ColumnarMetadataWriter(directory, _merged_schema(base.schema, appended))
+    writer.copy_from(base)
+    writer.extend(appended)
+    return writer.close()
+
+
+def load_metadata(index_path: str | Path) -> ColumnarMetadata | list[dict]:
+    """Load the metadata sidecar for ``index_path`` (columnar, else legacy pickle)."""
+    columnar = Path(str(index_path) + COLUMNAR_SUFFIX)
+    if (columnar / "schema.json").exists():
+        return ColumnarMetadata(columnar)
+    legacy = Path(str(index_path) + LEGACY_META_SUFFIX)
+    log.warning("loading legacy pickle metadata; convert with `python -m ml.models.index convert`",
+                path=str(legacy))
+    with open(legacy, "rb") as f:
+        return pickle.load(f)
+
+
+def convert_pickle_metadata(meta_path: str | Path, out_dir: str | Path | None = None) -> Path:
+    """Convert a legacy pickled ``.meta`` sidecar into the columnar format."""
+    meta_path = Path(meta_path)
+    if out_dir is None:
+        base = str(meta_path)
+        if base.endswith(LEGACY_META_SUFFIX):
+            base = base[: -len(LEGACY_META_SUFFIX)]
+        out_dir = base + COLUMNAR_SUFFIX
+    with open(meta_path, "rb") as f:
+        rows = pickle.load(f)
+    out = write_columnar_metadata(rows, out_dir)
+    log.info("converted pickle metadata to columnar", src=str(meta_path), dst=str(out), n_rows=len(rows))
+    return out
+
+
+def index_key(repo: str, pr_id: int, hunk: str | int) -> str:
+    """Manifest key identifying one indexed hunk."""
+    return f"{repo}#{pr_id}#{hunk}"
+
+
+def write_manifest(path: str | Path, entries: Iterable[tuple[str, int, str]], n_rows: int) -> None:
+    """Write ``(key, id, digest)`` entries as a manifest JSON, streaming entry by entry."""
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(f'{{"n_rows": {n_rows}, "keys": {{')
+        for i, (key, idx, digest) in enumerate(entries):
+            f.write(("," if i else "") + f"{json.dumps(key)}: [{int(idx)}, {json.dumps(digest)}]")
+        f.write("}}")
+    os.replace(tmp, path)
+
+
+def resolve_index_spec(spec: str, n: int, dim: int) -> str:
+    """Translate a named index spec into a ``faiss.index_factory`` string for ``n`` vectors."""
+    # ~4·sqrt(n) lists, but keep >= 39 training points per centroid
+    nlist = max(1, min(int(4 * math.sqrt(max(n, 1))), n // 39))
+    if spec == "flat":
+        return "Flat"
+    if spec == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if spec == "ivf_pq":
+        m = next(m for m in (dim // 16, dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+        nbits = max(1, min(8, int(math.log2(max(n // 39, 2)))))
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    if spec == "hnsw":
+        return "HNSW32"
+    return spec
+
+
 class PRIndex:
     """FAISS index wrapping embeddings + metadata for retrieval."""
     
-    def __init__(self, dim: int = 768):
+    def __init__(
+        self,
+        dim: int = 768,
+        index_spec: str = "flat",
+        train_sample: int | None = 100_000,
+        nprobe: int = 16,
+        ef_search: int = 64,
+    ):
         self.dim = dim
+        self.index_spec = index_spec
+        self.train_sample = train_sample
+        self.nprobe = nprobe
+        self.ef_search = ef_search
         self._index = None
-        self._metadata: list[dict] = []
+        self._metadata: list[dict] | ColumnarMetadata | AppendedMetadata = []
+        # key -> (id, content digest)
+        self._manifest: dict[str, tuple[int, str]] = {}
     
     def _get_faiss(self):
         try:
@@ -36,31 +429,214 @@ class PRIndex:
         except ImportError as e:
             raise ImportError("faiss-cpu required: pip install faiss-cpu") from e
     
-    def build(self, embeddings: np.ndarray, metadata: list[dict]) -> None:
-        """Build FAISS index from embeddings + metadata list."""
-        faiss = self._get_faiss()
+    def build(
+        self,
+        embeddings: np.ndarray,
+        metadata: list[dict],
+        keys: Sequence[str] | None = None,
+        digests: Sequence[str] | None = None,
+    ) -> None:
+        """Build FAISS index from embeddings + metadata list.
+
+        ``keys`` (see ``index_key``) and optional content ``digests`` seed the
+        manifest used by incremental builds.
+        """
         assert embeddings.shape[0] == len(metadata), "embeddings and metadata must match length"
         assert embeddings.shape[1] == self.dim, f"expected dim {self.dim}, got {embeddings.shape[1]}"
         
         emb = np.ascontiguousarray(embeddings.astype(np.float32))
-        self._index = faiss.IndexFlatIP(self.dim)
-        self._index.add(emb)
+        self.train(emb)
+        self._index.add_with_ids(emb, np.arange(len(emb), dtype=np.int64))
         self._metadata = list(metadata)
+        self._record_keys(np.arange(len(emb)), keys, digests)
+    
+    def train(self, sample: np.ndarray, expected_size: int | None = None) -> None:
+        """Start an empty (trained, for IVF/PQ) index; fill it with ``add``.
+
+        ``expected_size`` sizes the IVF lists for the final corpus when
+        ``sample`` is only its first part, as in a streaming build.
+        """
+        faiss = self._get_faiss()
+        sample = np.ascontiguousarray(sample.astype(np.float32))
+        self._index = faiss.IndexIDMap2(self._new_index(sample, expected_size))
+        self._metadata = []
+        self._manifest = {}
+        self.set_search_params()
+    
+    def set_metadata_store(self, store: Any) -> None:
+        """Route rows from ``add`` to an append-only store such as ``ColumnarMetadataWriter``."""
+        self._metadata = store
+    
+    def _new_index(self, emb: np.ndarray, expected_size: int | None = None):
+        """Create (and train, for IVF/PQ) the FAISS index described by ``index_spec``."""
+        faiss = self._get_faiss()
+        if self.index_spec == "flat":
+            return faiss.IndexFlatIP(self.dim)
+        
+        factory = resolve_index_spec(self.index_spec, expected_size or len(emb), self.dim)
+        index = faiss.index_factory(self.dim, factory, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            sample = emb
+            if self.train_sample and len(emb) > self.train_sample:
+                rng = np.random.default_rng(0)
+                sample = emb[np.sort(rng.choice(len(emb), self.train_sample, replace=False))]
+            index.train(sample)
+        return index
+    
+    def _record_keys(
+        self,
+        ids: np.ndarray,
+        keys: Sequence[str] | None,
+        digests: Sequence[str] | None,
+    ) -> None:
+        if keys is None:
+            return
+        assert len(keys) == len(ids), "keys and embeddings must match length"
+        for i, (idx, key) in enumerate(zip(ids.tolist(), keys)):
+            self._manifest[key] = (idx, digests[i] if digests is not None else "")
+    
+    def _ensure_id_map(self) -> None:
+        """Wrap a positional (pre-IDMap) index so vectors can be added/removed by id."""
+        faiss = self._get_faiss()
+        if isinstance(self._index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return
+        old = self._index
+        try:
+            faiss.extract_index_ivf(old).make_direct_map()
+        except RuntimeError:
+            pass  # not an IVF index
+        vectors = old.reconstruct_n(0, old.ntotal)
+        base = faiss.clone_index(old)
+        base.reset()
+        self._index = faiss.IndexIDMap2(base)
+        self._index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        self.set_search_params()
+    
+    def _writable_metadata(self) -> list[dict] | AppendedMetadata | ColumnarMetadataWriter:
+        if isinstance(self._metadata, ColumnarMetadata):
+            self._metadata = AppendedMetadata(self._metadata)
+        return self._metadata
+    
+    def add(
+        self,
+        embeddings: np.ndarray,
+        metadata: list[dict],
+        keys: Sequence[str] | None = None,
+        digests: Sequence[str] | None = None,
+    ) -> np.ndarray:
+        """Append vectors without retraining; returns their ids (metadata rows)."""
+        if self._index is None:
+            self.build(embeddings, metadata, keys, digests)
+            return np.arange(len(metadata), dtype=np.int64)
+        assert embeddings.shape[0] == len(metadata), "embeddings and metadata must match length"
+        assert embeddings.shape[1] == self.dim, f"expected dim {self.dim}, got {embeddings.shape[1]}"
+        
+        self._ensure_id_map()
+        rows = self._writable_metadata()
+        ids = np.arange(len(rows), len(rows) + len(metadata), dtype=np.int64)
+        self._index.add_with_ids(np.ascontiguousarray(embeddings.astype(np.float32)), ids)
+        rows.extend(metadata)
+        self._record_keys(ids, keys, digests)
+        return ids
+    
+    def remove(self, ids: Sequence[int]) -> int:
+        """Drop vectors by id; their metadata rows become tombstones. Returns count removed."""
+        if self._index is None:
+            raise RuntimeError("Index not built. Call build() or load() first.")
+        faiss = self._get_faiss()
+        self._ensure_id_map()
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if len(ids) == 0:
+            return 0
+        try:
+            removed = self._index.remove_ids(faiss.IDSelectorBatch(ids))
+        except RuntimeError:
+            # HNSW cannot delete in place: rebuild from the surviving vectors,
+            # which sit in the base index in id_map order
+            live = faiss.vector_to_array(self._index.id_map)
+            mask = ~np.isin(live, ids)
+            vectors = self._index.index.reconstruct_n(0, len(live))[mask]
+            base = faiss.clone_index(self._index.index)
+            base.reset()
+            self._index = faiss.IndexIDMap2(base)
+            if len(vectors):
+                self._index.add_with_ids(vectors, live[mask])
+            self.set_search_params()
+            removed = len(live) - int(mask.sum())
+        dropped = set(ids.tolist())
+        self._manifest = {k: v for k, v in self._manifest.items() if v[0] not in dropped}
+        return int(removed)
+    
+    def upsert(
+        self,
+        embeddings: np.ndarray,
+        metadata: list[dict],
+        keys: Sequence[str],
+        digests: Sequence[str] | None = None,
+        pending_removals: list[int] | None = None,
+    ) -> np.ndarray:
+        """Replace vectors whose key is already indexed and add the rest.
+
+        With ``pending_removals``, the replaced ids are appended to it instead
+        of removed, so a caller making many upserts can ``remove`` them all in
+        one pass (each HNSW removal rebuilds the graph). Until then searches
+        can still return the replaced vectors.
+        """
+        stale = [self._manifest[k][0] for k in keys if k in self._manifest]
+        if pending_removals is not None:
+            pending_removals.extend(stale)
+        elif stale:
+            self.remove(stale)
+        return self.add(embeddings, metadata, keys, digests)
+    
+    @property
+    def manifest(self) -> dict[str, tuple[int, str]]:
+        """Indexed keys mapped to ``(id, content digest)``."""
+        return self._manifest
+    
+    def set_search_params(self, nprobe: int | None = None, ef_search: int | None = None) -> None:
+        """Set query-time knobs (IVF ``nprobe``, HNSW ``efSearch``); no-op for flat."""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self._index is None:
+            return
+        faiss = self._get_faiss()
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", self.nprobe), ("efSearch", self.ef_search)):
+            try:
+                params.set_index_parameter(self._index, name, value)
+            except RuntimeError:
+                pass  # parameter does not apply to this index type
     
     def search(self, query: np.ndarray, k: int = 10) -> list[RetrievalResult]:
         """Search for top-k nearest neighbors."""
+        batch = self.search_batch(query.reshape(1, -1), k)
+        if batch.ids.shape[1] == 0:
+            return []
+        return self.materialize(batch.scores[0], batch.ids[0])
+    
+    def search_batch(self, queries: np.ndarray, k: int = 10) -> BatchSearchResult:
+        """Search N queries (N, d) in one FAISS call; returns compact arrays."""
         if self._index is None:
             raise RuntimeError("Index not built. Call build() or load() first.")
         
-        q = np.ascontiguousarray(query.reshape(1, -1).astype(np.float32))
+        q = np.ascontiguousarray(np.atleast_2d(queries).astype(np.float32))
         k = min(k, self._index.ntotal)
-        if k == 0:
-            return []
+        if k == 0 or len(q) == 0:
+            return BatchSearchResult(
+                scores=np.zeros((len(q), 0), dtype=np.float32),
+                ids=np.zeros((len(q), 0), dtype=np.int64),
+            )
         
         scores, indices = self._index.search(q, k)
-        
+        return BatchSearchResult(scores=scores, ids=indices.astype(np.int64))
+    
+    def materialize(self, scores: np.ndarray, ids: np.ndarray) -> list[RetrievalResult]:
+        """Build ``RetrievalResult`` objects for one row of a ``BatchSearchResult``."""
         results = []
-        for score, idx in zip(scores[0], indices[0]):
+        for score, idx in zip(scores, ids):
             if idx < 0:
                 continue
             meta = self._metadata[idx]
@@ -75,22 +651,59 @@ class PRIndex:
         
         return sorted(results, key=lambda r: r.score, reverse=True)
     
-    def save(self, path: str) -> None:
-        """Save FAISS index + metadata to disk."""
+    def save_vectors(self, path: str) -> None:
+        """Write only the FAISS index (atomically) — used for build checkpoints."""
         faiss = self._get_faiss()
+        tmp = f"{path}.tmp"
+        faiss.write_index(self._index, tmp)
+        os.replace(tmp, path)
+    
+    def load_vectors(self, path: str) -> None:
+        faiss = self._get_faiss()
+        self._index = faiss.read_index(str(path))
+        self.set_search_params()
+    
+    def save(self, path: str) -> None:
+        """Save FAISS index + columnar metadata (``<path>.cols/``) to disk."""
         path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self._index, str(path))
-        with open(str(path) + ".meta", "wb") as f:
-            pickle.dump(self._metadata, f)
+        self.save_vectors(str(path))
+        out = write_metadata(self._metadata, str(path) + COLUMNAR_SUFFIX)
+        if isinstance(self._metadata, AppendedMetadata):
+            # Appended rows are on disk now; map them instead of holding the dicts
+            self._metadata = ColumnarMetadata(out)
+        manifest_path = Path(str(path) + MANIFEST_SUFFIX)
+        if self._manifest:
+            write_manifest(
+                manifest_path,
+                ((k, idx, digest) for k, (idx, digest) in self._manifest.items()),
+                len(self._metadata),
+            )
+        elif manifest_path.exists():
+            manifest_path.unlink()
     
     def load(self, path: str) -> None:
-        """Load FAISS index + metadata from disk."""
-        faiss = self._get_faiss()
-        self._index = faiss.read_index(str(path))
-        with open(str(path) + ".meta", "rb") as f:
-            self._metadata = pickle.load(f)
+        """Load FAISS index + metadata from disk (metadata is memory-mapped)."""
+        self.load_vectors(path)
+        self._metadata = load_metadata(path)
+        manifest_path = Path(str(path) + MANIFEST_SUFFIX)
+        self._manifest = {}
+        if manifest_path.exists():
+            keys = json.loads(manifest_path.read_text())["keys"]
+            self._manifest = {k: (int(v[0]), v[1]) for k, v in keys.items()}
     
     @property
     def size(self) -> int:
         return self._index.ntotal if self._index else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PRIndex metadata utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="convert a pickled .meta sidecar to columnar")
+    convert.add_argument("meta_path")
+    convert.add_argument("--out", default=None, help="output directory (default: <index>.cols)")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print(convert_pickle_metadata(args.meta_path, args.out))
@@ -4,12 +4,16 @@ Falls back to zero-shot CodeBERT embedding cosine similarity if no checkpoint ex
 """
 from __future__ import annotations
 
+import os
 from pathlib import Path
 from typing import Any
 
 import numpy as np
 import structlog
 
+from .backends import OrtSessionConfig, load_backend
+from .batching import encode_in_length_buckets
+
 log = structlog.get_logger()
 
 CHECKPOINT_DIR = Path(__file__).parent / "reranker"
@@ -21,16 +25,32 @@ class Reranker:
     
     If the checkpoint doesn't exist, falls back to zero-shot scoring using
     the CodeEmbedder (cosine similarity as a proxy for importance).
+    
+    The forward pass runs on a pluggable backend (see ``ml.models.backends``):
+    ``backend="auto"`` serves the INT8 ONNX export when present and falls back
+    to eager PyTorch. Defaults come from ``RERANKER_BACKEND`` /
+    ``RERANKER_ONNX_PATH`` and the ``ORT_*`` session env vars.
+    
+    Texts are batched by token length under a ``max_tokens`` padded-token
+    budget; pass ``max_tokens=None`` for fixed 16-text input-order batches.
     """
     
     def __init__(
         self,
         checkpoint_path: str | None = None,
         device: str = "cpu",
+        backend: str | None = None,
+        onnx_path: str | None = None,
+        session_config: OrtSessionConfig | None = None,
+        max_tokens: int | None = 16 * 512,
     ):
         self.checkpoint_path = checkpoint_path or str(CHECKPOINT_DIR)
         self.device = device
-        self._model: Any = None
+        self.max_tokens = max_tokens
+        self.backend_preference = backend or os.environ.get("RERANKER_BACKEND", "auto")
+        self.onnx_path = onnx_path or os.environ.get("RERANKER_ONNX_PATH")
+        self.session_config = session_config or OrtSessionConfig.from_env()
+        self._backend: Any = None
         self._tokenizer: Any = None
         self._loaded = False
         self._zero_shot = False
@@ -48,16 +68,16 @@ class Reranker:
             return
         
         try:
-            import torch
-            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+            from transformers import AutoTokenizer
             
             self._tokenizer = AutoTokenizer.from_pretrained(str(path))
-            self._model = AutoModelForSequenceClassification.from_pretrained(
-                str(path), num_labels=1
+            self._backend = load_backend(
+                self.backend_preference,
+                model_name_or_path=str(path),
+                onnx_path=self.onnx_path,
+                device=self.device,
+                session_config=self.session_config,
             )
-            self._model.eval()
-            self._model.to(device=self.device)
-            self._torch = torch
             self._zero_shot = False
         except Exception as e:
             # If loading fails, fall back to zero-shot
@@ -81,9 +101,21 @@ class Reranker:
         
         return self._model_score(texts)
     
+    @property
+    def backend_name(self) -> str | None:
+        """Name of the loaded inference backend (None in zero-shot mode)."""
+        return self._backend.name if self._backend is not None else None
+    
     def _model_score(self, texts: list[str]) -> list[float]:
         """Score using the fine-tuned model."""
-        import torch
+        if self.max_tokens:
+            probs = np.zeros(len(texts), dtype=np.float64)
+            for idx, encoded in encode_in_length_buckets(
+                self._tokenizer, texts, 512, self.max_tokens, return_tensors="np"
+            ):
+                logits = self._backend(dict(encoded))
+                probs[idx] = 1.0 / (1.0 + np.exp(-logits.astype(np.float64)))
+            return probs.tolist()
         
         scores = []
         batch_size = 16
@@ -95,19 +127,13 @@ class Reranker:
                 padding=True,
                 truncation=True,
                 max_length=512,
-                return_tensors="pt",
+                return_tensors="np",
             )
-            encoded = {k: v.to(self.device) for k, v in encoded.items()}
-            
-            with torch.no_grad():
-                outputs = self._model(**encoded)
+            logits = self._backend(dict(encoded))
             
             # Apply sigmoid to get [0,1] scores
-            logits = outputs.logits.squeeze(-1)
-            probs = torch.sigmoid(logits).cpu().numpy().tolist()
-            if isinstance(probs, float):
-                probs = [probs]
-            scores.extend(probs)
+            probs = 1.0 / (1.0 + np.exp(-logits.astype(np.float64)))
+            scores.extend(probs.tolist())
         
         return scores
     
@@ -0,0 +1,184 @@
+"""Tests for the pluggable reranker inference backends (no real models loaded)."""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from ml.models import backends
+from ml.models.backends import OnnxRuntimeBackend, OrtSessionConfig, load_backend, onnx_source, write_onnx_source
+
+
+class FakeSession:
+    def __init__(self, input_names):
+        self._input_names = input_names
+        self.feed = None
+
+    def get_inputs(self):
+        class _Input:
+            def __init__(self, name):
+                self.name = name
+        return [_Input(n) for n in self._input_names]
+
+    def run(self, output_names, feed):
+        self.feed = feed
+        return [feed["input_ids"].sum(axis=1, keepdims=True).astype(np.float32)]
+
+
+class FakeTorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name_or_path, device="cpu", **kwargs):
+        self.model_name_or_path = model_name_or_path
+
+    def __call__(self, encoded):
+        return np.zeros(len(encoded["input_ids"]), dtype=np.float32)
+
+
+def make_onnx_backend(input_names):
+    backend = OnnxRuntimeBackend.__new__(OnnxRuntimeBackend)
+    backend._session = FakeSession(input_names)
+    backend._input_names = input_names
+    return backend
+
+
+def test_onnx_backend_fills_missing_token_type_ids():
+    backend = make_onnx_backend(["input_ids", "attention_mask", "token_type_ids"])
+    encoded = {
+        "input_ids": np.array([[1, 2, 3], [4, 5, 0]]),
+        "attention_mask": np.array([[1, 1, 1], [1, 1, 0]]),
+    }
+    logits = backend(encoded)
+
+    assert logits.shape == (2,)
+    np.testing.assert_allclose(logits, [6.0, 9.0])
+    feed = backend._session.feed
+    assert feed["token_type_ids"].dtype == np.int64
+    assert not feed["token_type_ids"].any()
+
+
+def test_onnx_backend_ignores_undeclared_inputs():
+    backend = make_onnx_backend(["input_ids", "attention_mask"])
+    encoded = {
+        "input_ids": np.array([[1, 2]]),
+        "attention_mask": np.array([[1, 1]]),
+        "token_type_ids": np.array([[0, 0]]),
+    }
+    backend(encoded)
+    assert set(backend._session.feed) == {"input_ids", "attention_mask"}
+
+
+def test_onnx_backend_missing_file_raises(tmp_path):
+    pytest.importorskip("onnxruntime")
+    with pytest.raises(FileNotFoundError):
+        OnnxRuntimeBackend(tmp_path / "missing.onnx")
+
+
+def test_load_backend_rejects_unknown_preference():
+    with pytest.raises(ValueError, match="unknown backend"):
+        load_backend("tensorrt")
+
+
+def test_load_backend_falls_back_to_torch(monkeypatch, tmp_path):
+    monkeypatch.setattr(backends, "TorchBackend", FakeTorchBackend)
+    backend = load_backend(
+        "onnxruntime",
+        model_name_or_path="ckpt",
+        onnx_path=tmp_path / "missing.onnx",
+    )
+    assert backend.name == "torch"
+
+
+def test_load_backend_raises_when_nothing_loads(tmp_path):
+    with pytest.raises(RuntimeError, match="no inference backend"):
+        load_backend("auto", model_name_or_path=None, onnx_path=tmp_path / "missing.onnx")
+
+
+class FakeOnnxBackend:
+    name = "onnxruntime"
+
+    def __init__(self, onnx_path, config=None):
+        self.path = onnx_path
+
+
+@pytest.fixture
+def graph(tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, "TorchBackend", FakeTorchBackend)
+    monkeypatch.setattr(backends, "OnnxRuntimeBackend", FakeOnnxBackend)
+    path = tmp_path / "model_int8.onnx"
+    path.write_bytes(b"graph")
+    return path
+
+
+def test_load_backend_uses_graph_exported_from_the_checkpoint(graph):
+    write_onnx_source(graph.parent, "ritunjaym/prism-reranker")
+    assert onnx_source(graph) == "ritunjaym/prism-reranker"
+    backend = load_backend("auto", model_name_or_path="ritunjaym/prism-reranker", onnx_path=graph)
+    assert backend.name == "onnxruntime"
+
+
+def test_load_backend_refuses_graph_from_another_checkpoint(graph):
+    write_onnx_source(graph.parent, "microsoft/codebert-base")
+    backend = load_backend("auto", model_name_or_path="ritunjaym/prism-reranker", onnx_path=graph)
+    assert backend.name == "torch"
+
+
+def test_load_backend_refuses_graph_of_unknown_source(graph):
+    assert onnx_source(graph) is None
+    backend = load_backend("auto", model_name_or_path="ritunjaym/prism-reranker", onnx_path=graph)
+    assert backend.name == "torch"
+
+
+def test_export_without_fallback_fails_when_reranker_is_unavailable(tmp_path, monkeypatch):
+    from ml.models.export_onnx import export_reranker_to_onnx
+
+    class Unavailable:
+        @staticmethod
+        def from_pretrained(*args, **kwargs):
+            raise OSError("hub unreachable")
+
+    fake = types.SimpleNamespace(AutoTokenizer=Unavailable, AutoModelForSequenceClassification=Unavailable)
+    monkeypatch.setitem(sys.modules, "torch", types.ModuleType("torch"))
+    monkeypatch.setitem(sys.modules, "transformers", fake)
+    out = tmp_path / "onnx" / "model.onnx"
+
+    with pytest.raises(RuntimeError, match="prism-reranker"):
+        export_reranker_to_onnx(str(tmp_path / "no-checkpoint"), str(out), allow_fallback=False)
+    assert not out.exists() and onnx_source(out) is None
+
+
+def test_session_config_from_env(monkeypatch):
+    monkeypatch.setenv("ORT_INTRA_OP_THREADS", "4")
+    monkeypatch.setenv("ORT_INTER_OP_THREADS", "1")
+    monkeypatch.setenv("ORT_GRAPH_OPT_LEVEL", "extended")
+    config = OrtSessionConfig.from_env()
+    assert config.intra_op_num_threads == 4
+    assert config.inter_op_num_threads == 1
+    assert config.graph_optimization_level == "extended"
+
+
+def test_reranker_model_score_uses_backend():
+    from ml.models.reranker import Reranker
+
+    class FakeTokenizer:
+        def __call__(self, texts, **kwargs):
+            return {
+                "input_ids": np.array([[len(t)] for t in texts]),
+                "attention_mask": np.ones((len(texts), 1), dtype=np.int64),
+            }
+
+    class LengthBackend:
+        name = "fake"
+
+        def __call__(self, encoded):
+            return encoded["input_ids"].reshape(-1).astype(np.float32) - 3.0
+
+    reranker = Reranker(max_tokens=None)
+    reranker._loaded = True
+    reranker._tokenizer = FakeTokenizer()
+    reranker._backend = LengthBackend()
+
+    scores = reranker.score(["abc", "abcdef", "a"])
+    expected = 1.0 / (1.0 + np.exp(-np.array([0.0, 3.0, -2.0])))
+    np.testing.assert_allclose(scores, expected, rtol=1e-6)
+    assert reranker.backend_name == "fake"
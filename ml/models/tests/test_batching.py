@@ -0,0 +1,94 @@
+"""Tests for length-bucketed batching (pure python, fake tokenizer)."""
+import numpy as np
+import pytest
+
+from ml.models.batching import (
+    encode_in_length_buckets,
+    fixed_size_batches,
+    length_bucketed_batches,
+    padding_stats,
+)
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer exposing the __call__/pad subset used by batching."""
+
+    def __call__(self, texts, truncation=True, max_length=512):
+        ids = [[len(w) for w in t.split()][:max_length] for t in texts]
+        return {"input_ids": ids, "attention_mask": [[1] * len(i) for i in ids]}
+
+    def pad(self, features, padding=True, return_tensors="np"):
+        longest = max(len(ids) for ids in features["input_ids"])
+        return {
+            key: np.array([row + [0] * (longest - len(row)) for row in rows])
+            for key, rows in features.items()
+        }
+
+
+def test_batches_cover_every_index_once():
+    lengths = [5, 512, 7, 3, 300, 9, 5, 120]
+    batches = length_bucketed_batches(lengths, max_tokens=600)
+    flat = sorted(i for b in batches for i in b)
+    assert flat == list(range(len(lengths)))
+
+
+def test_batches_respect_token_budget():
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(1, 512, size=200).tolist()
+    for batch in length_bucketed_batches(lengths, max_tokens=2048):
+        longest = max(lengths[i] for i in batch)
+        assert len(batch) == 1 or longest * len(batch) <= 2048
+
+
+def test_oversized_row_gets_own_batch():
+    batches = length_bucketed_batches([10, 1000, 10], max_tokens=100)
+    assert [1] in batches
+
+
+def test_max_batch_size_caps_rows():
+    batches = length_bucketed_batches([1] * 10, max_tokens=10_000, max_batch_size=4)
+    assert [len(b) for b in batches] == [4, 4, 2]
+
+
+def test_invalid_budget_raises():
+    with pytest.raises(ValueError):
+        length_bucketed_batches([1, 2], max_tokens=0)
+
+
+def test_bucketing_reduces_padding():
+    lengths = [512] + [10] * 31
+    fixed = padding_stats(lengths, fixed_size_batches(len(lengths), 32))
+    bucketed = padding_stats(lengths, length_bucketed_batches(lengths, max_tokens=8 * 512))
+    assert fixed["padded_tokens"] == 32 * 512
+    assert bucketed["padded_tokens"] < fixed["padded_tokens"]
+    assert bucketed["real_tokens"] == fixed["real_tokens"]
+
+
+def test_encode_in_length_buckets_pads_per_bucket():
+    texts = ["a b c d e f", "a", "a b", "a b c d e f g h"]
+    seen = []
+    for idx, batch in encode_in_length_buckets(FakeTokenizer(), texts, 512, max_tokens=8):
+        assert batch["input_ids"].shape[0] == len(idx)
+        assert batch["input_ids"].shape[1] == max(len(texts[i].split()) for i in idx)
+        seen.extend(idx)
+    assert sorted(seen) == [0, 1, 2, 3]
+
+
+def test_reranker_bucketed_scores_keep_input_order():
+    from ml.models.reranker import Reranker
+
+    class WordCountBackend:
+        name = "fake"
+
+        def __call__(self, encoded):
+            return encoded["attention_mask"].sum(axis=1).astype(np.float32) - 2.0
+
+    texts = ["a b c d e f g h", "a", "a b c", "a b"]
+    reranker = Reranker(max_tokens=8)
+    reranker._loaded = True
+    reranker._tokenizer = FakeTokenizer()
+    reranker._backend = WordCountBackend()
+
+    scores = reranker.score(texts)
+    logits = np.array([len(t.split()) for t in texts], dtype=np.float64) - 2.0
+    np.testing.assert_allclose(scores, 1.0 / (1.0 + np.exp(-logits)), rtol=1e-6)
@@ -0,0 +1,66 @@
+"""Tests for the multi-process embedding executors (fake embedders, no models)."""
+import os
+import time
+
+import numpy as np
+
+from ml.models.embed_workers import EmbeddingWorkerPool, SerialEmbedder
+
+
+class SlowShortEmbedder:
+    """Short batches take longest, so later submissions tend to finish first."""
+
+    def embed(self, texts, batch_size=32):
+        time.sleep(0.05 / len(texts))
+        return np.array([[float(t)] for t in texts], dtype=np.float32)
+
+
+class EnvEmbedder:
+    """Reports the worker's BLAS thread variable as the embedding."""
+
+    def embed(self, texts, batch_size=32):
+        return np.full((len(texts), 1), float(os.environ.get("OMP_NUM_THREADS", "-1")), dtype=np.float32)
+
+
+def make_items(n):
+    # Payload i carries texts "i*10 .. i*10+i" (batch sizes 1..n)
+    return [(i, [str(i * 10 + j) for j in range(i + 1)]) for i in range(n)]
+
+
+def test_serial_embedder_preserves_order_and_skips_empty():
+    executor = SerialEmbedder(SlowShortEmbedder())
+    out = list(executor.map_ordered([(0, ["1", "2"]), (1, []), (2, ["3"])]))
+    assert [p for p, _ in out] == [0, 1, 2]
+    assert out[1][1] is None
+    np.testing.assert_array_equal(out[2][1], [[3.0]])
+    assert executor.report()["records"] == 3
+
+
+def test_worker_pool_yields_in_submission_order():
+    pool = EmbeddingWorkerPool(2, threads_per_worker=1, factory=SlowShortEmbedder, pin_cpus=False)
+    try:
+        items = make_items(6)
+        out = list(pool.map_ordered(iter(items)))
+    finally:
+        pool.close()
+
+    assert [p for p, _ in out] == list(range(6))
+    for (payload, texts), (_, embeddings) in zip(items, out):
+        np.testing.assert_array_equal(embeddings[:, 0], [float(t) for t in texts])
+
+    report = pool.report()
+    assert report["records"] == sum(len(t) for _, t in items)
+    assert sum(w["tasks"] for w in report["workers"].values()) == 6
+    assert set(report["workers"]) <= {0, 1}
+
+
+def test_workers_start_with_blas_threads_set(monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    pool = EmbeddingWorkerPool(1, threads_per_worker=3, factory=EnvEmbedder, pin_cpus=False)
+    try:
+        [(_, embeddings)] = list(pool.map_ordered([(0, ["x"])]))
+    finally:
+        pool.close()
+
+    assert embeddings[0, 0] == 3.0
+    assert "OMP_NUM_THREADS" not in os.environ  # the parent's environment is restored
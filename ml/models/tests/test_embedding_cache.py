@@ -0,0 +1,68 @@
+"""Tests for the content-addressed embedding cache."""
+import numpy as np
+
+from ml.models.embedding_cache import EmbeddingCache
+
+
+def vec(seed: int, dim: int = 8) -> np.ndarray:
+    return np.random.RandomState(seed).randn(dim).astype(np.float32)
+
+
+def test_key_depends_on_every_part():
+    base = EmbeddingCache.make_key("codebert", "max_length=512", "a.py", "+x")
+    assert base == EmbeddingCache.make_key("codebert", "max_length=512", "a.py", "+x")
+    assert base != EmbeddingCache.make_key("codebert", "max_length=128", "a.py", "+x")
+    assert base != EmbeddingCache.make_key("other", "max_length=512", "a.py", "+x")
+    assert base != EmbeddingCache.make_key("codebert", "max_length=512", "a.py", "+y")
+    # Part boundaries matter
+    assert EmbeddingCache.make_key("m", "t", "ab", "c") != EmbeddingCache.make_key("m", "t", "a", "bc")
+
+
+def test_hits_misses_and_lru_eviction():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put_many(["a", "b"], np.stack([vec(0), vec(1)]))
+    assert cache.get("a") is not None          # a is now most recent
+    cache.put("c", vec(2))                     # evicts b
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("c"), vec(2))
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = tmp_path / "emb.sqlite"
+    cache = EmbeddingCache(max_entries=10, disk_path=path)
+    cache.put_many(["k1", "k2"], np.stack([vec(1), vec(2)]))
+
+    reopened = EmbeddingCache(max_entries=10, disk_path=path)
+    found = reopened.get_many(["k1", "k2", "k3"])
+    np.testing.assert_array_equal(found[0], vec(1))
+    np.testing.assert_array_equal(found[1], vec(2))
+    assert found[2] is None
+    assert reopened.stats()["disk_hits"] == 2
+    assert len(reopened) == 2  # promoted into memory
+
+
+def test_embedder_only_embeds_misses(monkeypatch):
+    from ml.models.embedder import CodeEmbedder
+
+    calls = []
+
+    def fake_embed(self, texts, batch_size=32, max_tokens=None):
+        calls.append(list(texts))
+        return np.stack([vec(len(t)) for t in texts])
+
+    monkeypatch.setattr(CodeEmbedder, "_embed_uncached", fake_embed)
+    embedder = CodeEmbedder(cache=EmbeddingCache())
+
+    first = embedder.embed(["aa", "bbb"])
+    second = embedder.embed(["bbb", "cccc", "aa"])
+
+    assert calls == [["aa", "bbb"], ["cccc"]]
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[2], first[0])
+    assert embedder.cache.stats()["hits"] == 2
@@ -1,13 +1,23 @@
 """Tests for PRIndex — builds tiny in-memory FAISS index."""
 import numpy as np
 import pytest
+import json
 import tempfile
 import os
 
 # Skip if faiss not installed
 faiss = pytest.importorskip("faiss", reason="faiss-cpu not installed")
 
-from ml.models.index import PRIndex, RetrievalResult
+from ml.models.index import (
+    AppendedMetadata,
+    BatchSearchResult,
+    ColumnarMetadata,
+    PRIndex,
+    RetrievalResult,
+    convert_pickle_metadata,
+    resolve_index_spec,
+    write_columnar_metadata,
+)
 
 
 def make_unit_vectors(n: int, dim: int = 768, seed: int = 42) -> np.ndarray:
@@ -91,7 +101,8 @@ def test_save_and_load():
         index.save(path)
         
         assert os.path.exists(path)
-        assert os.path.exists(path + ".meta")
+        assert os.path.exists(os.path.join(path + ".cols", "schema.json"))
+        assert not os.path.exists(path + ".meta")
         
         index2 = PRIndex(dim=768)
         index2.load(path)
@@ -105,3 +116,434 @@ def test_empty_search_raises():
     index = PRIndex(dim=768)
     with pytest.raises(RuntimeError, match="not built"):
         index.search(np.zeros(768, dtype=np.float32), k=5)
+
+
+def test_search_batch_matches_single_queries():
+    n = 30
+    embeddings = make_unit_vectors(n)
+    index = PRIndex(dim=768)
+    index.build(embeddings, make_metadata(n))
+
+    queries = make_unit_vectors(4, seed=7)
+    batch = index.search_batch(queries, k=5)
+
+    assert isinstance(batch, BatchSearchResult)
+    assert batch.scores.shape == (4, 5)
+    assert batch.ids.shape == (4, 5)
+    assert batch.ids.dtype == np.int64
+    for row, query in enumerate(queries):
+        single = index.search(query, k=5)
+        np.testing.assert_allclose(batch.scores[row], [r.score for r in single], rtol=1e-5)
+        assert [r.filename for r in index.materialize(batch.scores[row], batch.ids[row])] == \
+            [r.filename for r in single]
+
+
+def test_search_batch_clamps_k_to_index_size():
+    embeddings = make_unit_vectors(3)
+    index = PRIndex(dim=768)
+    index.build(embeddings, make_metadata(3))
+
+    batch = index.search_batch(embeddings, k=10)
+    assert batch.ids.shape == (3, 3)
+    assert list(batch.ids[:, 0]) == [0, 1, 2]
+
+
+def test_resolve_index_spec():
+    assert resolve_index_spec("flat", 1000, 768) == "Flat"
+    assert resolve_index_spec("ivf_flat", 10_000, 768) == "IVF256,Flat"
+    assert resolve_index_spec("ivf_pq", 100_000, 768).endswith(",PQ48x8")
+    assert resolve_index_spec("hnsw", 10, 768) == "HNSW32"
+    assert resolve_index_spec("IVF64,PQ16", 10, 768) == "IVF64,PQ16"
+
+
+def test_ivf_flat_with_full_probe_matches_flat():
+    n = 400
+    embeddings = make_unit_vectors(n)
+    metadata = make_metadata(n)
+    flat = PRIndex(dim=768)
+    flat.build(embeddings, metadata)
+    ivf = PRIndex(dim=768, index_spec="ivf_flat")
+    ivf.build(embeddings, metadata)
+    ivf.set_search_params(nprobe=n)  # probe every list → exact
+
+    queries = make_unit_vectors(5, seed=3)
+    np.testing.assert_array_equal(
+        ivf.search_batch(queries, k=5).ids, flat.search_batch(queries, k=5).ids
+    )
+
+
+def test_hnsw_finds_exact_match_and_persists():
+    n = 200
+    embeddings = make_unit_vectors(n)
+    index = PRIndex(dim=768, index_spec="hnsw", ef_search=128)
+    index.build(embeddings, make_metadata(n))
+    assert index.search(embeddings[17], k=1)[0].filename == "src/file_17.py"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "hnsw.faiss")
+        index.save(path)
+        loaded = PRIndex(dim=768)
+        loaded.load(path)
+        assert loaded.size == n
+        assert loaded.search(embeddings[17], k=1)[0].filename == "src/file_17.py"
+
+
+def test_columnar_metadata_round_trip(tmp_path):
+    rows = make_metadata(12)
+    rows[3]["hunk_preview"] = "unicode — ✓ and\nnewlines"
+    write_columnar_metadata(rows, tmp_path / "meta.cols")
+
+    meta = ColumnarMetadata(tmp_path / "meta.cols")
+    assert len(meta) == 12
+    assert meta.schema == {
+        "filename": "str", "importance_score": "float64",
+        "hunk_preview": "str", "pr_id": "int64", "repo": "str",
+    }
+    assert list(meta) == rows
+    assert isinstance(meta[5]["pr_id"], int)
+    assert meta[-1] == rows[-1]
+    with pytest.raises(IndexError):
+        meta[12]
+
+
+def test_columnar_metadata_is_memory_mapped(tmp_path):
+    write_columnar_metadata(make_metadata(5), tmp_path / "meta.cols")
+    meta = ColumnarMetadata(tmp_path / "meta.cols")
+    assert isinstance(meta.column("pr_id"), np.memmap)
+    np.testing.assert_array_equal(meta.column("pr_id"), np.arange(5))
+
+
+def test_load_legacy_pickle_and_convert(tmp_path):
+    import pickle
+
+    n = 8
+    embeddings = make_unit_vectors(n)
+    metadata = make_metadata(n)
+    index = PRIndex(dim=768)
+    index.build(embeddings, metadata)
+    path = tmp_path / "legacy.faiss"
+    faiss.write_index(index._index, str(path))
+    with open(str(path) + ".meta", "wb") as f:
+        pickle.dump(metadata, f)
+
+    legacy = PRIndex(dim=768)
+    legacy.load(str(path))
+    assert legacy.search(embeddings[2], k=1)[0].filename == metadata[2]["filename"]
+
+    out = convert_pickle_metadata(str(path) + ".meta")
+    assert out == tmp_path / "legacy.faiss.cols"
+    converted = PRIndex(dim=768)
+    converted.load(str(path))
+    assert isinstance(converted._metadata, ColumnarMetadata)
+    assert converted.search(embeddings[2], k=1)[0].pr_id == metadata[2]["pr_id"]
+
+
+def test_add_remove_upsert():
+    embeddings = make_unit_vectors(12)
+    metadata = make_metadata(12)
+    keys = [f"test/repo#{i}#src/file_{i}.py" for i in range(12)]
+
+    index = PRIndex(dim=768)
+    index.build(embeddings[:8], metadata[:8], keys[:8])
+    ids = index.add(embeddings[8:], metadata[8:], keys[8:])
+    np.testing.assert_array_equal(ids, np.arange(8, 12))
+    assert index.size == 12
+    assert index.search(embeddings[10], k=1)[0].pr_id == 10
+
+    assert index.remove([10, 3]) == 2
+    assert index.size == 10
+    assert keys[10] not in index.manifest
+    assert index.search(embeddings[10], k=1)[0].pr_id != 10
+
+    # Re-embed key 5 with a new vector and metadata
+    moved = make_unit_vectors(1, seed=7)
+    new_ids = index.upsert(moved, [{**metadata[5], "hunk_preview": "changed"}], [keys[5]], ["d2"])
+    assert index.size == 10
+    assert index.manifest[keys[5]] == (int(new_ids[0]), "d2")
+    top = index.search(moved[0], k=1)[0]
+    assert top.pr_id == 5 and top.hunk_preview == "changed"
+    assert all(r.score < 0.99 for r in index.search(embeddings[5], k=3) if r.pr_id == 5)
+
+
+def test_remove_from_hnsw_rebuilds_graph():
+    embeddings = make_unit_vectors(30)
+    index = PRIndex(dim=768, index_spec="hnsw")
+    index.build(embeddings, make_metadata(30))
+    assert index.remove([4]) == 1
+    assert index.size == 29
+    assert index.search(embeddings[4], k=1)[0].pr_id != 4
+    assert index.search(embeddings[5], k=1)[0].pr_id == 5
+
+
+def test_add_to_legacy_positional_index(tmp_path):
+    embeddings = make_unit_vectors(6)
+    metadata = make_metadata(6)
+    path = tmp_path / "legacy.faiss"
+    flat = faiss.IndexFlatIP(768)
+    flat.add(embeddings[:4])
+    faiss.write_index(flat, str(path))
+    write_columnar_metadata(metadata[:4], str(path) + ".cols")
+
+    index = PRIndex(dim=768)
+    index.load(str(path))
+    index.add(embeddings[4:], metadata[4:])
+    assert index.size == 6
+    assert index.search(embeddings[1], k=1)[0].pr_id == 1
+    assert index.search(embeddings[5], k=1)[0].pr_id == 5
+
+
+def _forbid_row_decoding(monkeypatch):
+    def refuse(*args):
+        raise AssertionError("mapped metadata rows were decoded")
+
+    monkeypatch.setattr(ColumnarMetadata, "__iter__", refuse)
+    monkeypatch.setattr(ColumnarMetadata, "__getitem__", refuse)
+
+
+def test_add_and_save_stream_loaded_metadata(tmp_path, monkeypatch):
+    embeddings = make_unit_vectors(10)
+    metadata = make_metadata(10)
+    path = str(tmp_path / "idx.faiss")
+    index = PRIndex(dim=768)
+    index.build(embeddings[:6], metadata[:6])
+    index.save(path)
+
+    loaded = PRIndex(dim=768)
+    loaded.load(path)
+    _forbid_row_decoding(monkeypatch)
+    loaded.add(embeddings[6:], metadata[6:])
+    assert isinstance(loaded._metadata, AppendedMetadata)
+    loaded.save(path)
+    monkeypatch.undo()
+
+    assert isinstance(loaded._metadata, ColumnarMetadata)
+    assert list(ColumnarMetadata(path + ".cols")) == metadata
+    assert loaded.search(embeddings[8], k=1)[0].pr_id == 8
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["idx.faiss", "idx.faiss.cols"]
+
+
+def test_saved_append_matches_full_rewrite(tmp_path):
+    base = make_metadata(4)
+    write_columnar_metadata(base, tmp_path / "a.cols")
+    extra = [
+        {"filename": "x.py", "importance_score": 1, "pr_id": 2.5, "repo": 7, "hunk_preview": "p"},
+        {"filename": "y.py", "language": "go"},
+    ]
+    meta = AppendedMetadata(ColumnarMetadata(tmp_path / "a.cols"))
+    meta.extend(extra)
+    assert meta[5] == extra[1] and meta[-6] == base[0]
+
+    from ml.models.index import write_metadata
+
+    write_metadata(meta, tmp_path / "streamed.cols")
+    write_columnar_metadata(base + extra, tmp_path / "rewritten.cols")
+    streamed = ColumnarMetadata(tmp_path / "streamed.cols")
+    rewritten = ColumnarMetadata(tmp_path / "rewritten.cols")
+    # New columns, int -> float and numeric -> str widen exactly as a full rewrite would
+    assert streamed.schema == rewritten.schema
+    assert streamed.schema["pr_id"] == "float64" and streamed.schema["repo"] == "str"
+    assert list(streamed) == list(rewritten)
+
+
+def test_writer_close_swaps_directory_in(tmp_path):
+    from ml.models.index import ColumnarMetadataWriter
+
+    rows = make_metadata(5)
+    write_columnar_metadata(rows[:3], tmp_path / "m.cols")
+    old = ColumnarMetadata(tmp_path / "m.cols")
+
+    writer = ColumnarMetadataWriter(tmp_path / "m.cols", old.schema)
+    writer.copy_from(old, chunk_rows=2)
+    writer.extend(rows[3:])
+    writer.close()
+
+    assert list(ColumnarMetadata(tmp_path / "m.cols")) == rows
+    assert list(old) == rows[:3]  # maps of the replaced files stay readable
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["m.cols"]
+
+
+def test_manifest_persists(tmp_path):
+    embeddings = make_unit_vectors(5)
+    index = PRIndex(dim=768)
+    index.build(embeddings, make_metadata(5), [f"k{i}" for i in range(5)], [f"d{i}" for i in range(5)])
+    index.remove([2])
+    path = str(tmp_path / "idx.faiss")
+    index.save(path)
+
+    loaded = PRIndex(dim=768)
+    loaded.load(path)
+    assert loaded.manifest == index.manifest
+    assert "k2" not in loaded.manifest
+    assert loaded.size == 4
+    assert len(loaded._metadata) == 5  # tombstoned row kept until a full build
+
+
+class FakeEmbedder:
+    """Deterministic per-text unit vectors; records every call's batch size."""
+
+    calls: list[int] = []
+    fail_after: int | None = None
+
+    def embed(self, texts, batch_size=32):
+        if FakeEmbedder.fail_after is not None and len(FakeEmbedder.calls) >= FakeEmbedder.fail_after:
+            raise KeyboardInterrupt("simulated crash")
+        FakeEmbedder.calls.append(len(texts))
+        seeds = [int.from_bytes(t.encode()[-4:].rjust(4, b"\0"), "little") % 10_000 for t in texts]
+        return np.stack([make_unit_vectors(1, seed=s)[0] for s in seeds])
+
+
+@pytest.fixture
+def fake_build(monkeypatch, tmp_path):
+    from ml.models import build_index as bi
+
+    FakeEmbedder.calls = []
+    FakeEmbedder.fail_after = None
+    monkeypatch.setattr(bi, "CodeEmbedder", FakeEmbedder)
+
+    def write_records(records):
+        path = tmp_path / "records.jsonl"
+        path.write_text("".join(json.dumps(r) + "\n" for r in records))
+        return str(path)
+
+    return bi, write_records, str(tmp_path / "hunk_index.faiss")
+
+
+def make_records(n, start=0):
+    return [
+        {"repo": "o/r", "pr_id": i, "filename": f"f{i}.py", "patch": f"+line {i}", "importance_score": 0.5}
+        for i in range(start, start + n)
+    ]
+
+
+def test_build_index_incremental_embeds_only_changes(fake_build):
+    bi, write_records, path = fake_build
+    records = make_records(6)
+
+    bi.build_index(index_path=path, records_path=write_records(records))
+    assert FakeEmbedder.calls == [6]
+
+    records[2]["patch"] = "+changed"
+    records.append({"repo": "o/r", "pr_id": 9, "filename": "new.py", "patch": "+new"})
+    index = bi.build_index(index_path=path, records_path=write_records(records), incremental=True)
+    assert FakeEmbedder.calls == [6, 2]
+    assert index.size == 7
+
+    records.pop(0)
+    index = bi.build_index(index_path=path, records_path=write_records(records), incremental=True, prune=True)
+    assert FakeEmbedder.calls == [6, 2]
+    assert index.size == 6
+    assert bi.record_key({"repo": "o/r", "pr_id": 0, "filename": "f0.py"}) not in index.manifest
+
+
+def test_incremental_hnsw_update_removes_once(fake_build, monkeypatch):
+    bi, write_records, path = fake_build
+    records = make_records(12)
+    bi.build_index(index_path=path, records_path=write_records(records), index_spec="hnsw", chunk_size=3)
+
+    for i in (1, 5, 10):  # changes spread over three chunks
+        records[i]["patch"] = f"+changed {i}"
+    removals = []
+    original_remove = PRIndex.remove
+
+    def remove(self, ids):
+        removals.append(sorted(ids))
+        return original_remove(self, ids)
+
+    monkeypatch.setattr(PRIndex, "remove", remove)
+    index = bi.build_index(index_path=path, records_path=write_records(records), index_spec="hnsw",
+                           incremental=True, prune=True, chunk_size=3)
+
+    assert removals == [[1, 5, 10]]
+    assert index.size == 12
+    loaded = PRIndex(dim=768)
+    loaded.load(path)
+    changed = FakeEmbedder().embed([bi.format_hunk_text(records[5])])[0]
+    top = loaded.search(changed, k=1)[0]
+    assert top.pr_id == 5 and top.score > 0.99
+    assert sorted(v[0] for v in loaded.manifest.values()) == [0, 2, 3, 4, 6, 7, 8, 9, 11, 12, 13, 14]
+
+
+def test_incremental_update_keeps_metadata_columnar(fake_build, monkeypatch):
+    bi, write_records, path = fake_build
+    records = make_records(6)
+    bi.build_index(index_path=path, records_path=write_records(records))
+
+    records[1]["patch"] = "+changed"
+    records += make_records(2, start=6)
+    added = []
+    original_add = PRIndex.add
+
+    def add(self, *args, **kwargs):
+        ids = original_add(self, *args, **kwargs)
+        added.append(type(self._metadata))
+        return ids
+
+    monkeypatch.setattr(PRIndex, "add", add)
+    _forbid_row_decoding(monkeypatch)
+    bi.build_index(index_path=path, records_path=write_records(records), incremental=True)
+    monkeypatch.undo()
+
+    # An add on the loaded index never turned _metadata into a list
+    assert added == [AppendedMetadata]
+    rows = list(ColumnarMetadata(path + ".cols"))
+    assert [row["pr_id"] for row in rows] == [0, 1, 2, 3, 4, 5, 1, 6, 7]
+
+
+def test_streaming_build_matches_records(fake_build):
+    bi, write_records, path = fake_build
+    records = make_records(23)
+
+    index = bi.build_index(index_path=path, records_path=write_records(records), chunk_size=5)
+    assert FakeEmbedder.calls == [5, 5, 5, 5, 3]
+    assert index.size == 23
+    assert isinstance(index._metadata, ColumnarMetadata)
+    assert [row["pr_id"] for row in index._metadata] == list(range(23))
+    assert len(index.manifest) == 23
+    query = FakeEmbedder().embed([bi.format_hunk_text(records[17])])[0]
+    assert index.search(query, k=1)[0].pr_id == 17
+    assert not os.path.exists(path + ".checkpoint.json")
+    assert not os.path.exists(path + ".cols.partial")
+
+
+def test_streaming_build_resumes_after_crash(fake_build):
+    bi, write_records, path = fake_build
+    records_path = write_records(make_records(20))
+
+    FakeEmbedder.fail_after = 3
+    with pytest.raises(KeyboardInterrupt):
+        bi.build_index(index_path=path, records_path=records_path, chunk_size=4, checkpoint_every=2)
+    assert json.loads(open(path + ".checkpoint.json").read())["records_done"] == 8
+
+    FakeEmbedder.fail_after = None
+    FakeEmbedder.calls = []
+    index = bi.build_index(index_path=path, records_path=records_path, chunk_size=4, checkpoint_every=2)
+    # Chunk 3 was embedded before the crash but never checkpointed, so it is redone
+    assert FakeEmbedder.calls == [4, 4, 4]
+    assert index.size == 20
+    assert [row["pr_id"] for row in index._metadata] == list(range(20))
+    assert sorted(v[0] for v in index.manifest.values()) == list(range(20))
+
+
+def test_streaming_build_trains_ivf_on_buffered_chunks(fake_build):
+    bi, write_records, path = fake_build
+    index = bi.build_index(index_path=path, records_path=write_records(make_records(120)),
+                           chunk_size=50, index_spec="ivf_flat", nprobe=64)
+    assert index.size == 120
+    assert [row["pr_id"] for row in index._metadata] == list(range(120))
+
+
+def test_build_with_workers_matches_serial_build(fake_build, tmp_path):
+    bi, write_records, path = fake_build
+    records_path = write_records(make_records(30))
+
+    serial = bi.build_index(index_path=path, records_path=records_path, chunk_size=4)
+    parallel_path = str(tmp_path / "parallel.faiss")
+    parallel = bi.build_index(index_path=parallel_path, records_path=records_path,
+                              chunk_size=4, workers=2, threads_per_worker=1)
+
+    assert list(parallel._metadata) == list(serial._metadata)
+    assert parallel.manifest == serial.manifest
+    np.testing.assert_array_equal(
+        np.vstack([parallel._index.reconstruct(i) for i in range(30)]),
+        np.vstack([serial._index.reconstruct(i) for i in range(30)]),
+    )
@@ -0,0 +1,94 @@
+"""Tests for the shared, cached tokenization layer (pure python, fake tokenizer)."""
+import numpy as np
+import pytest
+
+from ml.models.tokenization import SharedTokenizer, VocabularyMismatchError, check_vocab_compatible
+
+
+class FakeBPETokenizer:
+    """Whitespace "BPE" with RoBERTa-style <s> ... </s> framing and a fixed vocab."""
+
+    bos_token_id = cls_token_id = 0
+    pad_token_id = 1
+    eos_token_id = sep_token_id = 2
+    unk_token_id = 3
+    mask_token_id = 4
+
+    def __init__(self, words=("<file>", "src/a.py", "+x", "+y", "def", "return"), char_level=False):
+        self.vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "<unk>": 3, "<mask>": 4}
+        for w in words:
+            self.vocab.setdefault(w, len(self.vocab))
+        self.char_level = char_level  # stands in for different merges over the same vocab
+        self.calls = 0
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def get_vocab(self):
+        return dict(self.vocab)
+
+    def __call__(self, texts, truncation=True, max_length=512, **_):
+        single = isinstance(texts, str)
+        self.calls += 1
+        rows = []
+        for text in [texts] if single else texts:
+            pieces = list(text) if self.char_level else text.split()
+            body = [self.vocab.get(w, self.unk_token_id) for w in pieces]
+            if truncation:
+                body = body[: max_length - 2]
+            rows.append([self.bos_token_id] + body + [self.eos_token_id])
+        return {"input_ids": rows[0] if single else rows}
+
+
+def test_encode_tokenizes_each_distinct_text_once():
+    fake = FakeBPETokenizer()
+    tok = SharedTokenizer(fake)
+    first = tok.encode(["<file> src/a.py +x", "def return"])
+    assert fake.calls == 1
+    again = tok.encode(["def return", "<file> src/a.py +x"])
+    assert fake.calls == 1
+    assert again == first[::-1]
+    assert tok.stats()["hits"] == 2 and tok.stats()["misses"] == 2
+
+
+def test_call_matches_direct_tokenizer_padding_and_truncation():
+    fake = FakeBPETokenizer()
+    tok = SharedTokenizer(fake, max_length=512)
+    texts = ["+x " * 20, "def", "<file> src/a.py " + "+y " * 200]
+
+    out = tok(texts, max_length=8)
+    direct = fake(texts, truncation=True, max_length=8)["input_ids"]
+    width = max(len(r) for r in direct)
+    assert out["input_ids"].shape == (3, width)
+    for row, ids, mask in zip(direct, out["input_ids"], out["attention_mask"]):
+        assert ids[: len(row)].tolist() == row
+        assert (ids[len(row):] == fake.pad_token_id).all()
+        assert mask.sum() == len(row)
+    assert out["input_ids"].dtype == np.int64
+
+
+def test_cache_is_bounded():
+    tok = SharedTokenizer(FakeBPETokenizer(), cache_size=2)
+    tok.encode(["a", "b", "c"])
+    assert tok.stats()["entries"] == 2
+
+
+def test_identical_tokenizers_are_compatible():
+    check_vocab_compatible(FakeBPETokenizer(), FakeBPETokenizer())
+
+
+def test_vocab_size_mismatch_is_rejected():
+    with pytest.raises(VocabularyMismatchError, match="vocab sizes"):
+        check_vocab_compatible(FakeBPETokenizer(), FakeBPETokenizer(words=("def",)))
+
+
+def test_special_token_mismatch_is_rejected():
+    other = FakeBPETokenizer()
+    other.pad_token_id = 0
+    with pytest.raises(VocabularyMismatchError, match="pad_token_id"):
+        check_vocab_compatible(FakeBPETokenizer(), other)
+
+
+def test_same_vocab_different_encoding_is_rejected():
+    with pytest.raises(VocabularyMismatchError, match="probe text"):
+        check_vocab_compatible(FakeBPETokenizer(), FakeBPETokenizer(char_level=True))
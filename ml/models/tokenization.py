@@ -0,0 +1,135 @@
+"""
+Shared, cached tokenization for RoBERTa-family models.
+
+CodeBERT and the distilRoBERTa reranker use the same byte-level BPE vocabulary,
+so one set of token ids can feed both. ``SharedTokenizer`` encodes each text
+once at the tokenizer's full length, caches the ids under a content hash and
+pads/truncates per model at batch time. ``check_vocab_compatible`` is the
+load-time guard that decides whether two models may share it.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Sequence
+
+import numpy as np
+import structlog
+
+log = structlog.get_logger()
+
+_SPECIAL_TOKENS = ("bos_token_id", "eos_token_id", "pad_token_id", "unk_token_id",
+                   "cls_token_id", "sep_token_id", "mask_token_id")
+_PROBE_TEXTS = (
+    "<file>src/auth/token.py\n+    token = jwt.encode(payload, secret)",
+    "def __init__(self):\n\treturn {'ключ': 42}  # naïve ✓",
+)
+
+
+class VocabularyMismatchError(ValueError):
+    """Two tokenizers would map the same text to different ids."""
+
+
+def check_vocab_compatible(a: Any, b: Any) -> None:
+    """Raise ``VocabularyMismatchError`` unless ``a`` and ``b`` tokenize identically.
+
+    Compares vocabulary size and contents, special-token ids and the encoding of
+    a few probe strings (which catches differing BPE merges over one vocab).
+    """
+    if len(a) != len(b):
+        raise VocabularyMismatchError(f"vocab sizes differ: {len(a)} != {len(b)}")
+    for attr in _SPECIAL_TOKENS:
+        if getattr(a, attr, None) != getattr(b, attr, None):
+            raise VocabularyMismatchError(
+                f"{attr} differs: {getattr(a, attr, None)} != {getattr(b, attr, None)}"
+            )
+    if a.get_vocab() != b.get_vocab():
+        raise VocabularyMismatchError("vocabularies have the same size but different entries")
+    for text in _PROBE_TEXTS:
+        if a(text)["input_ids"] != b(text)["input_ids"]:
+            raise VocabularyMismatchError(f"probe text tokenizes differently: {text!r}")
+
+
+class SharedTokenizer:
+    """Tokenize once per distinct text; pad and truncate per consuming model.
+
+    ``encode`` returns ids capped at ``max_length`` (the longest any consumer
+    needs) from an LRU keyed by a SHA-256 of the text.
+    ``__call__`` mirrors ``tokenizer(texts, padding=True, truncation=True,
+    max_length=...)`` for single sequences: rows longer than the model's limit
+    keep their leading tokens plus the closing special token.
+    """
+
+    def __init__(self, tokenizer: Any, max_length: int = 512, cache_size: int = 50_000):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.pad_token_id = tokenizer.pad_token_id
+        self._cache: OrderedDict[str, list[int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def content_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def encode(self, texts: Sequence[str]) -> list[list[int]]:
+        """Token ids per text; only cache misses reach the underlying tokenizer."""
+        keys = [self.content_key(t) for t in texts]
+        ids: list[list[int] | None] = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    ids[i] = cached
+            missing = [i for i, row in enumerate(ids) if row is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            fresh = self.tokenizer(
+                [texts[i] for i in missing], truncation=True, max_length=self.max_length
+            )["input_ids"]
+            with self._lock:
+                for i, row in zip(missing, fresh):
+                    row = list(row)
+                    ids[i] = row
+                    self._cache[keys[i]] = row
+                    self._cache.move_to_end(keys[i])
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return ids  # type: ignore[return-value]
+
+    def pad(self, ids: Sequence[list[int]], max_length: int | None = None,
+            return_tensors: str = "np") -> dict:
+        """Right-pad (and truncate to ``max_length``) into ``input_ids`` / ``attention_mask``."""
+        limit = max_length or self.max_length
+        rows = [row if len(row) <= limit else row[: limit - 1] + row[-1:] for row in ids]
+        width = max((len(r) for r in rows), default=0)
+        input_ids = np.full((len(rows), width), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, : len(row)] = row
+            attention_mask[i, : len(row)] = 1
+        if return_tensors == "pt":
+            import torch
+            return {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def __call__(self, texts: Sequence[str], max_length: int | None = None,
+                 return_tensors: str = "np") -> dict:
+        return self.pad(self.encode(texts), max_length, return_tensors)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
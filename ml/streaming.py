@@ -0,0 +1,60 @@
+"""
+NDJSON / Server-Sent Events framing for streamed ranking responses.
+
+Both APIs stream the same event dicts (``{"event": "heuristic" | "refined" |
+"final" | "error", ...}``). ``StreamEncoder`` picks the wire format, frames
+each event and records time-to-first-result — from handler entry to the
+first event leaving the server — in the ``time_to_first_result_ms`` histogram.
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from .telemetry import Telemetry, get_telemetry
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def negotiate_stream_format(accept: str | None = None, requested: str | None = None) -> str:
+    """``requested`` (``?format=``) wins; else SSE if the client accepts it; else NDJSON."""
+    if requested:
+        if requested not in STREAM_FORMATS:
+            raise ValueError(f"unknown stream format {requested!r}; expected one of {sorted(STREAM_FORMATS)}")
+        return requested
+    if accept and "text/event-stream" in accept:
+        return "sse"
+    return "ndjson"
+
+
+class StreamEncoder:
+    """Frames event dicts for one response and times its first event."""
+
+    def __init__(self, fmt: str, endpoint: str, telemetry: Telemetry | None = None):
+        self.fmt = fmt
+        self.endpoint = endpoint
+        self.media_type = STREAM_FORMATS[fmt]
+        self.telemetry = telemetry or get_telemetry()
+        self.t0 = time.perf_counter()
+        self.first_result_ms: float | None = None
+
+    def encode(self, event: dict) -> str:
+        if self.first_result_ms is None:
+            self.first_result_ms = round((time.perf_counter() - self.t0) * 1000, 2)
+            self.telemetry.observe(
+                "time_to_first_result_ms", self.first_result_ms,
+                help="Time from request to the first streamed event.", endpoint=self.endpoint,
+            )
+        data = json.dumps(event, separators=(",", ":"))
+        if self.fmt == "sse":
+            return f"event: {event.get('event', 'message')}\ndata: {data}\n\n"
+        return data + "\n"
+
+    def wrap(self, events: Iterable[dict]) -> Iterator[str]:
+        for event in events:
+            yield self.encode(event)
+
+    async def wrap_async(self, events: AsyncIterable[dict]) -> AsyncIterator[str]:
+        async for event in events:
+            yield self.encode(event)
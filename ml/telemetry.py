@@ -0,0 +1,242 @@
+"""
+Request/stage latency histograms with Prometheus text exposition.
+
+Shared by both APIs (``apps/api`` imports it from the repo, the HF Space from
+its vendored ``ml/``). Instrument a block with the ``timed`` context manager:
+
+    with timed("faiss_search", endpoint="retrieve") as t:
+        hits = index.search_batch(queries, k)
+    timings["retrieve"] = t.ms
+
+Every timer feeds the ``stage_latency_ms`` histogram labelled with its stage
+(and any extra labels); ``observe`` / ``set_gauge`` cover batch sizes and
+model load times. ``render_prometheus()`` emits text format 0.0.4.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable
+
+METRIC_PREFIX = "assert_review"
+
+LATENCY_BUCKETS_MS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+_Labels = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: _Labels, extra: _Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    """Thread-safe fixed-bucket histogram (cumulative counts, Prometheus-style)."""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def _cumulative(self) -> tuple[list[tuple[float, int]], int, float]:
+        with self._lock:
+            cumulative, running = [], 0
+            for bound, n in zip(self.buckets + [math.inf], self._counts):
+                running += n
+                cumulative.append((bound, running))
+            return cumulative, self._count, self._sum
+
+    def snapshot(self) -> dict:
+        cumulative, count, total = self._cumulative()
+        return {
+            "buckets": {("+Inf" if b == math.inf else f"{b:g}"): n for b, n in cumulative},
+            "count": count,
+            "sum": round(total, 3),
+        }
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile by linear interpolation inside the matching bucket."""
+        cumulative, count, _ = self._cumulative()
+        if not count:
+            return 0.0
+        rank = q * count
+        lower, below = 0.0, 0
+        for bound, running in cumulative:
+            if running >= rank:
+                if bound == math.inf:
+                    return lower
+                in_bucket = running - below
+                return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 0.0)
+            lower, below = bound, running
+        return lower
+
+
+class _Timer:
+    """Context manager returned by ``Telemetry.timer``; ``ms`` is set on exit."""
+
+    __slots__ = ("_hist", "_t0", "ms")
+
+    def __init__(self, hist: Histogram):
+        self._hist = hist
+        self.ms = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.ms = round((time.perf_counter() - self._t0) * 1000, 2)
+        self._hist.observe(self.ms)
+
+
+class Telemetry:
+    """Named, labelled histograms, counters and gauges for one process."""
+
+    def __init__(self, prefix: str = METRIC_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[_Labels, Histogram]] = {}
+        self._counters: dict[str, dict[_Labels, float]] = {}
+        self._gauges: dict[str, dict[_Labels, float]] = {}
+        self._help: dict[str, str] = {}
+
+    def histogram(self, name: str, buckets: Iterable[float] = LATENCY_BUCKETS_MS,
+                  help: str = "", **labels) -> Histogram:
+        """Get or create the histogram for ``name`` + ``labels``."""
+        key = _label_key(labels)
+        series = self._histograms.get(name)
+        if series is not None and key in series:
+            return series[key]
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if help:
+                self._help.setdefault(name, help)
+            if key not in series:
+                series[key] = Histogram(buckets)
+            return series[key]
+
+    def timer(self, stage: str, **labels) -> _Timer:
+        """Time a block into ``stage_latency_ms{stage=...}``."""
+        return _Timer(self.histogram(
+            "stage_latency_ms", help="Latency of one pipeline stage in milliseconds.",
+            stage=stage, **labels,
+        ))
+
+    def observe(self, name: str, value: float, buckets: Iterable[float] = LATENCY_BUCKETS_MS,
+                help: str = "", **labels) -> None:
+        self.histogram(name, buckets, help, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, help: str = "", **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+            if help:
+                self._help.setdefault(name, help)
+
+    def set_gauge(self, name: str, value: float, help: str = "", **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = float(value)
+            if help:
+                self._help.setdefault(name, help)
+
+    def _series(self, name: str) -> list[tuple[str, Histogram]]:
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+        return [(",".join(f"{k}={v}" for k, v in key) or "_", hist) for key, hist in sorted(series.items())]
+
+    def snapshot(self) -> dict:
+        """JSON-friendly view: ``{name: {"stage=embed,...": snapshot}}``."""
+        with self._lock:
+            names = sorted(self._histograms)
+        return {name: {key: hist.snapshot() for key, hist in self._series(name)} for name in names}
+
+    def summary(self, name: str, quantiles: Iterable[int] = (50, 95, 99)) -> dict:
+        """``{label_key: {"count", "p50", ...}}`` for histogram ``name`` (bucket-interpolated)."""
+        return {
+            key: {"count": hist.snapshot()["count"],
+                  **{f"p{q}": round(hist.quantile(q / 100), 2) for q in quantiles}}
+            for key, hist in self._series(name)
+        }
+
+    def render_prometheus(self) -> str:
+        """All series in Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            help_text = dict(self._help)
+
+        lines: list[str] = []
+
+        def header(name: str, full: str, kind: str) -> None:
+            if name in help_text:
+                lines.append(f"# HELP {full} {help_text[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+
+        for name, series in sorted(histograms.items()):
+            full = f"{self.prefix}_{name}"
+            header(name, full, "histogram")
+            for key, hist in sorted(series.items()):
+                cumulative, count, total = hist._cumulative()
+                for bound, running in cumulative:
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{full}_bucket{_format_labels(key, (('le', le),))} {running}")
+                lines.append(f"{full}_sum{_format_labels(key)} {total:g}")
+                lines.append(f"{full}_count{_format_labels(key)} {count}")
+
+        for kind, metrics in (("counter", counters), ("gauge", gauges)):
+            for name, series in sorted(metrics.items()):
+                full = f"{self.prefix}_{name}"
+                header(name, full, kind)
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full}{_format_labels(key)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._help.clear()
+
+
+_telemetry: Telemetry | None = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """Process-wide telemetry registry."""
+    global _telemetry
+    if _telemetry is None:
+        with _telemetry_lock:
+            if _telemetry is None:
+                _telemetry = Telemetry()
+    return _telemetry
+
+
+def timed(stage: str, **labels) -> _Timer:
+    """``get_telemetry().timer(stage, **labels)``."""
+    return get_telemetry().timer(stage, **labels)
@@ -0,0 +1,34 @@
+"""Tests for the model-free file importance features."""
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from ml.heuristics import file_features
+
+
+def test_security_path_outranks_docs_and_tests():
+    names = ["src/auth/jwt.py", "docs/guide.md", "src/auth/test_jwt.py"]
+    features = file_features(names, [10, 10, 10], [0, 0, 0], 30)
+
+    assert features["security"].tolist() == [1.0, 0.0, 1.0]
+    assert features["path"].tolist() == [0.9, 0.2, 0.9]
+    score = features["score"]
+    assert score[0] > score[2] > score[1]
+    # Same features, test files damped by 0.7
+    assert score[2] == pytest.approx(0.7 * score[0])
+
+
+def test_small_config_edit_is_halved():
+    features = file_features(["settings.json", "settings.json"], [5, 60], [0, 0], 0)
+    assert features["size"].tolist() == [0.5, 0.5]  # nothing to share when total is 0
+    assert features["score"][0] == pytest.approx(0.5 * features["score"][1])
+
+
+def test_size_follows_share_of_churn():
+    features = file_features(["a.py", "b.py"], [90, 5], [0, 5], 100)
+    assert features["size"][0] > 0.9 > 0.5 > features["size"][1]
@@ -0,0 +1,99 @@
+"""Tests for on-demand tracemalloc windows and cheap memory stats."""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from ml.memory import MemoryProfiler, memory_stats
+
+
+@pytest.fixture
+def profiler():
+    p = MemoryProfiler()
+    yield p
+    p.stop()
+
+
+def test_memory_stats_does_not_start_tracing():
+    stats = memory_stats()
+    assert stats["rss_mb"] > 0
+    assert stats["peak_rss_mb"] >= stats["rss_mb"] * 0.5
+    assert not tracemalloc.is_tracing()
+
+
+def test_requests_outside_window_are_not_traced(profiler):
+    assert profiler.begin_request("/rank") is None
+    assert not tracemalloc.is_tracing()
+
+
+def test_window_attributes_allocations_to_endpoint(profiler):
+    profiler.start(duration_s=10)
+    assert tracemalloc.is_tracing()
+
+    before = profiler.begin_request("/rank")
+    kept = [bytearray(64 * 1024) for _ in range(16)]  # ~1 MB held across the snapshot
+    profiler.end_request(before, "/rank")
+
+    report = profiler.report()
+    assert report["active"] is True
+    rank = report["endpoints"]["/rank"]
+    assert rank["requests"] == 1
+    top = rank["top_sites"][0]
+    assert "test_memory.py" in top["site"]
+    assert top["size_kb"] >= 1000
+    del kept
+
+
+def test_window_closes_after_request_budget(profiler):
+    profiler.start(duration_s=10, max_requests=2, endpoints=["/rank"])
+    assert profiler.begin_request("/health") is None
+    for _ in range(2):
+        profiler.end_request(profiler.begin_request("/rank"), "/rank")
+
+    assert not profiler.active
+    assert not tracemalloc.is_tracing()
+    report = profiler.report()
+    assert report["window"]["traced_requests"] == 2
+    assert report["endpoints"]["/rank"]["requests"] == 2
+
+
+def test_window_closes_after_duration(profiler):
+    profiler.start(duration_s=0.05)
+    with pytest.raises(RuntimeError):
+        profiler.start(duration_s=1)
+    deadline = time.time() + 2
+    while profiler.active and time.time() < deadline:
+        time.sleep(0.01)
+    assert not profiler.active
+    assert not tracemalloc.is_tracing()
+
+
+def test_window_duration_is_capped():
+    profiler = MemoryProfiler(max_window_s=1)
+    try:
+        assert profiler.start(duration_s=3600)["window"]["duration_s"] == 1
+    finally:
+        profiler.stop()
+
+
+def test_window_leaves_external_tracing_running():
+    tracemalloc.start()
+    try:
+        profiler = MemoryProfiler()
+        profiler.start(duration_s=30)
+        before = profiler.begin_request("/rank")
+        profiler.end_request(before, "/rank")
+        profiler.stop()
+        assert tracemalloc.is_tracing()  # started outside the profiler, so not ours to stop
+    finally:
+        tracemalloc.stop()
+
+    profiler.start(duration_s=30)
+    profiler.stop()
+    assert not tracemalloc.is_tracing()
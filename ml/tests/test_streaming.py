@@ -0,0 +1,66 @@
+"""Tests for NDJSON/SSE stream framing and time-to-first-result tracking."""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from ml.streaming import StreamEncoder, negotiate_stream_format
+from ml.telemetry import Telemetry
+
+
+def test_negotiate_prefers_explicit_format():
+    assert negotiate_stream_format("text/event-stream", "ndjson") == "ndjson"
+    assert negotiate_stream_format("text/event-stream, */*", None) == "sse"
+    assert negotiate_stream_format("application/json", None) == "ndjson"
+    assert negotiate_stream_format(None, None) == "ndjson"
+
+
+def test_negotiate_rejects_unknown_format():
+    with pytest.raises(ValueError, match="unknown stream format"):
+        negotiate_stream_format(None, "xml")
+
+
+def test_ndjson_frames_one_event_per_line():
+    encoder = StreamEncoder("ndjson", "rank_stream", Telemetry())
+    body = "".join(encoder.wrap([{"event": "heuristic", "n": 1}, {"event": "final", "n": 2}]))
+
+    assert encoder.media_type == "application/x-ndjson"
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {"event": "heuristic", "n": 1}, {"event": "final", "n": 2},
+    ]
+
+
+def test_sse_frames_named_events():
+    encoder = StreamEncoder("sse", "rank_stream", Telemetry())
+    frame = encoder.encode({"event": "refined", "batch": 0})
+
+    assert encoder.media_type == "text/event-stream"
+    assert frame.startswith("event: refined\ndata: ")
+    assert frame.endswith("\n\n")
+    assert json.loads(frame.split("data: ", 1)[1]) == {"event": "refined", "batch": 0}
+
+
+def test_time_to_first_result_recorded_once():
+    telemetry = Telemetry()
+    encoder = StreamEncoder("ndjson", "rank_stream", telemetry)
+    list(encoder.wrap([{"event": "heuristic"}, {"event": "refined"}, {"event": "final"}]))
+
+    series = telemetry.snapshot()["time_to_first_result_ms"]
+    assert series["endpoint=rank_stream"]["count"] == 1
+    assert encoder.first_result_ms is not None
+
+
+@pytest.mark.asyncio
+async def test_wrap_async():
+    async def events():
+        yield {"event": "heuristic"}
+        yield {"event": "final"}
+
+    encoder = StreamEncoder("ndjson", "rank_hunks_stream", Telemetry())
+    lines = [line async for line in encoder.wrap_async(events())]
+    assert [json.loads(line)["event"] for line in lines] == ["heuristic", "final"]
@@ -0,0 +1,52 @@
+"""Tests for the shared latency histograms and Prometheus rendering."""
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from ml.telemetry import Histogram, Telemetry
+
+
+def test_histogram_cumulative_buckets_and_quantile():
+    hist = Histogram([1, 10, 100])
+    for value in [0.5, 5, 5, 50, 500]:
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap["buckets"] == {"1": 1, "10": 3, "100": 4, "+Inf": 5}
+    assert snap["count"] == 5
+    assert snap["sum"] == 560.5
+    # Median falls in (1, 10]: 2.5th of 5 observations, 1.5 into a 2-wide bucket
+    assert 1 < hist.quantile(0.5) <= 10
+
+
+def test_timer_records_stage_and_exposes_ms():
+    telemetry = Telemetry()
+    with telemetry.timer("embed", endpoint="analyze") as t:
+        time.sleep(0.002)
+    assert t.ms >= 2
+    summary = telemetry.summary("stage_latency_ms")
+    assert summary["endpoint=analyze,stage=embed"]["count"] == 1
+
+
+def test_render_prometheus_text_format():
+    telemetry = Telemetry(prefix="test")
+    telemetry.observe("batch_size", 3, [1, 4], help="Texts per forward pass.", model="codebert")
+    telemetry.inc("requests_total", endpoint="/rank", status=200)
+    telemetry.inc("requests_total", endpoint="/rank", status=200)
+    telemetry.set_gauge("model_load_seconds", 1.5, component='say "hi"')
+
+    text = telemetry.render_prometheus()
+    lines = text.splitlines()
+    assert "# HELP test_batch_size Texts per forward pass." in lines
+    assert "# TYPE test_batch_size histogram" in lines
+    assert 'test_batch_size_bucket{model="codebert",le="1"} 0' in lines
+    assert 'test_batch_size_bucket{model="codebert",le="4"} 1' in lines
+    assert 'test_batch_size_bucket{model="codebert",le="+Inf"} 1' in lines
+    assert 'test_batch_size_count{model="codebert"} 1' in lines
+    assert "# TYPE test_requests_total counter" in lines
+    assert 'test_requests_total{endpoint="/rank",status="200"} 2' in lines
+    assert 'test_model_load_seconds{component="say \\"hi\\""} 1.5' in lines
+    assert text.endswith("\n")